@@ -3,25 +3,36 @@
 """
 This code sets for all intervalls which are outside of a angle interval microphonedata to 0
 As a result, the script always only calculates the sound volume maps for angles within the angle interval
+The csms of all angle intervals are calculated in one pass over the microphonedata (see SectorPowerSpectra)
 The trigger data is for this script inside the same file with the microphonedata
 """
 # ------------------------------- Imports -------------------------------
 from os import path, getcwd, environ
 
 environ["QT_API"] = "pyqt5"
+# numbas tbb threading layer lets the script hang at its end, if worker processes were forked (nrWorkers > 1)
+environ.setdefault("NUMBA_THREADING_LAYER", "workqueue")
 
 import time as t
 from math import pi, sqrt
 
-from acoular import config, PowerSpectra, SteeringVector, BeamformerBase, MicGeom, RectGrid, __file__, RotatingFlow, \
-    GeneralFlowEnvironment, MaskedTimeSamples
-from acoular.tprocess import Trigger, AngleTracker, SpatialInterpolatorRotation
+from acoular import config, SteeringVector, BeamformerBase, MicGeom, RectGrid, __file__, RotatingFlow, \
+    MaskedTimeSamples
+from acoular.tprocess import SpatialInterpolatorRotation
 
-from numpy import save, array
+from numpy import array
 
-from B_Acoular_SourceAndTprocess import SpatialInterpolatorRotationZeroing, ZeroedMaskedTimeSamples
-from C_FilterFunctionality import getIntervallsByDegreeOverlapping, invertIntervalls, plotMaps, integrateSources,\
-    averageAndMinimum
+from B_Acoular_Beamformer import AdaptiveBeamformer
+from B_Acoular_Environments import CachedGeneralFlowEnvironment
+from B_Acoular_Grids import SectorGrid
+from B_Acoular_SourceAndTprocess import ZeroedMaskedTimeSamples, CachedAngleTracker, TrackerChannelTrigger
+from B_Acoular_Spectra import SectorPowerSpectra, BandPowerSpectra, StoredSectorPowerSpectra
+from C_FilterFunctionality import getIntervallsByDegreeOverlapping, plotMaps, integrateSources, averageAndMinimum, \
+    averageAndMinimumBands, thirdOctaveBands, bandLimits
+from C_Instrumentation import enable, stage, printSummary
+from C_MapStack import MapStack, gridMetadata
+from C_ParallelSectors import calcSectorMapsParallel
+from C_SectorCsmStore import SectorCsmStore
 
 # ------------------------------- Initialize and set variables -------------------------------
 
@@ -46,11 +57,30 @@ print(f"Z= {Z}m!!")
 radius = 0.8                    # radius of the map in m
 g = RectGrid(x_min=-radius, x_max=radius, y_min=-radius, y_max=radius, z=Z, increment=inc)
 sectors = [[0.3, 0.3, 0.1]]     # [a,b,c], a=[x0,y0,r0], b=... areas over which the sound volume will get integrated
+sectorsOnly = False     # True: only the grid points inside of the sectors are beamformed (see SectorGrid). The
+                        # maps only hold these points, instead of plotting them the sector levels are calculated
+beamGrid = SectorGrid(grid=g, sectors=sectors) if sectorsOnly else g     # grid of the maps
+coarseStep = 0          # >1: the maps are beamformed coarse to fine (see AdaptiveBeamformer), first every
+                        # coarseStep-th grid point, then only the regions within refineRange of the maximum
+refineRange = 10        # level range in dB below the maximum of the coarse map, which is beamformed on the full grid
 
 # ------ Sound source analysis
 bSize = 1024        # block size for calculating the csm (should be a power of 2)
 freq = 1500         # frequency of interest
+freqs = [freq]      # all frequencies of interest. The csms and the beamforming are calculated once for all of them,
+                    # there are maps (and Average, Min, Standing) for each
+thirdOctaves = None     # [fmin, fmax]: freqs = thirdOctaveBands(fmin, fmax), e.g. [500, 8000]
+if thirdOctaves:
+    freqs = thirdOctaveBands(*thirdOctaves)
 bandwidth = 3       # bandwidth (0 = single frequency line, 3= third octave band)
+nrWorkers = 1       # >1: the intervalls are calculated by that many processes (see C_ParallelSectors)
+nrFineSectors = 0   # >0: the spectra of that many sectors of every revolution (e.g. 360 -> 1°) are stored once in
+                    # mapFolder (see SectorCsmStore). Afterwards nrIntervalls (must be a divisor of nrFineSectors) and
+                    # revolutions can be changed without reading the microphonedata again. nrWorkers isn't used then
+revolutions = []    # revolutions which are used for the maps, [] = all. Only with nrFineSectors > 0
+instrumentationLog = None   # json lines file for the times and counters (bytes read, zeroed blocks, FFTs) of the
+                            # stages, e.g. path.join(mapFolder, 'stages.jsonl'), see C_Instrumentation. None = off
+profileStages = []          # stages which are run with cProfile, e.g. ['sector_csm']
 
 temp = 16.9            # room temperature during measurement
 c0 = sqrt(1.4 * 8.314462 * (273.15 + temp) / 0.02896)
@@ -64,6 +94,9 @@ if useCorrectionFactor:
     print("Maps are gonna be multiplied with the factor nrIntervalls! If you dont want that set 'useCorrectionFactor'"
           " to False")
 
+if instrumentationLog or profileStages:
+    enable(instrumentationLog, profileStages)
+
 # ------ Microphone, Trigger, Generators
 mg = MicGeom(from_file=micgeofile)
 
@@ -80,11 +113,19 @@ tr.invalid_channels = invalid    # channels in which the microphone data is stor
 tr.start = startSample
 tr.stop = stopSample
 
-trigger = Trigger(source=tr, threshold=35, trigger_type='dirac', multiple_peaks_in_hunk='first')
+# only the tracker channel is read from the file (see TrackerChannelTrigger)
+trigger = TrackerChannelTrigger(source=tr, threshold=35, trigger_type='dirac', multiple_peaks_in_hunk='first')
 print(f"Trigger threshold is set to {trigger.threshold}")
-angletracker = AngleTracker(source=microphonedata, trigger=trigger, rot_direction=-1, interp_points=5)
+# angles, rpm and trigger indices are loaded from the cache, if this measurement was evaluated before
+angletracker = CachedAngleTracker(source=microphonedata, trigger=trigger, rot_direction=-1, interp_points=5)
 
-splittedMapName = h5savefileName[0:-3] + "freq" + str(int(freq)) + "_nrInts"+str(nrIntervalls)+"_"
+splittedMapNames = [h5savefileName[0:-3] + "freq" + str(round(f)) + "_nrInts" + str(nrIntervalls) + "_"
+                    for f in freqs]     # names of the maps of each frequency
+csmStoreName = h5savefileName[0:-3] + "_csm" + str(nrFineSectors)     # name of the SectorCsmStore
+sweepName = h5savefileName[0:-3] + "sweep" + str(len(freqs)) + "_nrInts" + str(nrIntervalls) + "_"
+if sectorsOnly:  # the maps of the whole grid aren't overwritten
+    splittedMapNames = [name + "sectors_" for name in splittedMapNames]
+    sweepName += "sectors_"
 
 mvirt = MicGeom()
 mvirt.mpos_tot = mg.mpos_tot
@@ -93,35 +134,65 @@ rotdata = SpatialInterpolatorRotation(mics= mg, mics_virtual=mvirt, method='line
                                       source=microphonedata, angle_source=angletracker)
 
 # ----- Rotating air, steering vector
-rotfield = RotatingFlow(rpm=int(angletracker.average_rpm), v0=0,
+with stage('angletracker'):     # the trigger and the angles are calculated or loaded here
+    averageRpm = angletracker.average_rpm
+rotfield = RotatingFlow(rpm=int(averageRpm), v0=0,
                         origin=array((0., 0., 0.)))
-envRot = GeneralFlowEnvironment(c=c0, N=1000, ff=rotfield, Om=12)
+envRot = CachedGeneralFlowEnvironment(c=c0, N=1000, ff=rotfield, Om=12)
 
-steerRot = SteeringVector(grid=g, mics=mvirt, env=envRot)
+steerRot = SteeringVector(grid=beamGrid, mics=mvirt, env=envRot)
 
 # ------------------------------- Calculate -------------------------------
-nIntervalls = 0
-
-for nr, intervalls in enumerate(getIntervallsByDegreeOverlapping(angleRes, angletracker)):
-
-    rotdataZero = SpatialInterpolatorRotationZeroing(mics= mg, mics_virtual=mvirt, source=microphonedata, angle_source=angletracker,
-                                                     method='linear', array_dimension='2D', interp_at_zero=False)
-    rotdataZero.intsToZero = invertIntervalls(intervalls, rotdata.numsamples)  # e.g. intervalls =[[0,100] ,[1000,1200]
-                # describes which intervalls microphonedata will set to 0
-
-    psRot = PowerSpectra(time_data=rotdataZero, window='Hanning', overlap='50%', block_size=bSize)
-    bfRot = BeamformerBase(freq_data=psRot, steer=steerRot, r_diag=True)
+intervalls = getIntervallsByDegreeOverlapping(angleRes, angletracker)
+# all maps of the intervalls are stored in one file per frequency, Maps/<splittedMapName>.npy (see MapStack)
+mapStacks = [MapStack.create(mapFolder, name, beamGrid.shape, nrIntervalls, freq=f, bandwidth=bandwidth,
+                             nrIntervalls=nrIntervalls, grid=gridMetadata(beamGrid))
+             for f, name in zip(freqs, splittedMapNames)]
+if nrWorkers > 1 and not nrFineSectors:   # every worker process calculates the maps of some of the intervalls
+    with stage('parallelSectors'):
+        calcSectorMapsParallel(rotdata, intervalls, steerRot, freqs, bandwidth, mapStacks, block_size=bSize,
+                               workers=nrWorkers)
+else:
+    if nrFineSectors:   # the csms of the intervalls are summed up from the stored spectra of the fine sectors
+        bandSpectra = BandPowerSpectra(time_data=rotdata, window='Hanning', overlap='50%', block_size=bSize)
+        bandSpectra.ind_low, bandSpectra.ind_high = bandLimits(bandSpectra.fftfreq(), freqs, bandwidth)
+        with stage('csmStore'):
+            store = SectorCsmStore.cached(mapFolder, csmStoreName, bandSpectra, angletracker, nrFineSectors)
+        psRot = StoredSectorPowerSpectra(store=store, nrIntervalls=nrIntervalls, revolutions=revolutions)
+    else:
+        psRot = SectorPowerSpectra(time_data=rotdata, window='Hanning', overlap='50%', block_size=bSize,
+                                   intervalls=intervalls)
+        # only the frequency lines of the bands are beamformed
+        psRot.ind_low, psRot.ind_high = bandLimits(psRot.fftfreq(), freqs, bandwidth)
+    if coarseStep > 1 and not sectorsOnly:
+        bfRot = AdaptiveBeamformer(freq_data=psRot, steer=steerRot, r_diag=True, coarse_step=coarseStep,
+                                   db_range=refineRange)
+    else:
+        bfRot = BeamformerBase(freq_data=psRot, steer=steerRot, r_diag=True)
     T = t.time()
-    splittedRotMap = bfRot.synthetic(freq, bandwidth)   # calculates the sound maps
-
-    print(f"[{nr+1}/{nrIntervalls}]\033[92m bfRot.synthetic time={format(t.time() - T, '.2f')}s \n\n \u001b[0m")
-
-    save(path.join(mapFolder, splittedMapName + str(nIntervalls)), splittedRotMap)
-    nIntervalls += 1
-
-averageAndMinimum(mapFolder, splittedMapName, nrIntervalls-1, 10, nrIntervalls)
+    with stage('sector_csm'):
+        psRot.sector_csm    # calculates the csms of all intervalls (one pass over the microphonedata)
+    print(f"\033[92m psRot.sector_csm time={format(t.time() - T, '.2f')}s \n\n \u001b[0m")
+
+    for nr in range(psRot.numsectors):
+        psRot.sector = nr
+        T = t.time()
+        with stage('beamforming', sector=nr):
+            for f, mapStack in zip(freqs, mapStacks):
+                mapStack[nr] = bfRot.synthetic(f, bandwidth)   # the beamforming is done once, for the first frequency
+
+        print(f"[{nr+1}/{nrIntervalls}]\033[92m bfRot.synthetic time={format(t.time() - T, '.2f')}s \n\n \u001b[0m")
+
+if len(freqs) > 1:  # Average, Min and Standing maps of all bands are also stored in MapStacks, indexed by band
+    averageAndMinimumBands(mapFolder, splittedMapNames, sweepName, nrIntervalls-1, 10, nrIntervalls, freqs=freqs,
+                           bandwidth=bandwidth, nrIntervalls=nrIntervalls, grid=gridMetadata(beamGrid))
+else:
+    averageAndMinimum(mapFolder, splittedMapNames[0], nrIntervalls-1, 10, nrIntervalls)
 print(f"Maps are saved in {mapFolder}")
+printSummary()
 
 # ------------------------------- Plot results -------------------------------
-plotMaps(mapFolder, splittedMapName, g, nrIntervalls, sectors)
-integrateSources(sectors, mapFolder, splittedMapName, nrIntervalls - 1, g)
+for f, splittedMapName in zip(freqs, splittedMapNames):
+    if not sectorsOnly:
+        plotMaps(mapFolder, splittedMapName, g, nrIntervalls, sectors, freq=round(f))
+    integrateSources(sectors, mapFolder, splittedMapName, nrIntervalls - 1, beamGrid, freq=round(f))
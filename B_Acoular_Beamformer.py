@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Inside this script is AdaptiveBeamformer defined, which derivates from the acoular class BeamformerBase, normally found
+in fbeamform.py
+"""
+from acoular import BeamformerBase, SteeringVector, RectGrid, L_p
+from numpy import arange, union1d, searchsorted, flatnonzero, zeros, ones, int64
+from scipy.ndimage import binary_dilation
+from traits.api import Int, Float, Property, cached_property
+
+from B_Acoular_Environments import SubsetEnvironment
+from B_Acoular_Grids import IndexGrid
+
+
+class AdaptiveBeamformer(BeamformerBase):
+    """
+    BeamformerBase for a RectGrid, which beamforms coarse to fine: first only every :attr:`coarse_step`-th point in x
+    and y direction (and the last ones) is beamformed. Only the cells between these points, which have a corner within
+    :attr:`db_range` of the highest level of the coarse map (and :attr:`margin` cells around them), are beamformed on
+    the full grid afterwards. All other points get the values of the coarse map, interpolated bilinearly. So
+    :meth:`synthetic` returns maps of the usual shape of the RectGrid (for MapStack, plotMaps and integrateSources),
+    but the steering vectors and the beamforming are only calculated for a part of the points.
+
+    The distances of the steering vectors are calculated once for the whole grid (see SubsetEnvironment). Only
+    :meth:`synthetic` is adaptive, :attr:`result` is the one of BeamformerBase for the whole grid.
+    """
+
+    #: Distance between the points of the coarse grid, in points of the full grid. <= 1: the full grid is beamformed
+    coarse_step = Int(4, desc="step of the coarse grid")
+
+    #: Cells of the coarse grid with a level of at least the maximum - db_range at one of their corners are refined
+    db_range = Float(10., desc="level range which is refined in dB")
+
+    #: Number of cells around the ones within db_range, which are refined as well
+    margin = Int(1, desc="number of cells refined around the loud ones")
+
+    #: BeamformerBase of the coarse grid; readonly
+    coarse_beamformer = Property(depends_on=['steer.digest', 'coarse_step', 'r_diag', 'r_diag_norm', 'precision'])
+
+    #: Number of points, which were beamformed by the last call of :meth:`synthetic`; readonly
+    num_beamformed = Int(0)
+
+    @cached_property
+    def _get_coarse_beamformer(self):
+        ix, iy = self._coarseAxes()
+        return self._subBeamformer((ix[:, None] * self.steer.grid.shape[1] + iy[None, :]).ravel())
+
+    def _coarseAxes(self):
+        """ :return: indices of the points of the coarse grid on the x and y axis of the full grid """
+        nx, ny = self.steer.grid.shape
+        return (union1d(arange(0, nx, self.coarse_step), [nx - 1]).astype(int64),
+                union1d(arange(0, ny, self.coarse_step), [ny - 1]).astype(int64))
+
+    def _subBeamformer(self, indices):
+        """ :return: BeamformerBase with the same settings, for the points indices of the flattened grid """
+        env = SubsetEnvironment(steer=self.steer, indices=indices, c=self.steer.env.c)
+        steer = SteeringVector(grid=IndexGrid(grid=self.steer.grid, grid_indices=indices), mics=self.steer.mics,
+                               env=env, steer_type=self.steer.steer_type, ref=self.steer.ref)
+        return BeamformerBase(freq_data=self.freq_data, steer=steer, r_diag=self.r_diag, r_diag_norm=self.r_diag_norm,
+                              precision=self.precision, cached=False)
+
+    def _bandMap(self, beamformer, f, num):
+        """
+        Like beamformer.synthetic(f, num), but only the frequency lines of the band are beamformed, not all lines
+        between freq_data.ind_low and ind_high (e.g. of all bands of a sweep)
+        """
+        freq = self.freq_data.fftfreq()
+        lines = _bandLines(freq, f, num)
+        ac = zeros((len(freq), beamformer.steer.grid.size), dtype=self.precision)
+        fr = ones(len(freq), dtype='int8')     # calc skips the lines, which are marked as calculated
+        fr[lines] = 0
+        beamformer.calc(ac, fr)
+        return ac[lines].sum(0)
+
+    def synthetic(self, f, num=0):
+        """
+        Like BeamformerBase.synthetic, but coarse to fine (see class description)
+        :return: map of the shape of the RectGrid
+        """
+        grid = self.steer.grid
+        if not isinstance(grid, RectGrid):
+            raise ValueError("AdaptiveBeamformer needs a RectGrid")
+        ix, iy = self._coarseAxes()
+        if self.coarse_step <= 1 or len(ix) < 2 or len(iy) < 2:     # too small for a coarse grid
+            self.num_beamformed = grid.size
+            return super().synthetic(f, num)
+        coarseMap = self.coarse_beamformer.synthetic(f, num)
+        if coarseMap is None:
+            return None
+        coarseMap = coarseMap.reshape(len(ix), len(iy))
+
+        # cells of the coarse grid with a loud corner, cell (a, b) lies between the points a, a+1 and b, b+1
+        levels = L_p(coarseMap)
+        loud = levels >= levels.max() - self.db_range
+        loudCells = loud[:-1, :-1] | loud[1:, :-1] | loud[:-1, 1:] | loud[1:, 1:]
+        if self.margin > 0:
+            loudCells = binary_dilation(loudCells, ones((3, 3), dtype=bool), iterations=self.margin)
+
+        nx, ny = grid.shape
+        cellX, weightX = _cells(ix, nx)
+        cellY, weightY = _cells(iy, ny)
+        # a point on the border of two cells is refined, if one of them is loud
+        leftX = (searchsorted(ix, arange(nx), 'left') - 1).clip(0, len(ix) - 2)
+        leftY = (searchsorted(iy, arange(ny), 'left') - 1).clip(0, len(iy) - 2)
+        refine = loudCells[cellX[:, None], cellY[None, :]] | loudCells[leftX[:, None], cellY[None, :]] | \
+            loudCells[cellX[:, None], leftY[None, :]] | loudCells[leftX[:, None], leftY[None, :]]
+        coarse = zeros((nx, ny), dtype=bool)
+        coarse[ix[:, None], iy[None, :]] = True
+        refine &= ~coarse
+
+        # bilinear interpolation of the coarse map, then the exact values of the coarse and refined points
+        wx, wy = weightX[:, None], weightY[None, :]
+        cx, cy = cellX[:, None], cellY[None, :]
+        fullMap = (1 - wx) * (1 - wy) * coarseMap[cx, cy] + wx * (1 - wy) * coarseMap[cx + 1, cy] + \
+            (1 - wx) * wy * coarseMap[cx, cy + 1] + wx * wy * coarseMap[cx + 1, cy + 1]
+        fullMap[ix[:, None], iy[None, :]] = coarseMap
+        refineIndices = flatnonzero(refine)
+        if len(refineIndices):
+            fullMap.ravel()[refineIndices] = self._bandMap(self._subBeamformer(refineIndices), f, num)
+        self.num_beamformed = coarseMap.size + len(refineIndices)
+        return fullMap
+
+
+def _bandLines(freq, f, num):
+    """ :return: slice of the frequency lines, which BeamformerBase.synthetic sums up for the band f, num """
+    if num == 0:
+        ind = min(searchsorted(freq, f), len(freq) - 1)
+        return slice(ind, ind + 1)
+    f1, f2 = (num[0], num[-1]) if isinstance(num, list) else (f * 2. ** (-0.5 / num), f * 2. ** (0.5 / num))
+    return slice(searchsorted(freq, f1), searchsorted(freq, f2))
+
+
+def _cells(axis, n):
+    """
+    :param axis: indices of the coarse points on an axis of the full grid (ascending, with 0 and n-1)
+    :return: cell of every point of the axis of the full grid (the nr of the coarse point before it) and its relative
+    position inside of the cell (0 at the coarse point before it, 1 at the one behind it)
+    """
+    points = arange(n)
+    cells = (searchsorted(axis, points, 'right') - 1).clip(0, len(axis) - 2)
+    return cells, (points - axis[cells]) / (axis[cells + 1] - axis[cells])
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Inside this script are CachedGeneralFlowEnvironment and SubsetEnvironment defined, which derivate from the acoular
+classes GeneralFlowEnvironment and Environment, normally found in environments.py
+"""
+from hashlib import md5
+from os import path
+
+from acoular import GeneralFlowEnvironment, Environment, SteeringVector, config
+from acoular.internal import digest
+from numpy import asarray, float64, int64, isscalar
+from traits.api import Str, Int, Instance, CArray, Property, cached_property
+
+from C_DiskCache import DiskCache
+
+
+class CachedGeneralFlowEnvironment(GeneralFlowEnvironment):
+    """
+    GeneralFlowEnvironment, which stores the distances calculated by :meth:`_r` (ray tracing through the flow field,
+    which takes long) in a DiskCache. The entries are identified by the grid and microphone positions, c, the flow field
+    (e.g. rpm, v0 and origin of a RotatingFlow), N and Om. So a run with the same setup loads the distances instead of
+    tracing them again, also with config.global_caching = "none".
+    Can be used instead of GeneralFlowEnvironment for a SteeringVector.
+    """
+
+    #: Folder of the cache, default: folder "steer" inside of the acoular cache_dir
+    cache_folder = Str(desc="folder of the cache")
+
+    #: Maximum size of all files inside of cache_folder in bytes, the least recently used ones get deleted
+    cache_size = Int(2 * 1024 ** 3, desc="maximum size of the cache")
+
+    def _r(self, gpos, mpos=0.0):
+        cache = DiskCache(self.cache_folder or path.join(config.cache_dir, 'steer'), self.cache_size)
+        key = cache.key(self.digest, asarray(gpos, dtype=float64), asarray(mpos, dtype=float64))
+        return cache.cached(key, lambda: super(CachedGeneralFlowEnvironment, self)._r(gpos, mpos))
+
+
+class SubsetEnvironment(Environment):
+    """
+    Environment for a SteeringVector of some points of the grid of another SteeringVector (:attr:`steer`), e.g. with
+    an IndexGrid. The distances are taken from the ones of :attr:`steer`, which are calculated once for its whole grid
+    (ray tracing of a flow environment needs the same time for some points as for all of them). :attr:`c` has to be the
+    one of the environment of :attr:`steer`.
+    """
+
+    #: SteeringVector, whose distances are used
+    steer = Instance(SteeringVector)
+
+    #: Indices of the used points in the grid of :attr:`steer`, in the order of the grid of the new SteeringVector
+    indices = CArray(dtype=int64, desc="indices of the used grid points")
+
+    # internal identifier
+    digest = Property(depends_on=['steer.digest', 'c', '_indices_digest'])
+
+    # internal identifier of indices
+    _indices_digest = Property(depends_on=['indices'])
+
+    @cached_property
+    def _get_digest(self):
+        return digest(self)
+
+    @cached_property
+    def _get__indices_digest(self):
+        return md5(asarray(self.indices, dtype=int64).tobytes()).hexdigest()
+
+    def _r(self, gpos, mpos=0.0):
+        if isscalar(mpos):     # distances to the reference position, see SteeringVector.r0
+            return self.steer.r0[self.indices]
+        return self.steer.rm[self.indices]
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Inside this script are IndexGrid and SectorGrid defined, which derivate from the acoular class Grid, normally found in
+grids.py
+"""
+from hashlib import md5
+
+from acoular import RectGrid
+from acoular.grids import Grid
+from acoular.internal import digest
+from numpy import arange, atleast_1d, concatenate, unique, searchsorted, int64, full, asarray
+from traits.api import Instance, List, Property, CArray, cached_property, property_depends_on
+
+
+def rectGridIndices(grid, positions):
+    """
+    :param grid: RectGrid
+    :param positions: [[x0,y0,r0], [x1,y1,r1]] like for integrateSources
+    :return: list with an array of the grid points inside of every sector, as indices into the flattened map. Like
+    acoular.integrate, the nearest grid point is used for a sector without any grid point in it
+    """
+    flatIndices = arange(grid.size).reshape(grid.shape)
+    return [atleast_1d(flatIndices[grid.indices(xyr[1], xyr[0], xyr[2])]).ravel() for xyr in positions]
+
+
+class IndexGrid(Grid):
+    """
+    Grid of some points of a RectGrid, given by their indices in the flattened maps of the RectGrid. The maps of this
+    grid have the shape (size,), :meth:`fullMap` puts them back onto the RectGrid.
+    """
+
+    #: RectGrid, whose points are used
+    grid = Instance(RectGrid)
+
+    #: Sorted indices of the used points in the flattened maps of :attr:`grid`
+    grid_indices = CArray(dtype=int64, desc="indices of the used points of grid")
+
+    # internal identifier
+    digest = Property(depends_on=['grid.digest', '_indices_digest'])
+
+    # internal identifier of grid_indices, str() of a numpy array is not unique
+    _indices_digest = Property(depends_on=['grid_indices'])
+
+    @cached_property
+    def _get_digest(self):
+        return digest(self)
+
+    @cached_property
+    def _get__indices_digest(self):
+        return md5(asarray(self.grid_indices, dtype=int64).tobytes()).hexdigest()
+
+    @property_depends_on('digest')
+    def _get_size(self):
+        return len(self.grid_indices)
+
+    @property_depends_on('digest')
+    def _get_shape(self):
+        return (self.size,)
+
+    @property_depends_on('digest')
+    def _get_gpos(self):
+        return self.grid.gpos[:, self.grid_indices]
+
+    def mapIndices(self, gridIndices):
+        """
+        :param gridIndices: indices into the flattened maps of :attr:`grid`
+        :return: indices of the same points in the maps of this grid
+        """
+        mapInds = searchsorted(self.grid_indices, gridIndices)
+        if (mapInds >= self.size).any() or (self.grid_indices[mapInds.clip(max=self.size - 1)] != gridIndices).any():
+            raise ValueError(f"Some of the grid points aren't part of the {self.__class__.__name__}")
+        return mapInds
+
+    def fullMap(self, indexMap, fill=0.):
+        """
+        :param indexMap: map of this grid, shape (size,)
+        :return: map of the shape of :attr:`grid` with the values of indexMap at the points of this grid and fill at
+        all others, e.g. for plotMaps
+        """
+        fullMap = full(self.grid.size, fill, dtype=indexMap.dtype)
+        fullMap[self.grid_indices] = indexMap
+        return fullMap.reshape(self.grid.shape)
+
+
+class SectorGrid(IndexGrid):
+    """
+    Grid of the points of a RectGrid, which are inside of the integration sectors (like for integrateSources). A
+    SteeringVector with this grid beamforms only these points, so the beamforming and the maps (shape (size,)) only
+    cost a fraction of the ones of the whole RectGrid, if the sound levels of the sectors are all that is needed.
+    sectorIndices of C_FilterFunctionality returns the indices into these maps, so integrateSources and integrateMaps
+    give the same levels as for the maps of the whole RectGrid.
+    """
+
+    #: [[x0,y0,r0], [x1,y1,r1]] circular sectors, like for integrateSources
+    sectors = List()
+
+    #: Sorted indices of the used points in the flattened maps of :attr:`grid`; readonly
+    grid_indices = Property(depends_on=['grid.digest', 'sectors'])
+
+    # internal identifier
+    digest = Property(depends_on=['grid.digest', 'sectors'])
+
+    @cached_property
+    def _get_digest(self):
+        return digest(self)
+
+    @cached_property
+    def _get_grid_indices(self):
+        inds = rectGridIndices(self.grid, self.sectors)
+        return unique(concatenate(inds)).astype(int64) if inds else arange(0, dtype=int64)
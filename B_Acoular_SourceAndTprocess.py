@@ -2,27 +2,97 @@
 # -*- coding: utf-8 -*-
 # imports from other packages
 """
-Inside this script are SpatialInterpolatorRotationZeroing and ZeroedMaskedTimeSamples defined, which derivated from
+Inside this script are SpatialInterpolatorRotationZeroing, MemmapAngleTracker, TrackerChannelTrigger,
+FastAngleTracker, CachedAngleTracker, ZeroedMaskedTimeSamples and MemmapTimeSamples defined, which derivated from
 acoular classes, normally found in tprocess.py and sources.py
 """
+from os import path
+from threading import Lock
+from warnings import warn
 
-from acoular import SpatialInterpolatorRotation, TimeSamples, SamplesGenerator, Calib, MaskedTimeSamples
-from numpy import pi
-from traits.api import List
+from acoular import SpatialInterpolatorRotation, TimeSamples, SamplesGenerator, Calib, MaskedTimeSamples, config
+from acoular.internal import digest
+from acoular.tprocess import AngleTracker, Trigger
+from numpy import pi, zeros, load, diff, flatnonzero, append, newaxis, float64, inf, arange, add, concatenate, array, \
+    argmax, asarray, empty, searchsorted, clip, where, unique, stack, argsort
+from scipy.interpolate import splrep, splev
+from traits.api import List, Dict, Either, Instance, File, Str, Int, cached_property, on_trait_change
 
+from C_DiskCache import DiskCache
+from C_Instrumentation import count
+from C_IntervalSet import IntervalSet, ZeroingPlan
+from C_Prefetch import prefetch
 
-# ========== tprocess
 from traits.traits import Trait, Property
 
+# HDF5 isn't thread safe, so only one thread at a time reads a slab (see ZeroedMaskedTimeSamples.prefetch)
+_readLock = Lock()
+
+
+# ========== tprocess
+
 
 class SpatialInterpolatorRotationZeroing(SpatialInterpolatorRotation):
     """
     Spatial  Interpolation for rotating sources. Gets samples from :attr:`source`
     and angles from  :attr:`AngleTracker`.Generates output via the generator :meth:`result`
     Result function returns zeroed microphonedata, for samples inside of intsToZero
+
+    The interpolation of a sample only depends on this sample and its angle, so zeroing before or after the
+    interpolation gives the same result. If :attr:`cache_folder` is set, the source data is interpolated only once
+    (without zeroing) into a .npy file (see :attr:`rotated`). All results for different intsToZero are read from it and
+    zeroed afterwards, instead of interpolating the source data again for every sector.
     """
 
-    intsToZero = List()
+    #: [[start0, end0], [s1,e1],...] or IntervalSet of the samples to zero
+    intsToZero = Either(List(), Instance(IntervalSet))
+
+    #: Folder of the DiskCache for the interpolated data, "" = no caching
+    cache_folder = Str(desc="folder of the cache of the interpolated data")
+
+    #: Maximum size of all files inside of cache_folder in bytes, the least recently used ones get deleted
+    cache_size = Int(8 * 1024 ** 3, desc="maximum size of the cache")
+
+    #: MemmapTimeSamples with the interpolated (not zeroed) data of the whole source, read from the cache. It is
+    #: calculated and written into the cache at the first access, if it isn't there yet; readonly
+    rotated = Property(depends_on=['_rotated_digest', 'cache_folder'])
+
+    #: Number of blocks, which are interpolated ahead by a background thread (see C_Prefetch.prefetch), while the
+    #: consumer (e.g. the csm calculation) processes the current one. 0 = no thread
+    prefetch = Int(0, desc="number of blocks interpolated ahead")
+
+    #: Internal identifier
+    digest = Property(depends_on=['source.digest', 'angle_source.digest', 'mics.digest', 'mics_virtual.digest',
+                                  'method', 'array_dimension', 'Q', 'interp_at_zero', 'intsToZero'])
+
+    # identifier of the interpolated data without zeroing, which is the same for all intsToZero
+    _rotated_digest = Property(depends_on=['source.digest', 'angle_source.digest', 'mics.digest',
+                                           'mics_virtual.digest', 'method', 'array_dimension', 'Q', 'interp_at_zero'])
+
+    @cached_property
+    def _get_digest(self):
+        return digest(self)
+
+    @cached_property
+    def _get__rotated_digest(self):
+        return digest(self, '_rotated_digest')
+
+    @cached_property
+    def _get_rotated(self):
+        cache = DiskCache(self.cache_folder, self.cache_size)
+        key = 'rotated' + self._rotated_digest
+        if cache.load(key, mmap_mode='r') is None:
+            cache.saveBlocks(key, self._interpolatedBlocks(16384), (self.numsamples, self.numchannels), 'float64')
+        return MemmapTimeSamples(name=cache.fileName(key), sample_freq=self.sample_freq)
+
+    def _interpolatedBlocks(self, num):
+        """ yields the interpolated data of the whole source blockwise, without zeroing """
+        period = 2 * pi                         # period for rotation
+        angle = self.angle_source._get_angle()  # get angle
+        for i, timeData in self.source.sparseZeroedResult(num, []):
+            phiDelay = angle[i:i + timeData.shape[0]]
+            yield self._result_core_func(timeData, phiDelay, period, self.Q, interp_at_zero=False)
+
     def result(self, num=128):
         """
         Python generator that yields the output block-wise.
@@ -38,6 +108,13 @@ class SpatialInterpolatorRotationZeroing(SpatialInterpolatorRotation):
         Samples in blocks of shape (num, :attr:`numchannels`).
             The last block may be shorter than num.
         """
+        yield from prefetch(self._result(num), self.prefetch)
+
+    def _result(self, num):
+        """ result without prefetching """
+        if self.cache_folder:
+            yield from self.rotated.partiallyZeroedResult(num, self.intsToZero)
+            return
         period = 2 * pi                         # period for rotation
         angle = self.angle_source._get_angle()  # get angle
         count = 0       # counter to track angle position in time for each block
@@ -47,94 +124,470 @@ class SpatialInterpolatorRotationZeroing(SpatialInterpolatorRotation):
             yield interpVal
             count += num
 
+    def sparseResult(self, num=128):
+        """
+        Like result, but blocks in which every sample is inside of intsToZero are neither read, nor interpolated, nor
+        yielded. Used by SparsePowerSpectra, which treats the missing blocks as zeros.
+        :param num: blocksize of the yielded data
+        :return: tuples (nr of the first sample of the block, interpolated samples in blocks of shape
+        (num, numchannels))
+        """
+        yield from prefetch(self._sparseResult(num), self.prefetch)
+
+    def _sparseResult(self, num):
+        """ sparseResult without prefetching """
+        if self.cache_folder:
+            yield from self.rotated.sparseZeroedResult(num, self.intsToZero)
+            return
+        period = 2 * pi                         # period for rotation
+        angle = self.angle_source._get_angle()  # get angle
+        for i, timeData in self.source.sparseZeroedResult(num, self.intsToZero):
+            phiDelay = angle[i:i + timeData.shape[0]]
+            yield i, self._result_core_func(timeData, phiDelay, period, self.Q, interp_at_zero=False)
+
+
+class MemmapAngleTracker(AngleTracker):
+    """
+    AngleTracker, which doesn't calculate the angles from a trigger, but reads them from a .npy file (e.g. saved from
+    the angle of an AngleTracker). The file is opened as memmap, so several processes can use the same angles without
+    copying them.
+    """
+
+    #: .npy file with the angle for every sample
+    angle_file = File(filter=['*.npy'], desc="name of the angle file")
+
+    #: Internal identifier
+    digest = Property(depends_on=['angle_file'])
+
+    @cached_property
+    def _get_digest(self):
+        return digest(self)
+
+    @cached_property
+    def _get_angle(self):
+        return load(self.angle_file, mmap_mode='r')
+
+
+class TrackerChannelTrigger(Trigger):
+    """
+    Trigger, which reads only the trigger channel of its source directly from the file, in chunks of
+    :attr:`chunk_size` samples, instead of the blocks of source.result. The source is a MaskedTimeSamples (or
+    ZeroedMaskedTimeSamples) in which all channels except the trigger channel are invalid, e.g. of a file with the
+    microphone channels and the tracker channel. The pulses are found with vectorized thresholding of each chunk.
+    The trigger indices are the same as the ones of Trigger, except for a 'rect' edge in the first block of Trigger
+    (which are found one sample too early there). The calibration of the source isn't applied.
+    """
+
+    #: Number of samples, which are read from the file at once
+    chunk_size = Int(2 ** 20, desc="number of samples read at once")
+
+    def _channelChunks(self):
+        """ yields the trigger channel between start and stop of the source in chunks, as 1-d arrays """
+        source = self.source
+        channel = 0 if isinstance(source.channels, slice) else int(source.channels[0])
+        start, stop, _ = slice(source.start, source.stop).indices(source.numsamples_total)
+        for i in range(start, stop, self.chunk_size):
+            with _readLock:
+                chunk = source.data[i:min(i + self.chunk_size, stop), channel]
+            count('bytesRead', chunk.nbytes)
+            yield chunk
+
+    def _threshold(self, nSamples):
+        """ like Trigger._threshold, but with vectorized statistics of the chunks """
+        if self.threshold is not None:
+            return self.threshold
+        maxVal, minVal, blockMeans = -inf, inf, []
+        for chunk in self._channelChunks():
+            maxVal, minVal = max(maxVal, chunk.max()), min(minVal, chunk.min())
+            blockStarts = arange(0, len(chunk), nSamples)   # mean of every block of nSamples, like Trigger
+            blockMeans.append(add.reduceat(chunk, blockStarts, dtype=float64) / diff(append(blockStarts, len(chunk))))
+        meanVal = concatenate(blockMeans).mean()
+        maxTriggerHelp = array([minVal, maxVal]) - meanVal
+        thresh = maxTriggerHelp[argmax(abs(maxTriggerHelp))] * 0.75  # 0.75 for 75% of max trigger signal
+        warn('No threshold was passed. An estimated threshold of %s is assumed.' % thresh, Warning, stacklevel=2)
+        return thresh
+
+    @cached_property
+    def _get_trigger_data(self):
+        self._check_trigger_existence()
+        if self.chunk_size % 2048:  # the block means of the threshold estimation need whole blocks in each chunk
+            raise ValueError("chunk_size must be a multiple of 2048")
+        threshold = self._threshold(2048)
+        peakLocs, peakValues = [], []
+        count, last = 0, None
+        for chunk in self._channelChunks():
+            if self.trigger_type == 'rect':     # difference of every sample to its predecessor
+                signal = diff(chunk, prepend=chunk[0] if last is None else last)
+            else:
+                signal = chunk
+            localTrigger = flatnonzero(signal > threshold if threshold > 0 else signal < threshold)
+            peakLocs.append(localTrigger + count)
+            peakValues.append(chunk[localTrigger])    # like Trigger, the extremum is chosen by the signal values
+            count += len(chunk)
+            last = chunk[-1]
+        peakLoc, peakValue = concatenate(peakLocs), concatenate(peakValues)
+        if len(peakLoc) <= 1:
+            raise Exception('Not enough trigger info. Check *threshold* sign and value!')
+        maxPeakDist = diff(peakLoc).max()  # approximate distance between the revolutions
+        peakLoc = _singlePeaks(peakLoc, peakValue, self.hunk_length * maxPeakDist, self.multiple_peaks_in_hunk)
+
+        # check whether distances between peaks are evenly distributed
+        peakDist = diff(peakLoc)
+        meanDist = peakDist.mean()
+        faultyInd = flatnonzero(abs(peakDist - meanDist) > self.max_variation_of_duration * meanDist)
+        if faultyInd.size != 0:
+            warn('In Trigger-Identification: The distances between the peaks (and therefor the lengths of the '
+                 'revolutions) vary too much (check samples %s).' % str(peakLoc[faultyInd] + self.source.start),
+                 Warning, stacklevel=2)
+        return peakLoc, peakDist.max(), peakDist.min()
+
+
+class FastAngleTracker(AngleTracker):
+    """
+    AngleTracker, which calculates the same angles and rpm, but vectorized (see rpmAndAngle) instead of fitting a
+    spline for every sample. Can be used instead of AngleTracker everywhere, e.g. with a TrackerChannelTrigger.
+    """
+
+    def _to_rpm_and_angle(self):
+        _fastRpmAndAngle(self)
+
+
+class CachedAngleTracker(MemmapAngleTracker):
+    """
+    AngleTracker, which stores the angle and rpm of every sample and the trigger indices in a DiskCache. The entries
+    are identified by the content of the trigger file, its channels and start/stop, the settings of the Trigger, the
+    settings of the AngleTracker and the number of samples and sample frequency of the source. So an analysis of a
+    measurement, which was evaluated before, loads them (as memmap, see MemmapAngleTracker) instead of detecting the
+    trigger pulses again. Otherwise they are calculated like in FastAngleTracker.
+    """
+
+    #: Folder of the cache, default: folder "angles" inside of the acoular cache_dir
+    cache_folder = Str(desc="folder of the cache")
+
+    #: Maximum size of all files inside of cache_folder in bytes, the least recently used ones get deleted
+    cache_size = Int(2 * 1024 ** 3, desc="maximum size of the cache")
+
+    #: .npy file with the angle for every sample inside of the cache, readonly. The angles, rpm and trigger indices
+    #: are calculated and stored at the first access, if they aren't in the cache yet
+    angle_file = Property(depends_on=['digest'])
+
+    #: sample indices of the trigger pulses, readonly
+    trigger_indices = Property(depends_on=['digest'])
+
+    #: Key of the cache entries, readonly. The trigger file is only hashed, when it is needed the first time
+    cache_key = Property(depends_on=['digest'])
+
+    #: Internal identifier
+    digest = Property(depends_on=['source.digest', 'trigger.digest', 'trigger_per_revo', 'rot_direction',
+                                  'interp_points', 'start_angle', 'cache_folder'])
+
+    @property
+    def _cache(self):
+        return DiskCache(self.cache_folder or path.join(config.cache_dir, 'angles'), self.cache_size)
+
+    @cached_property
+    def _get_digest(self):
+        return digest(self)
+
+    @cached_property
+    def _get_cache_key(self):
+        cache = self._cache
+        trigger, triggerSource = self.trigger, self.trigger.source
+        if isinstance(triggerSource, MaskedTimeSamples) and path.isfile(triggerSource.name):
+            triggerData = (cache.fileHash(triggerSource.name), list(triggerSource.invalid_channels),
+                           triggerSource.start, triggerSource.stop)
+        else:   # no file, e.g. generated trigger data
+            triggerData = triggerSource.digest
+        return cache.key(type(trigger).__name__, triggerData, trigger.threshold, trigger.trigger_type,
+                         trigger.multiple_peaks_in_hunk,
+                         trigger.hunk_length, trigger.max_variation_of_duration, self.trigger_per_revo,
+                         self.rot_direction, self.interp_points, self.start_angle, self.source.numsamples,
+                         self.source.sample_freq)
+
+    def _cachedArray(self, name):
+        """ :return: the array name ('angle', 'rpm' or 'trigger') from the cache, they are calculated if necessary """
+        cache = self._cache
+        data = cache.load(name + self.cache_key, mmap_mode='r')
+        if data is None:
+            self._to_rpm_and_angle()
+            cache.save('trigger' + self.cache_key, self.trigger._get_trigger_data()[0])
+            cache.save('rpm' + self.cache_key, self._rpm)
+            cache.save('angle' + self.cache_key, self._angle)
+            self._rpm, self._angle = [], []
+            data = cache.load(name + self.cache_key, mmap_mode='r')
+        return data
+
+    def _to_rpm_and_angle(self):
+        _fastRpmAndAngle(self)
+
+    @cached_property
+    def _get_angle_file(self):
+        self._cachedArray('angle')
+        return self._cache.fileName('angle' + self.cache_key)
+
+    @cached_property
+    def _get_angle(self):
+        return self._cachedArray('angle')
+
+    @cached_property
+    def _get_rpm(self):
+        return self._cachedArray('rpm')
+
+    @cached_property
+    def _get_trigger_indices(self):
+        return self._cachedArray('trigger')
+
+    @cached_property
+    def _get_average_rpm(self):
+        peakloc = self.trigger_indices
+        return (len(peakloc) - 1) / (peakloc[-1] - peakloc[0]) / self.trigger_per_revo * self.source.sample_freq * 60
+
 
 # ========== source
 
 
 class ZeroedMaskedTimeSamples(MaskedTimeSamples):
+    """
+    MaskedTimeSamples, which yields its data with some samples set to 0 (see partiallyZeroedResult and
+    sparseZeroedResult). The data is read from the file in big slabs of whole blocks (about :attr:`slab_bytes`, a
+    multiple of the chunks of the file), instead of one read for every block. If the valid channels are contiguous
+    (e.g. all except the tracker channel), they are selected with a slice, so the file is read without copying the
+    channels afterwards. The calibration is applied to the whole slab at once, and the yielded blocks are views of it.
+    """
+
+    #: Approximate number of bytes, which are read from the file at once
+    slab_bytes = Int(32 * 1024 ** 2, desc="size of the slabs read from the file")
+
+    #: Number of slabs, which are read ahead by a background thread (see C_Prefetch.prefetch), 0 = no thread
+    prefetch = Int(0, desc="number of slabs read ahead")
+
+    #: Number of ZeroingPlans, which are kept for later calls (see zeroingPlan)
+    zeroing_plans = Int(4, desc="number of ZeroingPlans kept")
+
+    # the last used ZeroingPlans, the least recently used one first, see zeroingPlan
+    _zeroingPlans = Dict()
+
+    def _sampleRange(self):
+        """ :return: (nr of the first sample in the file, number of samples) of the samples between start and stop """
+        sli = slice(self.start, self.stop).indices(self.numsamples_total)
+        return sli[0], sli[1] - sli[0]
+
+    def _channelIndex(self):
+        """ :return: slice of the valid channels if they are contiguous, otherwise their indices """
+        channels = self.channels
+        if isinstance(channels, slice) or len(channels) == 0 or (diff(channels) != 1).any():
+            return channels
+        return slice(int(channels[0]), int(channels[-1]) + 1)
+
+    def _calibFactor(self):
+        """ :return: calibration factors of the valid channels with shape (1, numchannels), None without calib """
+        if not self.calib:
+            return None
+        if self.calib.num_mics == self.numchannels_total:
+            return self.calib.data[self.channels][newaxis]
+        if self.calib.num_mics == self.numchannels:
+            return self.calib.data[newaxis]
+        if self.calib.num_mics == 0:
+            warn("No calibration data used.", Warning, stacklevel=3)
+            return None
+        raise ValueError("calibration data not compatible: %i, %i" % (self.calib.num_mics, self.numchannels))
+
+    def _blocksPerSlab(self, num):
+        """ :return: number of blocks of num samples, which are read at once (about slab_bytes, whole chunks) """
+        chunks = getattr(self.data, 'chunkshape', None) or getattr(self.data, 'chunks', None) or (1,)
+        rowBytes = max(self.numchannels_total * self.data.dtype.itemsize, 1)
+        rows = max(self.slab_bytes // rowBytes // chunks[0], 1) * chunks[0]
+        return max(rows // num, 1)
+
+    def _readBlocks(self, plan, blockNrs):
+        """
+        Reads the blocks blockNrs (ascending) of the ZeroingPlan plan. Blocks with consecutive numbers are read as one
+        slab, the valid channels are selected and the calibration is applied once per slab. With :attr:`prefetch`, the
+        slabs are read by a background thread.
+        :return: generator of (nr of the block, samples of the block), the samples are views of the slab
+        """
+        for slabBlocks, start, slab in prefetch(self._readSlabs(plan, blockNrs), self.prefetch):
+            for b in slabBlocks:
+                i = plan.blockStarts[b] - start
+                yield b, slab[i:i + plan.blockLengths[b]]
+
+    def _readSlabs(self, plan, blockNrs):
+        """ yields (nrs of the blocks, nr of the first sample, slab with the samples) of the slabs of _readBlocks """
+        offset = self._sampleRange()[0]
+        channels = self._channelIndex()
+        calibFactor = self._calibFactor()
+        perSlab = self._blocksPerSlab(plan.num)
+        runStarts = flatnonzero(diff(blockNrs, prepend=-2) != 1)
+        for runStart, runEnd in zip(runStarts, append(runStarts[1:], len(blockNrs))):
+            for first in range(runStart, runEnd, perSlab):
+                slabBlocks = blockNrs[first:min(first + perSlab, runEnd)]
+                start = plan.blockStarts[slabBlocks[0]]
+                end = plan.blockStarts[slabBlocks[-1]] + plan.blockLengths[slabBlocks[-1]]
+                with _readLock:
+                    if isinstance(channels, slice):
+                        slab = self.data[offset + start:offset + end, channels]
+                        count('bytesRead', slab.nbytes)
+                    else:   # reading all channels and selecting them afterwards is faster than a point selection
+                        rows = self.data[offset + start:offset + end]
+                        count('bytesRead', rows.nbytes)
+                        slab = rows[:, channels]
+                if calibFactor is not None:
+                    slab = slab * calibFactor
+                yield slabBlocks, start, slab
+
+    def zeroingPlan(self, num, intsToZero):
+        """
+        Returns the ZeroingPlan for the intervalls and the blocksize. The last :attr:`zeroing_plans` plans are kept, so
+        e.g. the plan of a sector is calculated only once for all frequencies, but the memory doesn't grow with the
+        number of sectors.
+        :param num: blocksize of the yielded data
+        :param intsToZero: [[start0, end0], [s1,e1],...] or IntervalSet of the samples to zero
+        """
+        intsToZero = IntervalSet(intsToZero)
+        key = (self.digest, num, str(intsToZero))
+        plan = self._zeroingPlans.pop(key, None)
+        if plan is None:
+            plan = ZeroingPlan(intsToZero, num, self._sampleRange()[1])
+        self._zeroingPlans[key] = plan     # moved to the end as the most recently used one
+        while len(self._zeroingPlans) > max(self.zeroing_plans, 0):
+            del self._zeroingPlans[next(iter(self._zeroingPlans))]
+        return plan
+
+    def result(self, num=128):
+        """
+        Like MaskedTimeSamples.result, but read in slabs (see class description)
+        :param num: blocksize of the yielded data
+        :return: Samples in blocks of shape (num, numchannels), views of the slab. The last block may be shorter
+        """
+        yield from self.partiallyZeroedResult(num, [])
+
     def partiallyZeroedResult(self, num, intsToZero):
         """
         Yields data blockwise. If a sample inside the borders of "intsToZero" all microphone data of that sample gets
         set to 0. Because it zeroes Data, there will be a small error in the sound evaluation if e.g. originally the data
         of a single microphone  looked like this: [4,5,6,5,4,3,2,1] and it gets set to [4,5,6,0,0,0] there is a jump
-        of -6 instead of -1
+        of -6 instead of -1. Blocks which are zeroed completely aren't read from the file.
         :param num: blocksize of the yielded data
-        :param intsToZero: [[start0, end0], [s1,e1],...] samples with the number from start to end will be zeroed
+        :param intsToZero: [[start0, end0], [s1,e1],...] or IntervalSet, samples with the number from start to end (both
+        included) will be zeroed. The sample numbers count from self.start on, like the angles of the AngleTracker
         :return: Samples in blocks of shape (num, numchannels)
         """
         if self.numsamples == 0:
             raise IOError("no samples available")
+        plan = self.zeroingPlan(num, intsToZero)
+        dataBlocks = self._readBlocks(plan, plan.dataBlocks)
+        dtype = self.data.dtype if self._calibFactor() is None else float64
+        for b in range(len(plan.blockStarts)):
+            if plan.fullyZeroed[b]:
+                count('blocksZeroed')
+                yield zeros((plan.blockLengths[b], self.numchannels), dtype=dtype)
+            else:
+                count('blocksYielded')
+                yield plan.zero(b, next(dataBlocks)[1])
+
+    def sparseZeroedResult(self, num, intsToZero):
+        """
+        Yields the data blockwise with all samples inside of "intsToZero" set to 0. Blocks in which every sample would
+        be zeroed are skipped, they aren't even read from the file. So the time needed scales with the number of
+        samples that aren't zeroed and not with the length of the file.
+        :param num: blocksize of the yielded data
+        :param intsToZero: [[start0, end0], [s1,e1],...] or IntervalSet, samples with the number from start to end (both
+        included) will be zeroed. The sample numbers count from self.start on, like the angles of the AngleTracker
+        :return: tuples (nr of the first sample of the block, samples in blocks of shape (num, numchannels)). The nr of
+        the first sample is always a multiple of num
+        """
+        if self.numsamples == 0:
+            raise IOError("no samples available")
+        plan = self.zeroingPlan(num, intsToZero)
+        count('blocksSkipped', len(plan.blockStarts) - len(plan.dataBlocks))
+        for b, data in self._readBlocks(plan, plan.dataBlocks):
+            count('blocksYielded')
+            yield plan.blockStarts[b], plan.zero(b, data)
 
-        # loop for all samples
-        n = 0  # intsToZero[n]= [start n, end n]
 
-        if self.start is None :
-            i = 0
-        else:
-            i = self.start
-        if self.stop is None:
-            stop = self.data.shape[0]
+class MemmapTimeSamples(ZeroedMaskedTimeSamples):
+    """
+    ZeroedMaskedTimeSamples, which reads the time data from a .npy file of shape (numsamples, numchannels) instead of a
+    .h5 file. The file is opened as memmap, so several processes can read the same data without copying it.
+    :attr:`sample_freq` isn't stored in the file and has to be set.
+    """
+
+    #: Full name of the .npy file with data
+    name = File(filter=['*.npy'], desc="name of data file")
+
+    @on_trait_change('basename')
+    def load_data(self):
+        if not path.isfile(self.name):
+            self.numsamples_total = 0
+            self.numchannels_total = 0
+            raise IOError("No such file: %s" % self.name)
+        self.load_timedata()
+
+    def load_timedata(self):
+        """ opens the .npy file as memmap """
+        self.data = load(self.name, mmap_mode='r')
+        (self.numsamples_total, self.numchannels_total) = self.data.shape
+
+
+def _singlePeaks(peakLoc, peakValue, hunkLength, multiplePeaksInHunk):
+    """
+    Removes peaks like Trigger._get_trigger_data: as long as two adjacent peaks are closer than hunkLength, one of them
+    is deleted (the later one for 'first', the one with the smaller absolute value for 'extremum')
+    :return: the remaining peak locations
+    """
+    if not (diff(peakLoc) < hunkLength).any():
+        return peakLoc
+    kept = []   # indices of the remaining peaks, adjacent ones are never closer than hunkLength
+    for i in range(len(peakLoc)):
+        while kept and peakLoc[i] - peakLoc[kept[-1]] < hunkLength:
+            if multiplePeaksInHunk == 'first' or abs(peakValue[kept[-1]]) > abs(peakValue[i]):
+                break
+            kept.pop()
         else:
-            stop = self.stop
-
-        cuttedLastIntervall = False
-        doneWithLastZero = False
-        while i < stop:
-            dataToYield = self.data[i:  min(i + num, stop)][:, self.channels] # SELF.CALIB NOT IMPLEMENTED!!
-            intervallsToZeroNewIndices = []
-            # loop to calculate intervallsToZeroNewIndices
-            newIndexesCalculated = False
-            while not (newIndexesCalculated or doneWithLastZero):
-
-                a = intsToZero[n][0]
-                e = intsToZero[n][1]
-                A = i
-                E = i + num
-                # Following lines calculate the intersection of a [A,E] & [a,e]
-                if a <= A and e < E:
-                    # Case 1&2: zero is balancing on on left side of group to yield
-                    intervallsToZeroNewIndices.append([0, e - A])
-                elif a > A and e < E:
-                    # Case 3
-                    intervallsToZeroNewIndices.append([a - A, e - A])
-                elif a > A and e == E:
-                    # Case 4: zero inside yield, touching right border
-                    intervallsToZeroNewIndices.append([a - i, num - 1])
-                elif a > A and e > E and a < E:
-                    # Case 5: zero balancing on right side of yield
-                    intervallsToZeroNewIndices.append([a - A, num - 1])
-                    cuttedLastIntervall = True
-                elif a == E and e > E:
-                    # case 10 / 5.2: zero starts exactly at end inside of yield, hangs over on right side
-                    intervallsToZeroNewIndices.append([num - 1, num - 1])
-                    cuttedLastIntervall = True
-                elif a == E and e == E:
-                    # case 11 / 5.3: zero has len 1 an sits at the end of yield
-                    intervallsToZeroNewIndices.append([num - 1, num - 1])
-                elif a < i and e > E or a == i and e > E:
-                    # Case 6 and 9: zero hanging over on left and right side of yield
-                    # OR ero starts at start of yield, but hangs over on the right side
-                    intervallsToZeroNewIndices.append([0, num - 1])
-                    cuttedLastIntervall = True
-                elif a < A and e < A:
-                    # Case 7: Zero left of yield. This should only happen if the last couple samples dont have to get
-                    # zeroed
-                    newIndexesCalculated = True  # is this right?
-                elif a > E and e > E:
-                    # Case 8: toZero right of Group to yield this shouldnt get triggered?
-                    cuttedLastIntervall = True  # dont increase n by one, we went too far with this
-
-                if not cuttedLastIntervall:
-                    n += 1
-                    if n >= len(intsToZero):
-                        doneWithLastZero = True
-                else:  # eliminate the effect of n+=1, so for next run start again with n, not n+1
-                    cuttedLastIntervall = False
-                    newIndexesCalculated = True  # if we had to cut zero, this means we are at end of yield
-
-            # create dataToYield
-            for z in intervallsToZeroNewIndices:
-                dataToYield[z[0]:z[1], :] = 0
-
-            yield dataToYield
-            i += num
+            kept.append(i)
+    return peakLoc[kept]
+
+
+def rpmAndAngle(peakloc, numsamples, sampleFreq, interpPoints=4, rotDirection=-1, triggerPerRevo=1, startAngle=0.,
+                num=2 ** 20):
+    """
+    Vectorized version of AngleTracker._to_rpm_and_angle. Every sample gets the rpm and angle of the same spline
+    through interpPoints trigger pulses as there, but every spline is fitted only once for all samples which use it
+    :param peakloc: sample indices of the trigger pulses, e.g. trigger.trigger_data[0]
+    :param numsamples: number of samples of the source
+    :param num: number of samples, which are calculated at once
+    :return: rpm, angle in radians for each sample
+    """
+    peakloc = asarray(peakloc)
+    rpm, angle = empty(numsamples), empty(numsamples)
+    for first in range(0, numsamples, num):
+        ind = arange(first, min(first + num, numsamples))
+        # nearest trigger pulse of every sample, the earlier one for two equally near ones (like argmin)
+        right = searchsorted(peakloc, ind)
+        left, right = clip(right - 1, 0, len(peakloc) - 1), clip(right, 0, len(peakloc) - 1)
+        nearest = where(abs(peakloc[left] - ind) <= abs(peakloc[right] - ind), left, right)
+        forward = ind < peakloc[interpPoints]   # spline forward at the beginning, otherwise backwards
+        peakdist = where(forward, peakloc[(nearest + 1) % len(peakloc)] - peakloc[nearest],
+                         peakloc[nearest] - peakloc[nearest - 1])
+        revolution = ind // peakdist
+        sliceStarts = where(forward, revolution, revolution - interpPoints)
+        windows, sampleWindow = unique(stack((sliceStarts, forward)), axis=1, return_inverse=True)
+        order = argsort(sampleWindow, kind='stable')
+        borders = searchsorted(sampleWindow[order], arange(windows.shape[1] + 1))
+        for w, sliceStart in enumerate(windows[0]):
+            samples = ind[order[borders[w]:borders[w + 1]]]
+            # the same slice as in AngleTracker, also for negative starts
+            spline = splrep(peakloc[sliceStart:sliceStart + interpPoints], range(interpPoints), k=3)
+            rpm[samples] = splev(samples, spline, der=1, ext=0) * 60 * sampleFreq
+            angle[samples] = (splev(samples, spline, der=0, ext=0) * 2 * pi * rotDirection / triggerPerRevo +
+                              startAngle) % (2 * pi)
+    return rpm, angle
+
+
+def _fastRpmAndAngle(angletracker):
+    """ calculates rpm and angle of an AngleTracker with rpmAndAngle """
+    angletracker._rpm, angletracker._angle = rpmAndAngle(
+        angletracker.trigger._get_trigger_data()[0], angletracker.source.numsamples, angletracker.source.sample_freq,
+        angletracker.interp_points, angletracker.rot_direction, angletracker.trigger_per_revo,
+        angletracker.start_angle)
+    angletracker._calc_flag = True
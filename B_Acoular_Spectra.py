@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Inside this script are BandPowerSpectra, SectorPowerSpectra, StoredSectorPowerSpectra and SparsePowerSpectra defined,
+which derivate from the acoular class PowerSpectra, normally found in spectra.py
+"""
+
+from acoular import PowerSpectra, TimeSamples
+from acoular.internal import digest
+from numpy import dot, newaxis, zeros, empty, full, fft, arange, array, int32, int64, log2, outer, cos, sin, pi, \
+    matmul, unique
+from hashlib import md5
+from traits.api import List, Int, Any, Property, cached_property, on_trait_change
+
+from C_Instrumentation import count
+
+
+def addToCsm(csm, spectra):
+    """
+    Adds the spectra of several blocks to a csm with one matrix multiply per frequency line
+    :param csm: array of shape (number of lines, numchannels, numchannels)
+    :param spectra: array of shape (number of blocks, number of lines, numchannels)
+    """
+    ft = spectra.transpose(1, 2, 0)     # (lines, channels, blocks)
+    csm += matmul(ft, ft.conj().transpose(0, 2, 1))
+
+
+class BandPowerSpectra(PowerSpectra):
+    """
+    PowerSpectra, which only calculates the lines of the cross spectral matrix that are inside of :attr:`indices` (set
+    by ind_low and ind_high, e.g. with bandLimits of C_FilterFunctionality). A beamformer only reads these lines, so
+    for a single band only a few of the block_size/2+1 lines are transformed and added up. All other lines of
+    :attr:`csm` are 0.
+
+    The FFT blocks are collected and :attr:`batch_size` of them are transformed and added to the csm at once, with one
+    matrix multiply per frequency line. If there are only a few lines (not more than log2(block_size)), they are
+    calculated with a DFT (a matrix multiply with the time data) instead of a FFT of the whole block.
+    """
+
+    #: Number of FFT blocks, which are transformed and added to the csm at once
+    batch_size = Int(32, desc="number of FFT blocks per batch")
+
+    # internal identifier
+    digest = Property(depends_on=['time_data.digest', 'calib.digest', 'block_size', 'window', 'overlap', 'precision',
+                                  'ind_low', 'ind_high'])
+
+    # cos and -sin part of the windowed DFT matrix of the lines of indices, None if the FFT is used
+    _dft = Property(depends_on=['block_size', 'window', 'ind_low', 'ind_high'])
+
+    @cached_property
+    def _get_digest(self):
+        return digest(self)
+
+    @cached_property
+    def _get__dft(self):
+        bs = self.block_size
+        if len(self.indices) > log2(bs):
+            return None
+        phase = 2 * pi * outer(self.indices, arange(bs)) / bs
+        wind = self.window_(bs)
+        return cos(phase) * wind, -sin(phase) * wind
+
+    def calc_csm(self):
+        """ csm calculation """
+        t = self.time_data
+        bandCsm = self._new_band_csm(1)
+        batch = _BlockBatch(self, bandCsm)
+        bs = self.block_size
+        temp = empty((2 * bs, t.numchannels))
+        pos = bs
+        posinc = bs / self.overlap_
+        for data in t.result(bs):
+            ns = data.shape[0]
+            temp[bs:bs + ns] = data
+            while pos + bs <= bs + ns:
+                batch.add(temp[int(pos):int(pos + bs)], 0)
+                pos += posinc
+            temp[0:bs] = temp[bs:]
+            pos -= bs
+        batch.flush()
+        return self._full_csm(bandCsm[0] * self._norm())
+
+    def band_spectra(self, blocks):
+        """
+        :param blocks: array of shape (number of blocks, block_size, numchannels) with the (not windowed) time data
+        :return: array of shape (number of blocks, len(indices), numchannels) with the spectra of the blocks at the
+        lines of indices, windowed and calibrated like in PowerSpectra
+        """
+        if self._dft is None:
+            count('ffts', blocks.shape[0])
+            wind = self.window_(self.block_size)
+            spectra = fft.rfft(blocks * wind[:, newaxis], None, 1)[:, self.indices]
+        else:
+            count('dfts', blocks.shape[0])
+            dftCos, dftSin = self._dft
+            spectra = empty((blocks.shape[0], dftCos.shape[0], blocks.shape[2]), dtype='complex128')
+            spectra.real = matmul(dftCos, blocks)
+            spectra.imag = matmul(dftSin, blocks)
+        if self.calib and self.calib.num_mics > 0:
+            if self.calib.num_mics == blocks.shape[2]:
+                spectra *= self.calib.data[newaxis, newaxis, :]
+            else:
+                raise ValueError("Calibration data not compatible: %i, %i" % (self.calib.num_mics, blocks.shape[2]))
+        return spectra.astype(self.precision, copy=False)
+
+    def _new_band_csm(self, number):
+        """ :return: number empty csms, which only have the lines of indices """
+        nc = self.time_data.numchannels
+        return zeros((number, len(self.indices), nc, nc), dtype=self.precision)
+
+    def _norm(self):
+        """ :return: normalization factor of the csm (num_blocks is the number of blocks of the whole time data) """
+        wind = self.window_(self.block_size)
+        # onesided spectrum: multiplication by 2.0=sqrt(2)^2
+        return 2.0 / self.block_size / dot(wind, wind) / self.num_blocks
+
+    def _full_csm(self, bandCsm):
+        """ :return: csm with all lines, the lines of indices are taken from bandCsm, all others are 0 """
+        csm = zeros((self.block_size // 2 + 1,) + bandCsm.shape[1:], dtype=self.precision)
+        csm[self.indices] = bandCsm
+        return csm
+
+
+class _BlockBatch:
+    """ Collects FFT blocks of a BandPowerSpectra object and adds them batch_size at a time to the csms """
+
+    def __init__(self, spectra, bandCsms):
+        """
+        :param spectra: BandPowerSpectra
+        :param bandCsms: array of shape (number of sectors, len(indices), numchannels, numchannels), the blocks are
+        added to it
+        """
+        self.spectra = spectra
+        self.bandCsms = bandCsms
+        self.blocks = empty((spectra.batch_size, spectra.block_size, spectra.time_data.numchannels))
+        self.sectors = empty(spectra.batch_size, dtype=int32)
+        self.count = 0
+
+    def add(self, block, nr):
+        """ adds a copy of block (shape (block_size, numchannels)) to the batch, for the csm of sector nr """
+        self.blocks[self.count] = block
+        self.sectors[self.count] = nr
+        self.count += 1
+        if self.count == len(self.sectors):
+            self.flush()
+
+    def flush(self):
+        """ transforms all collected blocks and adds them to the csms """
+        if not self.count:
+            return
+        spectra = self.spectra.band_spectra(self.blocks[:self.count])
+        sectors = self.sectors[:self.count]
+        numbers = unique(sectors)
+        for nr in numbers:
+            addToCsm(self.bandCsms[nr], spectra if len(numbers) == 1 else spectra[sectors == nr])
+        self.count = 0
+
+
+class SectorPowerSpectra(BandPowerSpectra):
+    """
+    Provides the cross spectral matrices of all angle sectors of a rotating measurement.
+
+    The time data (e.g. from SpatialInterpolatorRotation, without any zeroing) is walked through only once. Every FFT
+    block gets assigned to the angle sector its samples belong to and is added to the csm of this sector. A block which
+    reaches over the border of two sectors is added to both csms, each time with the samples of the other sector set to
+    0. So the csm of every sector is the same as the one of a PowerSpectra object, whose time data is zeroed outside of
+    the sector, but the interpolation and FFT is done once for all sectors. Like for BandPowerSpectra only the lines of
+    :attr:`indices` are calculated.
+    :attr:`csm` returns the csm of the sector :attr:`sector`, so a BeamformerBase object can be evaluated for every
+    sector just by changing :attr:`sector`.
+    """
+
+    #: Intervalls of all sectors, as returned by getIntervallsByDegreeOverlapping:
+    #: [ [ [StartA1, EndA1], [StartA2, EndA2] ], [ [StartB1, EndB1], ...] ]. Start and end samples are both part of
+    #: the sector, the sectors must not overlap
+    intervalls = List()
+
+    #: Number of the sector, which csm is returned by :attr:`csm`
+    sector = Int(0, desc="index of the sector")
+
+    #: Number of sectors, readonly
+    numsectors = Property(depends_on=['intervalls'])
+
+    #: Number of the sector for every sample of the time data, -1 for samples which are in no sector; readonly
+    sample_sectors = Property(depends_on=['intervalls', 'time_data.numsamples'])
+
+    #: The cross spectral matrices of all sectors at the lines of :attr:`indices`,
+    #: (numsectors, len(indices), numchannels, numchannels) array of complex; readonly
+    sector_csm = Property(depends_on=['time_data.digest', 'calib.digest', 'block_size', 'window', 'overlap',
+                                      'precision', 'ind_low', 'ind_high', '_intervalls_digest'])
+
+    # internal identifier of intervalls, str(intervalls) is not unique for numpy arrays
+    _intervalls_digest = Property(depends_on=['intervalls'])
+
+    # internal identifier
+    digest = Property(depends_on=['time_data.digest', 'calib.digest', 'block_size', 'window', 'overlap', 'precision',
+                                  'ind_low', 'ind_high', '_intervalls_digest', 'sector'])
+
+    @cached_property
+    def _get_digest(self):
+        return digest(self)
+
+    @cached_property
+    def _get__intervalls_digest(self):
+        h = md5()
+        for ints in self.intervalls:
+            h.update(array(ints, dtype=int64).tobytes())
+            h.update(b'|')
+        return h.hexdigest()
+
+    @cached_property
+    def _get_numsectors(self):
+        return len(self.intervalls)
+
+    @cached_property
+    def _get_sample_sectors(self):
+        labels = full(self.time_data.numsamples, -1, dtype=int32)
+        for nr, ints in enumerate(self.intervalls):
+            for start, end in ints:
+                labels[start:end + 1] = nr
+        return labels
+
+    @cached_property
+    def _get_sector_csm(self):
+        return self.calc_sector_csm()
+
+    def calc_sector_csm(self):
+        """
+        Calculates the csms of all sectors with one pass over the time data
+        :return: array of shape (numsectors, len(indices), numchannels, numchannels)
+        """
+        t = self.time_data
+        bandCsm = self._new_band_csm(self.numsectors)
+        batch = _BlockBatch(self, bandCsm)
+        labels = self.sample_sectors
+        bs = self.block_size
+        temp = empty((2 * bs, t.numchannels))
+        tempLabels = full(2 * bs, -1, dtype=int32)
+        pos = bs
+        posinc = bs / self.overlap_
+        count = 0   # number of samples which have been read so far
+        for data in t.result(bs):
+            ns = data.shape[0]
+            temp[bs:bs + ns] = data
+            tempLabels[bs:bs + ns] = labels[count:count + ns]
+            while pos + bs <= bs + ns:
+                block = temp[int(pos):int(pos + bs)]
+                blockLabels = tempLabels[int(pos):int(pos + bs)]
+                if (blockLabels == blockLabels[0]).all():  # whole block inside of one sector
+                    if blockLabels[0] >= 0:
+                        batch.add(block, blockLabels[0])
+                else:   # block on the border of sectors -> add it to each with the samples of the others zeroed
+                    for nr in set(blockLabels.tolist()):
+                        if nr < 0:
+                            continue
+                        batch.add(block * (blockLabels == nr)[:, newaxis], nr)
+                pos += posinc
+            temp[0:bs] = temp[bs:]
+            tempLabels[0:bs] = tempLabels[bs:]
+            pos -= bs
+            count += ns
+        batch.flush()
+        # num_blocks is the number of blocks of the whole time data, like for PowerSpectra with zeroed time data
+        bandCsm *= self._norm()
+        return bandCsm
+
+    def calc_csm(self):
+        """ csm of :attr:`sector` """
+        return self._full_csm(self.sector_csm[self.sector])
+
+
+class StoredSectorPowerSpectra(BandPowerSpectra):
+    """
+    Provides the cross spectral matrices of sectors like SectorPowerSpectra, but sums them up from a SectorCsmStore
+    instead of reading the time data. So the number of sectors (:attr:`nrIntervalls`) and the used revolutions can be
+    changed without calculating the spectra again.
+    block_size, window, overlap, ind_low and ind_high are taken from the store.
+    """
+
+    #: SectorCsmStore (see C_SectorCsmStore) with the spectra of the fine sectors
+    store = Any(desc="store of the spectra")
+
+    #: Number of sectors, must be a divisor of store.nrFineSectors
+    nrIntervalls = Int(10, desc="number of sectors")
+
+    #: Revolutions, whose samples are used, [] = all
+    revolutions = List(Int)
+
+    #: Number of the sector, which csm is returned by :attr:`csm`
+    sector = Int(0, desc="index of the sector")
+
+    #: Number of sectors, readonly
+    numsectors = Property(depends_on=['nrIntervalls'])
+
+    #: The cross spectral matrices of all sectors at the lines of :attr:`indices`,
+    #: (numsectors, len(indices), numchannels, numchannels) array of complex; readonly
+    sector_csm = Property(depends_on=['store', 'nrIntervalls', 'revolutions'])
+
+    # internal identifier
+    digest = Property(depends_on=['store', 'nrIntervalls', 'revolutions', 'sector'])
+
+    @on_trait_change('store')
+    def _load_settings(self):
+        """ sets the settings of the csm calculation and a TimeSamples object with sample_freq etc. of the store """
+        meta = self.store.metadata
+        self.time_data = TimeSamples(sample_freq=meta['sample_freq'], numsamples=meta['numsamples'],
+                                     numchannels=meta['numchannels'])
+        self.trait_set(block_size=meta['block_size'], window=meta['window'], overlap=meta['overlap'],
+                 precision=meta['precision'])
+        self.ind_low, self.ind_high = meta['lines'][0], meta['lines'][-1] + 1
+
+    @cached_property
+    def _get_digest(self):
+        return digest(self)
+
+    @cached_property
+    def _get_numsectors(self):
+        return self.nrIntervalls
+
+    @cached_property
+    def _get_sector_csm(self):
+        return self.store.sectorCsms(self.nrIntervalls, self.revolutions)
+
+    def calc_csm(self):
+        """ csm of :attr:`sector` """
+        return self._full_csm(self.sector_csm[self.sector])
+
+
+class SparsePowerSpectra(BandPowerSpectra):
+    """
+    Provides the cross spectral matrix of time data, in which big parts are zeroed, e.g. of
+    SpatialInterpolatorRotationZeroing.
+
+    The time data is fetched via its sparseResult generator, which skips all blocks that are fully zeroed. These
+    blocks are treated as zeros, so FFT blocks that lie completely inside of them are not calculated at all (they
+    wouldn't change the csm). The result is the same as the one of PowerSpectra, also the normalization uses the number
+    of blocks of the whole time data (:attr:`num_blocks`). Like for BandPowerSpectra only the lines of :attr:`indices`
+    are calculated.
+    """
+
+    def calc_csm(self):
+        """ csm calculation """
+        t = self.time_data
+        bandCsm = self._new_band_csm(1)
+        batch = _BlockBatch(self, bandCsm)
+        bs = self.block_size
+        temp = zeros((2 * bs, t.numchannels))   # holds the blocks k-1 and k
+        lastBlock = -2  # nr of the last yielded block
+        for i, data in t.sparseResult(bs):
+            k = i // bs
+            if k > lastBlock + 1:   # blocks in between were skipped, so they are zeros
+                if lastBlock >= 0:
+                    temp[:bs] = temp[bs:]
+                    temp[bs:] = 0
+                    self._add_blocks(batch, temp, lastBlock + 1, False)
+                temp[:bs] = 0
+            else:
+                temp[:bs] = temp[bs:]
+            temp[bs:] = 0
+            temp[bs:bs + data.shape[0]] = data
+            self._add_blocks(batch, temp, k, True)
+            lastBlock = k
+        if lastBlock >= 0:  # FFT blocks reaching from the last yielded block into the following (zeroed) samples
+            temp[:bs] = temp[bs:]
+            temp[bs:] = 0
+            self._add_blocks(batch, temp, lastBlock + 1, False)
+        batch.flush()
+        return self._full_csm(bandCsm[0] * self._norm())
+
+    def _add_blocks(self, batch, temp, k, lastBlockYielded):
+        """
+        Adds all FFT blocks, whose last sample lies inside of the time data block k, to the batch
+        :param temp: array of shape (2*block_size, numchannels) with the time data blocks k-1 and k
+        :param lastBlockYielded: False if block k is zeroed, then the FFT block that lies completely inside of it is
+        skipped
+        """
+        bs = self.block_size
+        posinc = bs // self.overlap_
+        stop = bs + 1 if lastBlockYielded else bs
+        for pos in range(posinc, stop, posinc):
+            start = (k - 1) * bs + pos  # nr of the first sample of the FFT block
+            if start < 0 or start + bs > self.time_data.numsamples:
+                continue
+            batch.add(temp[pos:pos + bs], 0)
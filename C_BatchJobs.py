@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Inside this script are the functions of the batch runner (see G_BatchRunner.py) defined. A job is a dict with the
+settings of A_FilterStandingSource.py / A_FilterStandingSourceSpeakerLine.py (see DEFAULTS) and runJob calculates the
+same maps for it, without plotting them. The jobs are read from a TOML or YAML job list (see BatchJobs.toml).
+"""
+import json
+import time as t
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import lru_cache
+from math import pi, sqrt
+from os import path, makedirs, replace, stat, cpu_count
+
+from acoular import config, SteeringVector, BeamformerBase, MicGeom, RectGrid, RotatingFlow, MaskedTimeSamples, \
+    __file__ as acoularFile
+from acoular.tprocess import SpatialInterpolatorRotation
+from numba import config as numbaConfig, set_num_threads
+from numpy import array
+
+from B_Acoular_Beamformer import AdaptiveBeamformer
+from B_Acoular_Environments import CachedGeneralFlowEnvironment
+from B_Acoular_Grids import SectorGrid
+from B_Acoular_SourceAndTprocess import ZeroedMaskedTimeSamples, CachedAngleTracker, TrackerChannelTrigger
+from B_Acoular_Spectra import SectorPowerSpectra, BandPowerSpectra, StoredSectorPowerSpectra
+from C_DiskCache import DiskCache
+from C_FilterFunctionality import getIntervallsByDegreeOverlapping, averageAndMinimum, averageAndMinimumBands, \
+    thirdOctaveBands, bandLimits, integrateMaps, sectorIndices
+from C_Instrumentation import stage
+from C_MapStack import MapStack, gridMetadata
+from C_SectorCsmStore import SectorCsmStore
+
+#: settings of a job and their defaults. Relative paths are relative to the folder of the job list
+DEFAULTS = {
+    'name': None,               # name of the job, default: h5savefileName without ".h5"
+    'h5Folder': path.join('micData', 'Simuliert'),
+    'h5savefileName': None,     # name of the h5 file, in which the microph. data is stored (required)
+    'triggerFileName': None,    # h5 file in h5Folder with the trigger signal. None: channel trackerChannel of the
+    'trackerChannel': None,     # microphone data is the trigger signal
+    'startSample': None,        # first and last sample (None = first/last of the file)
+    'stopSample': None,
+    'micgeoName': 'tub_vogel63.xml',    # file in the xml folder of acoular or path of the microphone geometry
+    'mapFolder': 'Maps',        # folder in which the maps are stored
+    'inc': 0.01,                # size of the map pixels in m
+    'sideLenGrid': 1.6,         # length of each side of the scanning grid
+    'Z': 0.991,                 # distance: microphone array <-> sound source in m
+    'nrIntervalls': 10,         # number of angle sectors
+    'sectors': [[0, 0.5, 0.1]],     # areas over which the sound volume is integrated, [[x0, y0, r0], ...]
+    'sectorsOnly': False,       # True: only the grid points inside of the sectors are beamformed (see SectorGrid)
+    'coarseStep': 0,            # >1: coarse to fine beamforming (see AdaptiveBeamformer), not with sectorsOnly
+    'refineRange': 10,          # level range in dB below the maximum of the coarse map, which is refined
+    'bSize': 1024,              # block size for calculating the csm
+    'freqs': [1500],            # frequencies of interest
+    'thirdOctaves': None,       # [fmin, fmax]: freqs = thirdOctaveBands(fmin, fmax)
+    'bandwidth': 3,             # 0 = single frequency line, 3 = third octave band
+    'c0': 343,                  # speed of sound
+    'temp': None,               # room temperature, if given c0 is calculated from it
+    'threshold': 4,             # settings of the Trigger
+    'triggerType': 'dirac',
+    'multiplePeaksInHunk': 'extremum',
+    'rotDirection': -1,         # settings of the AngleTracker
+    'interpPoints': 4,
+    'nrFineSectors': 0,         # >0: csms are summed up from a SectorCsmStore, see A_FilterStandingSource.py
+    'revolutions': [],
+    'minSoundVolume': 10,       # see averageAndMinimum
+    'prefetch': 0,              # >0: number of slabs of the microphone data read ahead in a background thread
+}
+
+
+def loadJobs(jobFile):
+    """
+    Reads a job list. It is a TOML file (.toml) or a YAML file (.yaml/.yml, needs PyYAML) with an optional table
+    "defaults" and the list "jobs" with a table for every job. Every job gets the DEFAULTS, overwritten by the
+    "defaults" of the file and then by its own settings.
+    :param jobFile: name of the job list
+    :return: list with a dict of all settings for every job, with absolute paths
+    """
+    if jobFile.endswith('.toml'):
+        import tomllib
+        with open(jobFile, 'rb') as f:
+            jobList = tomllib.load(f)
+    elif jobFile.endswith(('.yaml', '.yml')):
+        import yaml     # PyYAML is only needed for YAML job lists
+        with open(jobFile) as f:
+            jobList = yaml.safe_load(f) or {}
+    else:
+        raise ValueError(f"{jobFile} is neither a .toml nor a .yaml file")
+
+    baseFolder = path.dirname(path.abspath(jobFile))
+    fileDefaults = jobList.get('defaults', {})
+    jobs = []
+    for nr, settings in enumerate(jobList.get('jobs', [])):
+        unknown = (set(fileDefaults) | set(settings)) - set(DEFAULTS)
+        if unknown:
+            raise ValueError(f"job {nr} in {jobFile}: unknown settings {sorted(unknown)}")
+        job = {**DEFAULTS, **fileDefaults, **settings}
+        if not job['h5savefileName']:
+            raise ValueError(f"job {nr} in {jobFile}: h5savefileName is missing")
+        if job['triggerFileName'] is None and job['trackerChannel'] is None:
+            raise ValueError(f"job {nr} in {jobFile}: either triggerFileName or trackerChannel is needed")
+        job['name'] = job['name'] or job['h5savefileName'][0:-3]
+        job['h5Folder'] = path.join(baseFolder, job['h5Folder'])
+        job['mapFolder'] = path.join(baseFolder, job['mapFolder'])
+        micgeofile = path.join(baseFolder, job['micgeoName'])
+        if not path.isfile(micgeofile):
+            micgeofile = path.join(path.split(acoularFile)[0], 'xml', job['micgeoName'])
+        job['micgeofile'] = micgeofile
+        if job['thirdOctaves']:
+            job['freqs'] = thirdOctaveBands(*job['thirdOctaves'])
+        if job['temp'] is not None:
+            job['c0'] = sqrt(1.4 * 8.314462 * (273.15 + job['temp']) / 0.02896)
+        jobs.append(job)
+    return jobs
+
+
+def jobKey(job):
+    """
+    :return: hex string, which identifies the settings of job and the state (size and modification time) of its h5
+    files. A changed setting or a newly written measurement leads to a new key
+    """
+    files = [path.join(job['h5Folder'], job['h5savefileName'])]
+    if job['triggerFileName']:
+        files.append(path.join(job['h5Folder'], job['triggerFileName']))
+    fileStates = [(stat(f).st_size, stat(f).st_mtime_ns) if path.isfile(f) else None for f in files]
+    return DiskCache.key(sorted((k, repr(v)) for k, v in job.items() if k != 'name'), fileStates)
+
+
+def jobOutputs(job):
+    """ :return: dict with the names of the MapStacks of every frequency, the sweep, the csm store and the done file """
+    name, n, bnd = job['name'], job['nrIntervalls'], job['bandwidth']
+    suffix = "_sectors_" if job['sectorsOnly'] else "_"     # maps of a SectorGrid
+    return {'maps': [name + "freq" + str(round(f)) + "_nrInts" + str(n) + "_bnd" + str(bnd) + suffix
+                     for f in job['freqs']],
+            'sweep': name + "sweep" + str(len(job['freqs'])) + "_nrInts" + str(n) + "_bnd" + str(bnd) + suffix,
+            'csmStore': name + "_csm" + str(job['nrFineSectors']),
+            'done': name + "_nrInts" + str(n) + "_bnd" + str(bnd) + "_job.json"}
+
+
+def isDone(job, key=None):
+    """ :return: True, if job was finished with the same settings and measurement before (see jobKey) """
+    doneFile = path.join(job['mapFolder'], jobOutputs(job)['done'])
+    if not path.isfile(doneFile):
+        return False
+    with open(doneFile) as f:
+        done = json.load(f)
+    return done.get('key') == (key or jobKey(job)) and all(MapStack.exists(job['mapFolder'], name)
+                                                           for name in jobOutputs(job)['maps'])
+
+
+# ------ warm objects, created once per process and shared by all jobs with the same setup
+@lru_cache(maxsize=None)
+def _micGeom(micgeofile):
+    return MicGeom(from_file=micgeofile)
+
+
+@lru_cache(maxsize=None)
+def _grid(sideLenGrid, Z, inc):
+    return RectGrid(x_min=-sideLenGrid/2, x_max=sideLenGrid/2, y_min=-sideLenGrid/2, y_max=sideLenGrid/2, z=Z,
+                    increment=inc)
+
+
+@lru_cache(maxsize=None)
+def _beamGrid(gridSettings, sectors):
+    """ :return: RectGrid of gridSettings, or SectorGrid of its points inside of sectors (tuple of tuples) """
+    if sectors is None:
+        return _grid(*gridSettings)
+    return SectorGrid(grid=_grid(*gridSettings), sectors=[list(sector) for sector in sectors])
+
+
+@lru_cache(maxsize=8)
+def _steeringVector(micgeofile, gridSettings, c0, rpm, sectors=None):
+    """ SteeringVector of a rotating flow, its distances are calculated once (or loaded from the cache) """
+    rotfield = RotatingFlow(rpm=rpm, v0=0, origin=array((0., 0., 0.)))
+    envRot = CachedGeneralFlowEnvironment(c=c0, N=1000, ff=rotfield, Om=12)
+    return SteeringVector(grid=_beamGrid(gridSettings, sectors), mics=_micGeom(micgeofile), env=envRot)
+
+
+def _sectorsKey(job):
+    """ :return: sectors of the SectorGrid of a job as tuple of tuples, None if the whole grid is beamformed """
+    return tuple(tuple(sector) for sector in job['sectors']) if job['sectorsOnly'] else None
+
+
+def warmKey(job):
+    """ :return: key of the warm objects (microphone geometry and grid) of a job, jobs with the same key share them """
+    return job['micgeofile'], job['sideLenGrid'], job['Z'], job['inc'], _sectorsKey(job)
+
+
+def _openMapStacks(job, key, grid, force=False):
+    """
+    :return: MapStacks of all frequencies. Existing ones of an interrupted run with the same key are opened again (if
+    not force), so the maps already calculated don't have to be calculated again
+    """
+    mapStacks = []
+    for f, name in zip(job['freqs'], jobOutputs(job)['maps']):
+        if not force and MapStack.exists(job['mapFolder'], name) and \
+                MapStack(job['mapFolder'], name).metadata.get('job') == key:
+            mapStacks.append(MapStack(job['mapFolder'], name, 'r+'))
+        else:
+            mapStacks.append(MapStack.create(job['mapFolder'], name, grid.shape, job['nrIntervalls'], freq=f,
+                                             bandwidth=job['bandwidth'], nrIntervalls=job['nrIntervalls'],
+                                             grid=gridMetadata(grid), job=key))
+    return mapStacks
+
+
+def runJob(job, force=False):
+    """
+    Calculates the maps of the sectors of a job like A_FilterStandingSource.py, the Average, Min and Standing maps and
+    the sound levels integrated over job['sectors']. A job which is done already (see isDone) is skipped, an interrupted
+    one is resumed behind the last stored map. The done file (see jobOutputs) is written at last.
+    :param job: dict with all settings, as returned by loadJobs
+    :param force: if True, the job is calculated again, even if it is done already
+    :return: dict with name, status ('done' or 'skipped'), time and the done file
+    """
+    T = t.time()
+    key = jobKey(job)
+    outputs = jobOutputs(job)
+    doneFile = path.join(job['mapFolder'], outputs['done'])
+    if not force and isDone(job, key):
+        return {'name': job['name'], 'status': 'skipped', 'time': 0., 'doneFile': doneFile}
+    makedirs(job['mapFolder'], exist_ok=True)
+    freqs, bandwidth, nrIntervalls = job['freqs'], job['bandwidth'], job['nrIntervalls']
+
+    mg = _micGeom(job['micgeofile'])
+    gridSettings = (job['sideLenGrid'], job['Z'], job['inc'])
+    g = _beamGrid(gridSettings, _sectorsKey(job))     # grid of the maps
+
+    microdataFileName = path.join(job['h5Folder'], job['h5savefileName'])
+    if not path.isfile(microdataFileName):
+        raise IOError(f"No such file: {microdataFileName}")
+    microphonedata = ZeroedMaskedTimeSamples(name=microdataFileName, prefetch=job['prefetch'])
+    tr = MaskedTimeSamples(name=path.join(job['h5Folder'], job['triggerFileName'] or job['h5savefileName']))
+    if job['triggerFileName'] is None:
+        microphonedata.invalid_channels = [job['trackerChannel']]
+        tr.invalid_channels = [c for c in range(tr.numchannels_total) if c != job['trackerChannel']]
+    for ts in (microphonedata, tr):
+        if job['startSample'] is not None:
+            ts.start = job['startSample']
+        if job['stopSample'] is not None:
+            ts.stop = job['stopSample']
+    trigger = TrackerChannelTrigger(source=tr, threshold=job['threshold'], trigger_type=job['triggerType'],
+                                    multiple_peaks_in_hunk=job['multiplePeaksInHunk'])
+    rotdata = SpatialInterpolatorRotation(mics=mg, method='linear', array_dimension='2D', interp_at_zero=False,
+                                          source=microphonedata)
+    angletracker = CachedAngleTracker(trigger=trigger, source=microphonedata, rot_direction=job['rotDirection'],
+                                      interp_points=job['interpPoints'])
+    rotdata.angle_source = angletracker
+    with stage('angletracker', job=job['name']):
+        averageRpm = angletracker.average_rpm
+    steerRot = _steeringVector(job['micgeofile'], gridSettings, job['c0'], int(averageRpm), _sectorsKey(job))
+
+    mapStacks = _openMapStacks(job, key, g, force)
+    firstNr = min(stack.count for stack in mapStacks)
+    if firstNr < nrIntervalls:
+        if job['nrFineSectors']:
+            bandSpectra = BandPowerSpectra(time_data=rotdata, window='Hanning', overlap='50%', block_size=job['bSize'])
+            bandSpectra.ind_low, bandSpectra.ind_high = bandLimits(bandSpectra.fftfreq(), freqs, bandwidth)
+            with stage('csmStore', job=job['name']):
+                store = SectorCsmStore.cached(job['mapFolder'], outputs['csmStore'], bandSpectra, angletracker,
+                                              job['nrFineSectors'])
+            psRot = StoredSectorPowerSpectra(store=store, nrIntervalls=nrIntervalls, revolutions=job['revolutions'])
+        else:
+            intervalls = getIntervallsByDegreeOverlapping(2 * pi / nrIntervalls, angletracker)
+            psRot = SectorPowerSpectra(time_data=rotdata, window='Hanning', overlap='50%', block_size=job['bSize'],
+                                       intervalls=intervalls)
+            psRot.ind_low, psRot.ind_high = bandLimits(psRot.fftfreq(), freqs, bandwidth)
+        if job['coarseStep'] > 1 and not job['sectorsOnly']:
+            bfRot = AdaptiveBeamformer(freq_data=psRot, steer=steerRot, r_diag=True, coarse_step=job['coarseStep'],
+                                       db_range=job['refineRange'])
+        else:
+            bfRot = BeamformerBase(freq_data=psRot, steer=steerRot, r_diag=True)
+        with stage('sector_csm', job=job['name']):
+            psRot.sector_csm    # one pass over the microphonedata for all sectors
+        for nr in range(firstNr, psRot.numsectors):
+            psRot.sector = nr
+            with stage('beamforming', job=job['name'], sector=nr):
+                for f, mapStack in zip(freqs, mapStacks):
+                    mapStack[nr] = bfRot.synthetic(f, bandwidth)
+            print(f"{job['name']} [{nr + 1}/{nrIntervalls}]\033[92m sector done \u001b[0m")
+
+    if len(freqs) > 1:
+        averageAndMinimumBands(job['mapFolder'], outputs['maps'], outputs['sweep'], nrIntervalls - 1,
+                               job['minSoundVolume'], nrIntervalls, freqs=freqs, bandwidth=bandwidth,
+                               nrIntervalls=nrIntervalls, grid=gridMetadata(g))
+    else:
+        averageAndMinimum(job['mapFolder'], outputs['maps'][0], nrIntervalls - 1, job['minSoundVolume'], nrIntervalls)
+    sectorInds = sectorIndices(g, job['sectors'])
+    levels = {str(round(f)): integrateMaps(stack[:nrIntervalls], sectorInds).tolist()
+              for f, stack in zip(freqs, mapStacks)}
+
+    result = {'name': job['name'], 'status': 'done', 'time': t.time() - T, 'doneFile': doneFile}
+    with open(doneFile + '.tmp', 'w') as f:
+        json.dump({'key': key, 'job': job, 'outputs': outputs, 'levels': levels, 'time': result['time']}, f, indent=1)
+    replace(doneFile + '.tmp', doneFile)    # written at last, so only finished jobs are skipped
+    return result
+
+
+def _runJobGroup(jobs, force):
+    """ runs jobs one after another in this process, so they share the warm objects. Failed jobs are skipped """
+    results = []
+    for job in jobs:
+        try:
+            results.append(runJob(job, force))
+        except Exception:
+            results.append({'name': job['name'], 'status': 'failed', 'time': 0., 'error': traceback.format_exc()})
+    return results
+
+
+def _initWorker(caching, threads):
+    config.global_caching = caching
+    set_num_threads(threads)
+
+
+def scheduleJobs(jobs, workers):
+    """
+    Groups the jobs by their warm objects (see warmKey), every group is run by one worker process. If there are less
+    groups than workers, the biggest groups are split, so all workers get something to do
+    :return: list of lists of jobs
+    """
+    groups = {}
+    for job in jobs:
+        groups.setdefault(warmKey(job), []).append(job)
+    groups = list(groups.values())
+    while len(groups) < workers:
+        biggest = max(groups, key=len, default=[])
+        if len(biggest) < 2:
+            break
+        groups.remove(biggest)
+        groups += [biggest[:len(biggest) // 2], biggest[len(biggest) // 2:]]
+    return groups
+
+
+def runJobs(jobs, workers=None, force=False):
+    """
+    Runs all jobs with a pool of worker processes (see scheduleJobs). With one worker they are run in this process.
+    The workers are forked, so set NUMBA_THREADING_LAYER like in the A_ scripts (see calcSectorMapsParallel)
+    :param jobs: list of jobs, as returned by loadJobs
+    :param workers: number of worker processes, None = number of cpus
+    :param force: see runJob
+    :return: list with the result dict of every job (see runJob), failed jobs have the status 'failed' and an 'error'
+    """
+    workers = workers or cpu_count()
+    groups = scheduleJobs(jobs, workers)
+    if workers == 1 or len(groups) == 1:
+        return _runJobGroup(jobs, force)
+    results = []
+    threads = max(1, numbaConfig.NUMBA_NUM_THREADS // workers)   # numba threads per worker
+    with ProcessPoolExecutor(max_workers=workers, initializer=_initWorker,
+                             initargs=(config.global_caching, threads)) as pool:
+        futures = [pool.submit(_runJobGroup, group, force) for group in groups]
+        for future in as_completed(futures):
+            for result in future.result():
+                print(f"\033[92m job {result['name']}: {result['status']} time={format(result['time'], '.2f')}s "
+                      f"\u001b[0m")
+                results.append(result)
+    return results
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Inside this script is the benchmark of the processing chain defined (see I_Benchmark.py). A simulated measurement (see
+C_SyntheticMeasurement) is evaluated like in A_FilterStandingSource.py and every stage is timed on its own: trigger,
+AngleTracker, getIntervallsByDegreeOverlapping, invertIntervalls, partiallyZeroedResult, rotation interpolation,
+PowerSpectra (csms of all sectors), beamforming, averageAndMinimum and the integration of the sectors. Each stage gets
+its input already calculated by the stages before, so its time doesn't contain theirs. The results are dicts, which
+are stored as json and can be compared with the ones of an earlier run (see compareToBaseline).
+"""
+import json
+import platform
+import time as t
+from contextlib import contextmanager, redirect_stdout
+from datetime import datetime
+from io import StringIO
+from math import pi
+from os import path, makedirs, cpu_count, replace
+from shutil import rmtree
+from tempfile import mkdtemp
+
+import acoular
+import numpy
+from acoular import MicGeom, MaskedTimeSamples, TimeSamples, RectGrid, SteeringVector, BeamformerBase, Environment, \
+    RotatingFlow
+from acoular.tprocess import SpatialInterpolatorRotation
+from numpy import empty, array
+
+from B_Acoular_Environments import CachedGeneralFlowEnvironment
+from B_Acoular_SourceAndTprocess import ZeroedMaskedTimeSamples, TrackerChannelTrigger, FastAngleTracker
+from B_Acoular_Spectra import SectorPowerSpectra
+from C_FilterFunctionality import getIntervallsByDegreeOverlapping, invertIntervalls, averageAndMinimum, \
+    bandLimits, loadMaps, sectorIndices, integrateMaps
+from C_MapStack import MapStack
+from C_SyntheticMeasurement import writeSyntheticMeasurement
+
+#: stages in the order they are run
+STAGES = ['trigger', 'angletracker', 'intervalls', 'invertIntervalls', 'partiallyZeroedResult', 'interpolation',
+          'powerSpectra', 'steering', 'beamforming', 'averageAndMinimum', 'integrateSources']
+
+#: parameters of the case, which every sweep starts from. Only one of them is changed for each case of a sweep
+BASE_CASE = {'samples': 102400, 'channels': 64, 'inc': 0.02, 'nrIntervalls': 10}
+
+#: settings which are the same for all cases
+DEFAULT_SETTINGS = {'sampleFreq': 51200., 'rpm': -500., 'bSize': 1024, 'freq': 1500., 'bandwidth': 3, 'Z': 1.,
+                    'sideLenGrid': 1.6, 'c0': 343., 'flow': False, 'sectors': [[0., 0.5, 0.1], [0.5, 0., 0.1]]}
+
+
+class _StageTimer:
+    """ collects the wall and cpu time of the stages, the minimum of all repetitions is kept """
+
+    def __init__(self):
+        self.wall, self.cpu = {}, {}
+
+    @contextmanager
+    def __call__(self, stage):
+        wall, cpu = t.perf_counter(), t.process_time()
+        yield
+        wall, cpu = t.perf_counter() - wall, t.process_time() - cpu
+        self.wall[stage] = min(wall, self.wall.get(stage, wall))
+        self.cpu[stage] = min(cpu, self.cpu.get(stage, cpu))
+
+
+def caseName(case):
+    """ :return: name of a case (dict with the parameters of BASE_CASE), which identifies it in the results """
+    return ",".join(f"{key}={case[key]}" for key in BASE_CASE)
+
+
+def sweepCases(sweeps, base=BASE_CASE):
+    """
+    :param sweeps: dict {parameter of BASE_CASE: list of values}
+    :return: list of the cases: the base case and for every value of every sweep the base case with this value
+    """
+    cases = [dict(base)]
+    for key, values in sweeps.items():
+        if key not in base:
+            raise ValueError(f"Unknown sweep parameter {key}, possible are {list(base)}")
+        for value in values:
+            case = dict(base, **{key: value})
+            if case not in cases:
+                cases.append(case)
+    return cases
+
+
+def benchmarkData(folder, numsamples, settings=DEFAULT_SETTINGS):
+    """
+    Writes the simulated measurement of the benchmark (DEFAULT_SOURCES of C_SyntheticMeasurement, 64 microphones of
+    tub_vogel64.xml, trigger as channel 64) into folder, if it isn't there yet. The cases use its first samples and
+    channels
+    :param numsamples: minimum number of samples
+    :return: (filename, index of the tracker channel, time needed for writing it in s, 0 if it existed)
+    """
+    duration = numsamples / settings['sampleFreq']
+    name = path.join(folder, f"benchmark_{numsamples}_fs{round(settings['sampleFreq'])}_rpm{round(settings['rpm'])}.h5")
+    if path.isfile(name):
+        return name, 64, 0.
+    makedirs(folder, exist_ok=True)
+    T = t.perf_counter()
+    # written under another name first, so an interrupted run leaves no incomplete file
+    writeSyntheticMeasurement(name + '.tmp', duration=duration, sampleFreq=settings['sampleFreq'],
+                              rpm=settings['rpm'], trackerChannel=True)
+    replace(name + '.tmp', name)
+    return name, 64, t.perf_counter() - T
+
+
+def runCase(fileName, trackerChannel, case, settings=DEFAULT_SETTINGS, repeat=1):
+    """
+    Runs all stages of the processing chain for one case
+    :param fileName: h5 file of benchmarkData
+    :param case: dict with the parameters of BASE_CASE
+    :param repeat: number of runs, the minimum time of every stage is used
+    :return: dict {'case': caseName, 'params': case, 'wall': {stage: s}, 'cpu': {stage: s}, 'total': s}
+    """
+    timer = _StageTimer()
+    for _ in range(repeat):
+        mapFolder = mkdtemp(prefix='benchmarkMaps')
+        try:
+            _runStages(timer, fileName, trackerChannel, case, settings, mapFolder)
+        finally:
+            rmtree(mapFolder, ignore_errors=True)
+    return {'case': caseName(case), 'params': dict(case), 'wall': timer.wall, 'cpu': timer.cpu,
+            'total': sum(timer.wall.values())}
+
+
+def _runStages(timer, fileName, trackerChannel, case, settings, mapFolder):
+    numsamples, numchannels, nrIntervalls = case['samples'], case['channels'], case['nrIntervalls']
+    unusedMics = list(range(numchannels, trackerChannel))
+    micgeofile = path.join(path.split(acoular.__file__)[0], 'xml', 'tub_vogel64.xml')
+    mics = MicGeom(from_file=micgeofile, invalid_channels=unusedMics)
+
+    tr = MaskedTimeSamples(name=fileName, stop=numsamples, invalid_channels=list(range(trackerChannel)))
+    trigger = TrackerChannelTrigger(source=tr, threshold=4)
+    with timer('trigger'):
+        trigger.trigger_data
+
+    data = ZeroedMaskedTimeSamples(name=fileName, stop=numsamples, invalid_channels=unusedMics + [trackerChannel])
+    angletracker = FastAngleTracker(source=data, trigger=trigger)
+    with timer('angletracker'):
+        angletracker.angle
+
+    with timer('intervalls'):
+        intervalls = getIntervallsByDegreeOverlapping(2 * pi / nrIntervalls, angletracker)
+
+    with timer('invertIntervalls'):
+        intsToZero = [invertIntervalls(ints, numsamples) for ints in intervalls]
+
+    # reading the time data once for every sector, like the scripts did before SectorPowerSpectra
+    with timer('partiallyZeroedResult'):
+        for ints in intsToZero:
+            for _ in data.partiallyZeroedResult(settings['bSize'], ints):
+                pass
+
+    rotdata = SpatialInterpolatorRotation(mics=mics, method='linear', array_dimension='2D', interp_at_zero=False,
+                                          source=data, angle_source=angletracker)
+    rotated = empty((numsamples, numchannels))
+    with timer('interpolation'):
+        count = 0
+        for block in rotdata.result(settings['bSize']):
+            rotated[count:count + block.shape[0]] = block
+            count += block.shape[0]
+
+    # the csms are calculated from the interpolated data in memory, so the interpolation isn't timed again
+    rotatedSamples = TimeSamples(data=rotated, sample_freq=data.sample_freq, numsamples=numsamples,
+                                 numchannels=numchannels)
+    ps = SectorPowerSpectra(time_data=rotatedSamples, window='Hanning', overlap='50%', block_size=settings['bSize'],
+                            intervalls=intervalls)
+    ps.ind_low, ps.ind_high = bandLimits(ps.fftfreq(), [settings['freq']], settings['bandwidth'])
+    with timer('powerSpectra'):
+        ps.sector_csm
+
+    half = settings['sideLenGrid'] / 2
+    grid = RectGrid(x_min=-half, x_max=half, y_min=-half, y_max=half, z=settings['Z'], increment=case['inc'])
+    if settings['flow']:
+        rotfield = RotatingFlow(rpm=int(angletracker.average_rpm), v0=0, origin=array((0., 0., 0.)))
+        env = CachedGeneralFlowEnvironment(c=settings['c0'], N=1000, ff=rotfield, Om=12)
+    else:
+        env = Environment(c=settings['c0'])
+    steer = SteeringVector(grid=grid, mics=mics, env=env)
+    with timer('steering'):     # distances between the grid and the microphones
+        steer.r0, steer.rm
+
+    bf = BeamformerBase(freq_data=ps, steer=steer, r_diag=True)
+    name = 'benchmark_'
+    mapStack = MapStack.create(mapFolder, name, grid.shape, nrIntervalls)
+    with timer('beamforming'):
+        for nr in range(ps.numsectors):
+            ps.sector = nr
+            mapStack[nr] = bf.synthetic(settings['freq'], settings['bandwidth'])
+        mapStack.flush()
+
+    with timer('averageAndMinimum'), redirect_stdout(StringIO()):
+        averageAndMinimum(mapFolder, name, nrIntervalls - 1, -1000, nrIntervalls)
+
+    with timer('integrateSources'):     # integrateSources without the plot
+        integrateMaps(loadMaps(mapFolder, name, nrIntervalls - 1), sectorIndices(grid, settings['sectors']))
+    del mapStack
+    for samples in (tr, data):
+        samples.h5f.close()
+
+
+def runBenchmark(folder, cases, settings=DEFAULT_SETTINGS, repeat=1, log=print):
+    """
+    Runs all cases. The simulated measurement is written once for the longest case (see benchmarkData)
+    :param folder: folder of the simulated measurement
+    :param cases: list of dicts with the parameters of BASE_CASE, see sweepCases
+    :param log: function which gets a line of progress info, None = silent
+    :return: dict with the machine, settings and the results of runCase of all cases, can be saved by saveResults
+    """
+    fileName, trackerChannel, writeTime = benchmarkData(folder, max(case['samples'] for case in cases), settings)
+    if log and writeTime:
+        log(f"simulated measurement {fileName} written, time={format(writeTime, '.2f')}s")
+    results = []
+    for nr, case in enumerate(cases):
+        results.append(runCase(fileName, trackerChannel, case, settings, repeat))
+        if log:
+            log(f"[{nr + 1}/{len(cases)}] {results[-1]['case']} total={format(results[-1]['total'], '.2f')}s")
+    return {'created': datetime.now().isoformat(timespec='seconds'), 'machine': machineInfo(),
+            'settings': dict(settings), 'repeat': repeat, 'stages': STAGES, 'results': results}
+
+
+def machineInfo():
+    """ :return: dict with the versions and the machine the benchmark ran on, for comparing results """
+    return {'platform': platform.platform(), 'processor': platform.processor(), 'cpus': cpu_count(),
+            'python': platform.python_version(), 'numpy': numpy.__version__, 'acoular': acoular.__version__}
+
+
+def saveResults(results, fileName):
+    """ writes the results of runBenchmark into a json file """
+    folder = path.dirname(fileName)
+    if folder:
+        makedirs(folder, exist_ok=True)
+    with open(fileName + '.tmp', 'w') as f:
+        json.dump(results, f, indent=1)
+    replace(fileName + '.tmp', fileName)
+
+
+def loadResults(fileName):
+    with open(fileName) as f:
+        return json.load(f)
+
+
+def compareToBaseline(results, baseline, tolerance=0.2, minTime=0.01):
+    """
+    Compares the wall times of all stages of the cases, which are in both results
+    :param results, baseline: dicts as returned by runBenchmark or loadResults
+    :param tolerance: relative change, from which on a stage counts as slower / faster
+    :param minTime: stages which need less than this in both results (in s) are always 'ok', their times are too
+    short for reliable ratios
+    :return: list of dicts {'case', 'stage', 'baseline', 'time', 'ratio', 'status'}, status is 'slower', 'faster',
+    'ok' or 'new' (no time in the baseline)
+    """
+    baseCases = {result['case']: result for result in baseline['results']}
+    rows = []
+    for result in results['results']:
+        baseWall = baseCases.get(result['case'], {}).get('wall', {})
+        for stage in list(result['wall']) + ['total']:
+            time = result['total'] if stage == 'total' else result['wall'][stage]
+            baseTime = baseCases[result['case']]['total'] if stage == 'total' and baseWall else baseWall.get(stage)
+            if baseTime is None:
+                rows.append({'case': result['case'], 'stage': stage, 'baseline': None, 'time': time, 'ratio': None,
+                             'status': 'new'})
+                continue
+            ratio = time / baseTime if baseTime > 0 else float('inf')
+            if max(time, baseTime) < minTime or abs(ratio - 1) <= tolerance:
+                status = 'ok'
+            else:
+                status = 'slower' if ratio > 1 else 'faster'
+            rows.append({'case': result['case'], 'stage': stage, 'baseline': baseTime, 'time': time, 'ratio': ratio,
+                         'status': status})
+    return rows
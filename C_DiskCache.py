@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Inside this script is DiskCache defined, a content addressed store for numpy arrays on the local disk. It is used for
+results, which are expensive to calculate, but rarely change between runs (e.g. the distances of a rotating flow
+environment).
+"""
+import json
+from hashlib import sha1
+from os import path, makedirs, listdir, remove, replace, utime, stat, getpid
+
+from numpy import ndarray, save, load, ascontiguousarray
+from numpy.lib.format import open_memmap
+
+
+class DiskCache:
+    """
+    Stores numpy arrays as .npy files in :attr:`folder`. The filename is a hash over everything the array depends on
+    (see :meth:`key`), so changed inputs just lead to a new entry. If the files in the folder get bigger than
+    :attr:`maxBytes` together, the least recently used ones are deleted.
+    """
+
+    def __init__(self, folder, maxBytes=2 * 1024 ** 3):
+        """
+        :param folder: folder in which the arrays are stored, gets created if necessary
+        :param maxBytes: maximum size of all stored arrays together
+        """
+        self.folder = folder
+        self.maxBytes = maxBytes
+
+    @staticmethod
+    def key(*parts):
+        """
+        :param parts: numpy arrays (dtype, shape and content are hashed) or anything else with a unique repr()
+        :return: hex string, which identifies the combination of parts
+        """
+        h = sha1()
+        for part in parts:
+            if isinstance(part, ndarray):
+                h.update(repr((part.dtype.str, part.shape)).encode("UTF-8"))
+                h.update(ascontiguousarray(part).tobytes())
+            else:
+                h.update(repr(part).encode("UTF-8"))
+            h.update(b'|')
+        return h.hexdigest()
+
+    def fileHash(self, fileName, blockSize=16 * 1024 ** 2):
+        """
+        :return: sha1 hex string of the content of the file fileName. It is stored in folder/fileHashes.json together
+        with the size and modification time of the file, so the file is only read again if it has changed
+        """
+        fileName = path.abspath(fileName)
+        fileStat = stat(fileName)
+        state = [fileStat.st_size, fileStat.st_mtime_ns]
+        hashesFile = path.join(self.folder, 'fileHashes.json')
+        try:
+            with open(hashesFile) as f:
+                hashes = json.load(f)
+        except (FileNotFoundError, ValueError):
+            hashes = {}
+        if hashes.get(fileName, {}).get('state') != state:
+            h = sha1()
+            with open(fileName, 'rb') as f:
+                for block in iter(lambda: f.read(blockSize), b''):
+                    h.update(block)
+            hashes[fileName] = {'state': state, 'hash': h.hexdigest()}
+            makedirs(self.folder, exist_ok=True)
+            tempName = hashesFile + f'.{getpid()}.tmp'
+            with open(tempName, 'w') as f:
+                json.dump(hashes, f, indent=1)
+            replace(tempName, hashesFile)
+        return hashes[fileName]['hash']
+
+    def fileName(self, key):
+        return path.join(self.folder, key + '.npy')
+
+    def load(self, key, mmap_mode=None):
+        """
+        :param mmap_mode: see numpy.load, e.g. 'r' to open the array as memmap
+        :return: the array stored for key, None if there is none
+        """
+        fileName = self.fileName(key)
+        try:
+            data = load(fileName, mmap_mode=mmap_mode)
+        except (FileNotFoundError, ValueError, EOFError):   # not stored or evicted by another process meanwhile
+            return None
+        utime(fileName)     # marks the entry as recently used for the eviction
+        return data
+
+    def save(self, key, data):
+        """ stores data for key, afterwards old entries are evicted if the cache is too big """
+        makedirs(self.folder, exist_ok=True)
+        # written to a temporary file first, so other processes never load a half written entry
+        tempName = self.fileName(key) + f'.{getpid()}.tmp'
+        with open(tempName, 'wb') as f:
+            save(f, data)
+        replace(tempName, self.fileName(key))
+        self.evict(keep=key)
+
+    def saveBlocks(self, key, blocks, shape, dtype):
+        """
+        Like save, but the array is written block by block into the file (as memmap), so it never has to be in the
+        memory as a whole
+        :param blocks: iterable of arrays, which are put one after another along the first axis
+        :param shape: shape of the whole array
+        :param dtype: dtype of the array
+        """
+        makedirs(self.folder, exist_ok=True)
+        tempName = self.fileName(key) + f'.{getpid()}.tmp'
+        data = open_memmap(tempName, mode='w+', dtype=dtype, shape=shape)
+        i = 0
+        for block in blocks:
+            data[i:i + block.shape[0]] = block
+            i += block.shape[0]
+        data.flush()
+        del data
+        replace(tempName, self.fileName(key))
+        self.evict(keep=key)
+
+    def cached(self, key, calc, mmap_mode=None):
+        """
+        :param calc: function without parameters, which calculates the array if there is none stored for key
+        :return: the stored array for key, or the result of calc, which gets stored
+        """
+        data = self.load(key, mmap_mode)
+        if data is None:
+            data = calc()
+            self.save(key, data)
+        return data
+
+    def evict(self, keep=None):
+        """
+        deletes the least recently used entries until all together are smaller than maxBytes
+        :param keep: key of an entry, which is never deleted (e.g. the one which was just saved)
+        """
+        entries = []
+        for fileName in listdir(self.folder):
+            if fileName.endswith('.npy'):
+                fileStat = stat(path.join(self.folder, fileName))
+                entries.append((fileStat.st_mtime, fileStat.st_size, fileName))
+        size = sum(entry[1] for entry in entries)
+        for _, fileSize, fileName in sorted(entries):
+            if size <= self.maxBytes:
+                break
+            if fileName == path.basename(self.fileName(keep or '')):
+                continue
+            try:
+                remove(path.join(self.folder, fileName))
+            except FileNotFoundError:
+                pass
+            size -= fileSize
@@ -1,214 +1,219 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 from cmath import pi
+from math import ceil, floor, log2
 from os import path
 
-from acoular import L_p, integrate
+from acoular import L_p
 from matplotlib import pyplot as plt
 from matplotlib.patches import Circle
-from numpy import save, load, array, minimum
+from numpy import save, load, minimum, maximum, asarray, searchsorted, arange, concatenate, flatnonzero, stack, \
+    argsort, split, cumsum, bincount, diff, zeros, int64, empty, atleast_1d, add
+from numpy.lib.format import open_memmap
+
+from B_Acoular_Grids import SectorGrid, rectGridIndices
+from C_Instrumentation import timed
+from C_IntervalSet import IntervalSet
+from C_MapStack import MapStack
 
 
 def calcNegativeOfIntervall(intervalls):
     """
     :param intervalls: must have the form [ [StartA1, EndA1], [StartA2, EndA2]  ]
-    :return: Inverted version of intervalls
+    :return: Inverted version of intervalls as IntervalSet: all gaps from sample 0 up to the end of the last intervall
     """
-    intervallsToZero = []
-    start, stop = 0, 0
-
-    # merge intervalls:
-    nrEntries = len(intervalls)
-    mergedIntervalls = []
-    n = 0
-    while n < nrEntries - 1:
-        if intervalls[n][1]+1 == intervalls[n+1][0]:
-            mergedIntervalls.append([intervalls[n][0], intervalls[n+1][1]])
-            n += 2
-        else:
-            mergedIntervalls.append(intervalls[n])
-            n += 1
-
-    # Invert intervalls
-    for i in mergedIntervalls:
-        if intervalls[0] == 0:  # Intervall beinhaltet das aller erste Sample
-            start = i[1] + 1
-        else:
-            stop = i[0] - 1
-            intervallsToZero.append([start, stop])
-            start = i[1] + 1
+    intervalls = IntervalSet(intervalls)
+    if not len(intervalls):
+        return intervalls
+    return intervalls.invert(0, int(intervalls.ends[-1]) + 1)
 
 
-    return intervallsToZero
-
+@timed('intervalls')
 def getIntervallsByDegreeOverlapping(angleRes, angletracker):
     """
-    :param angleArray: From the trigger the angles for each time sample
     :param angleRes: Width of the intervals (in multiples of pi). E.g. res = pi/2 -> method returns 4 Intervall
     groups. [[g1],[g2],[g3],[g4] ; g1 = [[start1, stop1], [start2,stop2], ...] start1 = nr of time sample where degree
      = 0, stop1 = nr of time sample where degree = pi/2 first time, start2 = nr of time sample where degree = 0 for
      second time
-    :return: intervall in form of: [ [ [StartA1, EndA1], [StartA2, EndA2]  ],   [  [StartB1, EndB1], [...]  ]  ]
+    :param angletracker: AngleTracker with the angles for each time sample. Works for both rotation directions
+    (angletracker.rot_direction)
+    :return: intervall in form of: [ array([[StartA1, EndA1], [StartA2, EndA2]]),   array([[StartB1, EndB1], [...]]) ]
     StartA ->
     Nr of the first sample which is in group A, StartA2 Nr of the sample where for the second time angle is in group A.
-    group A e.g. 0°->10°, group B 10.01° -> 20°
+    group A e.g. 0°->10°, group B 10.01° -> 20°. Every group is an int array of shape (K, 2), Start and End are both
+    part of the intervall
     """
-    angleArray = angletracker.angle
-    intervals = []
-    cuttedIntervals = []  #
-    if 2 * pi % angleRes >= 0.05:
-        raise Exception(f"2*pi is no multiple of resolution, res is {angleRes / pi} pi")
+    labels = sectorLabels(angleRes, angletracker)[0]
+    nrInts = int(round(2 * pi / angleRes))    # Number of intervalls
 
-    for i in range(int(2 * pi / angleRes)):  # Number of intervalls
-        intervals.append([])  # -> intervals= [[start],[]]
-        cuttedIntervals.append([])
-    n = len(intervals) - 1  # Höchster Index von intervals
-    currN = int(angleArray[0] // angleRes)  # Gibt an, welches Winkelintervall vervollständigt wird. currN <= n?
-    intervals[currN].append([0, None])
+    # change points: samples which are in a different sector than the sample before
+    starts = concatenate(([0], flatnonzero(labels[1:] != labels[:-1]) + 1))
+    ends = concatenate((starts[1:] - 1, [len(labels) - 1]))
+    startEnd = stack((starts, ends), axis=1)
+    startLabels = labels[starts]
+
+    order = argsort(startLabels, kind='stable')
+    return split(startEnd[order], cumsum(bincount(startLabels, minlength=nrInts))[:-1])
+
+
+def sectorLabels(angleRes, angletracker):
+    """
+    :param angleRes: Width of the sectors (in multiples of pi), see getIntervallsByDegreeOverlapping
+    :param angletracker: AngleTracker with the angles for each time sample
+    :return: (sector of every sample, revolution of every sample), both int arrays. The revolutions are counted from 0
+    on, a new one begins where the sector numbers start again (after sector nrInts-1 for increasing angles, after
+    sector 0 for decreasing ones)
+    """
+    angleArray = asarray(angletracker.angle)
+    nrInts = int(round(2 * pi / angleRes))    # Number of intervalls
+    if abs(nrInts * angleRes - 2 * pi) >= 0.05:
+        raise Exception(f"2*pi is no multiple of resolution, res is {angleRes / pi} pi")
 
-    lenAngleArray = len(angleArray)
+    # sector of each sample: nr of the sector borders angleRes * k which are <= angle
+    labels = searchsorted(angleRes * arange(1, nrInts), angleArray, side='right')
+    # Like the angle, the sector only changes in direction of rotation, so short steps back of the angle (e.g. where
+    # the AngleTracker changes its spline) don't open a new intervall. Therefore the sectors are counted on over all
+    # revolutions and only their running minimum / maximum is used
+    revolutions = zeros(len(angleArray), dtype=int64)
+    angleSteps = diff(angleArray)
     if angletracker.rot_direction == -1:  # Winkel werden kleiner mit Drehung
-        for i in range(1, lenAngleArray - 1):
-            # Is the current angle the last one for the current Intervall?
-            if angleArray[i + 1] >= angleRes * (currN - 1) and angleArray[i + 1] < angleRes * currN:
-                intervals[currN][-1][1] = i
-
-                intervals[currN - 1].append([i + 1, None])
-                currN -= 1
-            elif currN == 0:
-                if angleArray[i + 1] > angleRes:  # Check whether there is transition from e.g. 1° to 358°
-                    # (#decrasing angles)
-                    # [_2_,1, 359,358] 2° > 10° -> False, [2,_1_, 359,358],  359 > 10° -> True
-                    intervals[currN][-1][1] = i
-                    intervals[n].append([i + 1, None])
-                    currN = n
-    else:  # Angles are increasing
-        for i in range(1, lenAngleArray - 1):
-            if angleArray[i + 1] >= angleRes * (currN + 1):
-                intervals[currN][-1][1] = i
-
-                intervals[currN + 1].append([i + 1, None])
-                currN += 1
-            elif currN == n:
-                if angleArray[i + 1] < angleRes:
-                    intervals[currN][-1][1] = i
-                    intervals[0].append([i + 1, None])
-                    currN = 0
-
-    # insert last Sample
-    #     inervals[  angleIntervall(lastSample)] = Index of last Sample
-    intervals[int(angleArray[-1] // angleRes)][-1][1] = lenAngleArray - 1
-
-    return intervals
-
-def averageAndMinimum(mapFolder, splittedMapName, highestMapNr, minSoundVolume, nrInts):
+        revolutions[1:] = cumsum(angleSteps > pi) - cumsum(angleSteps < -pi)
+        sectorCount = minimum.accumulate(labels - nrInts * revolutions)
+    else:   # Angles are increasing
+        revolutions[1:] = cumsum(angleSteps < -pi) - cumsum(angleSteps > pi)
+        sectorCount = maximum.accumulate(labels + nrInts * revolutions)
+    labels = sectorCount % nrInts
+    revolutions = abs(sectorCount // nrInts - sectorCount[:1] // nrInts)
+    if len(labels) > 1:  # the sample after the first one always belongs to the intervall of the first sample
+        labels[1] = labels[0]
+        revolutions[1] = revolutions[0]
+    return labels, revolutions
+
+
+@timed('averageAndMinimum')
+def averageAndMinimum(mapFolder, splittedMapName, highestMapNr, minSoundVolume, nrInts, memmapOutput=False):
     """
-    Calculates the average and minimum of all given maps and saves the maps minMap, average and standing
+    Calculates the average and minimum of all given maps and saves the maps minMap, average and standing. The maps are
+    read from the MapStack mapFolder/splittedMapName or from the single .npy files. They are loaded one after another
+    and added to the running sum and minimum, so only one map at a time is in memory, no matter how many maps there are
     :param mapFolder: Path to the folder, where the maps are saved
-    :param splittedMapName: Name of the map. It MUST end with the nr of the map. e.g.: Blabla2, BlaBla3 ,...
+    :param splittedMapName: Name of the MapStack or of the maps. The single maps MUST end with the nr of the map. e.g.:
+    Blabla2, BlaBla3 ,...
     :param highestMapNr: Highest number at the end of the mapname
     :param minSoundVolume: Maps which highest volume level is below this wll be deleted
     :param nrInts: Nr of intervalls in which the revolution has been divided
+    :param memmapOutput: If True the average, minimum and standing maps are calculated directly inside of their .npy
+    files (as memmap) instead of the memory, for very big maps
+    :return: dict {"Average": averageMap, "Standing": standingMap, "Min": minMap}
     """
     print(f"Averaging maps (filename is {splittedMapName}Nr.npy)\n")
-    maps = []
-    for i in range(highestMapNr + 1):
+    averageMap, minMap = None, None
+    for i, loadedMap in enumerate(iterMaps(mapFolder, splittedMapName, highestMapNr)):
+        maxLevel = L_p(loadedMap.max())     # L_p is monotonic, so this is the maximum of L_p(loadedMap)
 
-        filename = splittedMapName + str(i) + '.npy'
-        loadedMap = load(path.join(mapFolder, filename))
-
-        if L_p(loadedMap).max() < minSoundVolume:
+        if maxLevel < minSoundVolume:
             print(
-                f"\n\n \033[91mWARNING: MAP FOR Nr {i} maximum volume = {L_p(loadedMap).max()}dB "
+                f"\n\n \033[91mWARNING: MAP FOR Nr {i} maximum volume = {maxLevel}dB "
                 f"<{minSoundVolume}dB skipping this map for calculating minimum and average map\u001b[0m\n\n")
             continue
 
-        maps.append(loadedMap)
-        print(f"max: {format(L_p(loadedMap).max(), '.2f')}dB")
+        print(f"max: {format(maxLevel, '.2f')}dB")
+        if averageMap is None:
+            # new arrays, so the loaded map isn't changed in place
+            averageMap = _newMap(mapFolder, splittedMapName + "Average", loadedMap, memmapOutput)
+            minMap = _newMap(mapFolder, splittedMapName + "Min", loadedMap, memmapOutput)
+        else:
+            averageMap += loadedMap
+            minimum(minMap, loadedMap, out=minMap)
+
+    if averageMap is None:
+        raise ValueError(f"All maps {splittedMapName}Nr.npy are quieter than {minSoundVolume}dB")
+    standingMap = _newMap(mapFolder, splittedMapName + "Standing", averageMap, memmapOutput)
+    standingMap -= minMap * nrInts
+    resultMaps = {"Average": averageMap, "Standing": standingMap, "Min": minMap}
+    for name, resultMap in resultMaps.items():
+        if memmapOutput:
+            resultMap.flush()
+        else:
+            save(path.join(mapFolder, splittedMapName + name), resultMap)
+    print("Done Minimizing & Averaging")
+    return resultMaps
 
-    minMap = maps[0]
-    averageMap = maps[0]
 
-    for i in range(1, len(maps)):
-        minMap = minimum(maps[i], minMap)
-        averageMap += maps[i]
+@timed('averageAndMinimumBands')
+def averageAndMinimumBands(mapFolder, bandMapNames, sweepName, highestMapNr, minSoundVolume, nrInts, **metadata):
+    """
+    Runs averageAndMinimum for the maps of every frequency band and stores its results additionally in the MapStacks
+    mapFolder/sweepName + "Average", "Standing" and "Min". Their map nr is the nr of the band in bandMapNames
+    :param bandMapNames: Names of the MapStacks or of the maps (see averageAndMinimum) of the bands
+    :param sweepName: Name of the three MapStacks
+    :param metadata: metadata of the MapStacks, e.g. freqs, bandwidth and grid
+    :return: dict {"Average": MapStack, "Standing": MapStack, "Min": MapStack}
+    """
+    bandStacks = {}
+    for nr, name in enumerate(bandMapNames):
+        for kind, resultMap in averageAndMinimum(mapFolder, name, highestMapNr, minSoundVolume, nrInts).items():
+            if kind not in bandStacks:
+                bandStacks[kind] = MapStack.create(mapFolder, sweepName + kind, resultMap.shape, len(bandMapNames),
+                                                   **metadata)
+            bandStacks[kind][nr] = resultMap
+    return bandStacks
 
-    standingMap = averageMap - minMap*nrInts
-    save(path.join(mapFolder, splittedMapName + "Average"), averageMap)
-    save(path.join(mapFolder, splittedMapName + "Standing"), standingMap)
-    save(path.join(mapFolder, splittedMapName + "Min"), minMap)
-    print("Done Minimizing & Averaging")
 
-def invertIntervalls(intervalls, nrOfSamples):
+def thirdOctaveBands(fmin=500, fmax=8000):
     """
-    Inverts the given Intervalls. E.g. intervalls = [[5,10], [20,25]] -> returns: [[0,4], [11,19], [26,nrOfSamples+1]]
-    :param intervalls: must have the form [ [StartA1, EndA1], [StartA2, EndA2]  ]. StartA1 = starting samples of
-    intervall 1, which microphonedata shall not later get zeroed. EndA1 = end sample of intervall 1
-    :return: Inverted intervalls in form [[StartToZeroA1, EndToZero1], [...], ...]
+    :return: list of the exact center frequencies 1000 * 2^(k/3) of all third octave bands from fmin to fmax, e.g.
+    [500, 629.96, 793.7, 1000, ..., 8000] (the nominal frequencies are 500, 630, 800, 1000, ...)
+    """
+    kmin = ceil(3 * log2(fmin / 1000) - 1e-9)
+    kmax = floor(3 * log2(fmax / 1000) + 1e-9)
+    return [1000 * 2 ** (k / 3) for k in range(kmin, kmax + 1)]
+
+
+def bandLimits(fftfreq, freqs, bandwidth):
     """
-    print("invertIntervalls")
-
-    intervallsToZero = []
-
-    start, stop = 0, 0
-
-    # ----- merge intervalls:
-    lenInts = len(intervalls)
-    if lenInts >1:
-        mergedIntervalls = []
-        n = 0
-        while n < lenInts - 1:
-            if intervalls[n][1]+1 == intervalls[n+1][0]:    # e.g. [[1,10], [11,16]]
-                mergedIntervalls.append([intervalls[n][0], intervalls[n+1][1]])
-                n += 2  # skip one entry in intervalls, because 2 intervalls got merged
-            else:
-                mergedIntervalls.append(intervalls[n])
-                n += 1
-        try:
-            if intervalls[-2][1] +1 == intervalls[-1][0]:
-                mergedIntervalls.pop()
-                mergedIntervalls.append([intervalls[-2][0], intervalls[-1][1]])
-            else:
-                mergedIntervalls.append(intervalls[-1])
-        except:
-            pass
+    Calculates the frequency lines needed for the maps of all given bands. If ind_low and ind_high of a PowerSpectra
+    object are set to them, a BeamformerBase object only calculates these lines instead of the whole spectrum, and its
+    synthetic(f, bandwidth) returns the same maps for all f in freqs
+    :param fftfreq: frequencies of the lines, e.g. PowerSpectra.fftfreq()
+    :param freqs: center frequencies of the bands
+    :param bandwidth: bandwidth (0 = single frequency line, 3= third octave band), like for synthetic
+    :return: ind_low, ind_high
+    """
+    freqs = atleast_1d(asarray(freqs, dtype=float))
+    if bandwidth == 0:
+        lower, upper = freqs, freqs
     else:
-        mergedIntervalls = intervalls
-
-    # ----- Invert intervalls
-    lenMerged = len(mergedIntervalls)
-    for i in range(lenMerged - 1):
-        x = 1
-        if mergedIntervalls[i][0] == 0:   # This intervalls has sample nr 0 in it
-            start = mergedIntervalls[i][1] + 1        # intervalls[0]= [0, 20] -> start = 21
-        else:   # 0 isn't inside i
-            stop = mergedIntervalls[i][0] - 1         # i= [15,25] -> stop current intervall at 14
-            intervallsToZero.append([start, stop])
-            start = mergedIntervalls[i][1] + 1        # start next intervalls with 26
-        # If i[1] = last sample -> intervallsToZero won't get appended with [lastsample+1, ?]. Because after start get's
-        # set to start = lastSample+1 intervallsToZero.append won't get triggered
-
-    lastInt = mergedIntervalls[-1]
-    if len(mergedIntervalls) != 1:
-        if lastInt[1] == nrOfSamples - 1:  # the last Intervall which shall not get zeroed ends with the last sample
-            intervallsToZero.append([start, lastInt[0]])
-        else:   # intervallNotToZero = [lastStart, LastStop] -> intervallsToZero.append([lastStop, nrOfSamples])
-            intervallsToZero.append([start, lastInt[0]-1])
-            intervallsToZero.append([lastInt[1]+1, nrOfSamples - 1])
-    else:   # Just one entry in merged intervalls
-        if lastInt[0] == 0:
-            if lastInt[1] == nrOfSamples-1:
-                print("C_FilterFunctionality/InvertIntervalls will zero no Data? Check if the inputs are right!")
-            else:
-                intervallsToZero.append([lastInt[1]+1, nrOfSamples-1])
-        else: # lastInt doesn't start with sample nr 0
-            intervallsToZero.append([0, lastInt[0]-1])
-            if lastInt[1] != nrOfSamples:
-                intervallsToZero.append([lastInt[1]+1,nrOfSamples - 1])
+        lower, upper = freqs * 2. ** (-0.5 / bandwidth), freqs * 2. ** (0.5 / bandwidth)
+    # synthetic warns, if the (excluded) upper border line of a band isn't calculated, so it is calculated, too
+    return int(searchsorted(fftfreq, lower).min()), int(searchsorted(fftfreq, upper).max() + 1)
+
+
+def _newMap(mapFolder, name, initialMap, memmapOutput):
+    """ :return: copy of initialMap, in memory or as memmap of the file mapFolder/name.npy """
+    if not memmapOutput:
+        return initialMap.copy()
+    newMap = open_memmap(path.join(mapFolder, name + '.npy'), mode='w+', dtype=initialMap.dtype,
+                         shape=initialMap.shape)
+    newMap[...] = initialMap
+    return newMap
 
 
+@timed('invertIntervalls')
+def invertIntervalls(intervalls, nrOfSamples):
+    """
+    Inverts the given Intervalls. E.g. intervalls = [[5,10], [20,25]] -> returns: [[0,4], [11,19], [26,nrOfSamples-1]]
+    :param intervalls: must have the form [ [StartA1, EndA1], [StartA2, EndA2]  ]. StartA1 = starting samples of
+    intervall 1, which microphonedata shall not later get zeroed. EndA1 = end sample of intervall 1. Can also be an
+    array of shape (K, 2) or an IntervalSet, doesn't have to be sorted
+    :return: Inverted intervalls as IntervalSet [[StartToZeroA1, EndToZero1], [...], ...]
+    """
+    intervallsToZero = IntervalSet(intervalls).invert(0, nrOfSamples)
+    if not len(intervallsToZero):
+        print("C_FilterFunctionality/InvertIntervalls will zero no Data? Check if the inputs are right!")
     return intervallsToZero
 
+
 def plotMaps(mapFolder, splittedMapName, grid, minFactorMultiply=1, sectors= [], freq=1500):
     """
     Plots three Average, Standing and min Map maps
@@ -278,20 +283,9 @@ def integrateSources(positions, mapFolder, splittedMapName, highestMapNr, grid,
     :param mapFolder: path as string to the npy map folder
     :param splittedMapName: name of the maps
     :param highestMapNr: highest nr of the map
+    :return: array (number of sectors, number of maps) with the integrated sound pressure levels in dB
     """
-    integrated = []
-    sectors = []
-
-    for xyr in positions:
-        sectors.append(array([xyr[1], xyr[0], xyr[2]]))
-
-    for index, s in enumerate(sectors):
-        integrated.append([])
-        for i in range(highestMapNr +1):
-
-            filename = splittedMapName + str(i) + '.npy'
-            loadedMap = load(path.join(mapFolder, filename))
-            integrated[index].append(L_p(integrate(loadedMap, grid, s)))
+    integrated = integrateMaps(loadMaps(mapFolder, splittedMapName, highestMapNr), sectorIndices(grid, positions))
 
     degreeRes = 360/(highestMapNr+1)
     angles = [a * degreeRes for a in list(range(len(integrated[0])))]
@@ -303,4 +297,57 @@ def integrateSources(positions, mapFolder, splittedMapName, highestMapNr, grid,
     plt.xlabel("Startwinkel der Map")
     plt.ylabel("Schalldruckpegel [dB]")
     plt.show()
+    return integrated
+
+
+def loadMaps(mapFolder, splittedMapName, highestMapNr):
+    """
+    :return: array (highestMapNr + 1, *shape of a map) with the maps 0 ... highestMapNr. They are read from the MapStack
+    mapFolder/splittedMapName (as memmap) if there is one, otherwise from the files splittedMapName0.npy ...
+    splittedMapNameN.npy
+    """
+    if MapStack.exists(mapFolder, splittedMapName):
+        return MapStack(mapFolder, splittedMapName)[:highestMapNr + 1]
+    firstMap = load(path.join(mapFolder, splittedMapName + '0.npy'))
+    maps = empty((highestMapNr + 1,) + firstMap.shape, dtype=firstMap.dtype)
+    maps[0] = firstMap
+    for i in range(1, highestMapNr + 1):
+        maps[i] = load(path.join(mapFolder, splittedMapName + str(i) + '.npy'))
+    return maps
+
+
+def iterMaps(mapFolder, splittedMapName, highestMapNr):
+    """ Like loadMaps, but yields the maps one after another, so only one of them is in memory at a time """
+    if MapStack.exists(mapFolder, splittedMapName):
+        stack = MapStack(mapFolder, splittedMapName)
+        for i in range(highestMapNr + 1):
+            yield stack[i]
+    else:
+        for i in range(highestMapNr + 1):
+            yield load(path.join(mapFolder, splittedMapName + str(i) + '.npy'))
+
+
+def sectorIndices(grid, positions):
+    """
+    :param grid: RectGrid or SectorGrid of the maps. The sectors must be inside of the ones of a SectorGrid
+    :param positions: [[x0,y0,r0], [x1,y1,r1]] like for integrateSources
+    :return: list with an array of the grid points inside of every sector, as indices into the flattened map. Like
+    acoular.integrate, the nearest grid point is used for a sector without any grid point in it
+    """
+    if isinstance(grid, SectorGrid):
+        return [grid.mapIndices(inds) for inds in rectGridIndices(grid.grid, positions)]
+    return rectGridIndices(grid, positions)
+
+
+@timed('integrateMaps')
+def integrateMaps(maps, sectorInds):
+    """
+    Integrates every map over every sector with one reduction over all of them
+    :param maps: array (number of maps, *shape of a map)
+    :param sectorInds: indices of the grid points of every sector, as returned by sectorIndices
+    :return: array (number of sectors, number of maps) with the integrated sound pressure levels in dB
+    """
+    flatMaps = maps.reshape(maps.shape[0], -1)
+    starts = cumsum([0] + [len(inds) for inds in sectorInds[:-1]])
+    return L_p(add.reduceat(flatMaps[:, concatenate(sectorInds)], starts, axis=1)).T
 
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Inside this script is the instrumentation of the processing chain defined: wall and cpu time of stages (e.g. the csm
+calculation or the beamforming of one sector), counters (bytes read from the h5 files, blocks yielded / zeroed /
+skipped, FFTs) and the peak memory of the process. It's off by default, then stage() returns a shared empty context and
+count() returns at once, so the calls can stay in the code also for production runs. After enable(), every finished
+stage is written as json line into a file and summed up for summaryTable(). Stages can be profiled with cProfile.
+
+    enable('Maps/run.jsonl', profile=['sector_csm'])
+    with stage('beamforming', sector=nr):
+        ...
+    printSummary()
+"""
+import cProfile
+import json
+import pstats
+import sys
+import time as t
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from io import StringIO
+from os import path, makedirs
+from threading import Lock
+
+try:
+    import resource
+except ImportError:     # Windows
+    resource = None
+
+# the active Recorder, None = instrumentation is off
+_recorder = None
+
+# returned by stage() while the instrumentation is off
+_noStage = nullcontext()
+
+
+class Recorder:
+    """ Collects the events of the stages and the counters, see enable """
+
+    def __init__(self, jsonFile=None, profile=(), profileFolder=None):
+        """
+        :param jsonFile: file, to which every finished stage is appended as json line, None = no file
+        :param profile: names of the stages, which are run with cProfile
+        :param profileFolder: folder for the .prof files of the profiled stages (readable with pstats or snakeviz),
+        None = the 20 functions with the highest cumulative time are printed instead
+        """
+        self.jsonFile = jsonFile
+        self._file = None
+        if jsonFile:
+            if path.dirname(jsonFile):
+                makedirs(path.dirname(jsonFile), exist_ok=True)
+            self._file = open(jsonFile, 'a')
+        self.profile = set(profile)
+        self.profileFolder = profileFolder
+        #: {stage name: {'calls', 'wall', 'cpu', 'peakMemory', 'counters'}}, summed up over all calls
+        self.stages = {}
+        #: counters of the whole run
+        self.counters = {}
+        self._running = []  # counters of the stages, which are running at the moment (nested stages)
+        self._lock = Lock()  # counts also come from the prefetch threads
+
+    def count(self, name, value):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+            for counters in self._running:
+                counters[name] = counters.get(name, 0) + value
+
+    @contextmanager
+    def stage(self, name, tags):
+        counters = {}
+        with self._lock:
+            self._running.append(counters)
+        profiler = cProfile.Profile() if name in self.profile else None
+        wall, cpu = t.perf_counter(), t.process_time()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            wall, cpu = t.perf_counter() - wall, t.process_time() - cpu
+            with self._lock:
+                self._running.remove(counters)
+            self._finish(name, tags, wall, cpu, counters, profiler)
+
+    def _finish(self, name, tags, wall, cpu, counters, profiler):
+        event = {'stage': name, **tags, 'wall': wall, 'cpu': cpu, 'peakMemory': peakMemory(),
+                 'counters': counters, 'time': t.time()}
+        if profiler is not None:
+            event['profile'] = self._saveProfile(profiler, name, tags)
+        _sumUp(self.stages, event)
+        if self._file is not None:
+            self._file.write(json.dumps(event) + '\n')
+            self._file.flush()
+
+    def _saveProfile(self, profiler, name, tags):
+        """ :return: name of the .prof file, None if the statistics were printed """
+        if self.profileFolder is None:
+            stream = StringIO()
+            pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(20)
+            print(f"cProfile of stage {name} {tags}:\n{stream.getvalue()}")
+            return None
+        makedirs(self.profileFolder, exist_ok=True)
+        fileName = path.join(self.profileFolder, name + "".join(f"_{key}{value}" for key, value in tags.items()) +
+                             '.prof')
+        profiler.dump_stats(fileName)
+        return fileName
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def summaryTable(self):
+        """ :return: table (str) with the calls, times and counters of every stage """
+        return summaryTable(self.stages, peakMemory())
+
+
+def _sumUp(stages, event):
+    """ adds the times and counters of an event to the sums of its stage in stages """
+    summed = stages.setdefault(event['stage'], {'calls': 0, 'wall': 0., 'cpu': 0., 'peakMemory': 0, 'counters': {}})
+    summed['calls'] += 1
+    summed['wall'] += event['wall']
+    summed['cpu'] += event['cpu']
+    summed['peakMemory'] = max(summed['peakMemory'], event['peakMemory'])
+    for key, value in event['counters'].items():
+        summed['counters'][key] = summed['counters'].get(key, 0) + value
+
+
+def loadEvents(jsonFile, since=0.):
+    """
+    :param since: only events of stages which ended after this time (time.time()) are returned, e.g. the ones of the
+    last run, the file is appended by every run
+    :return: list with the events of a json lines file of a Recorder
+    """
+    with open(jsonFile) as f:
+        events = [json.loads(line) for line in f if line.strip()]
+    return [event for event in events if event['time'] >= since]
+
+
+def summaryTable(stages, peak=None):
+    """
+    :param stages: {stage name: sums}, like Recorder.stages. Or a list of events (see loadEvents), e.g. of all worker
+    processes of a batch run, which wrote into the same file
+    :param peak: peak memory in bytes for the last line, None = the highest one of the stages
+    :return: table (str) with the calls, times, peak memory and counters of every stage
+    """
+    if isinstance(stages, list):
+        events, stages = stages, {}
+        for event in events:
+            _sumUp(stages, event)
+    counterNames = sorted({key for summed in stages.values() for key in summed['counters']})
+    lines = [f"{'stage':28} {'calls':>6} {'wall':>9} {'cpu':>9} {'peakMemory':>12} " +
+             " ".join(f"{name:>14}" for name in counterNames)]
+    for name, summed in stages.items():
+        lines.append(f"{name:28} {summed['calls']:6} {summed['wall']:8.2f}s {summed['cpu']:8.2f}s "
+                     f"{_format('peakMemory', summed['peakMemory']):>12} " +
+                     " ".join(f"{_format(c, summed['counters'].get(c, 0)):>14}" for c in counterNames))
+    if peak is None:
+        peak = max([summed['peakMemory'] for summed in stages.values()], default=0)
+    lines.append(f"peak memory: {_format('peakMemory', peak)}")
+    return "\n".join(lines)
+
+
+def _format(counter, value):
+    if counter in ('bytesRead', 'peakMemory'):
+        return f"{value / 1024 ** 2:.1f}MiB"
+    return str(value)
+
+
+def enable(jsonFile=None, profile=(), profileFolder=None):
+    """
+    Switches the instrumentation on (see Recorder for the parameters). A Recorder which was active before is closed
+    :return: the new Recorder
+    """
+    global _recorder
+    disable()
+    _recorder = Recorder(jsonFile, profile, profileFolder)
+    return _recorder
+
+
+def disable():
+    """ Switches the instrumentation off. :return: the Recorder which was active, or None """
+    global _recorder
+    recorder, _recorder = _recorder, None
+    if recorder is not None:
+        recorder.close()
+    return recorder
+
+
+def recorder():
+    """ :return: the active Recorder, None if the instrumentation is off """
+    return _recorder
+
+
+def stage(name, **tags):
+    """
+    Context manager, which measures the wall and cpu time of the code inside of it and the counters counted meanwhile
+    :param name: name of the stage, e.g. 'sector_csm'
+    :param tags: further json values of the event, e.g. sector=3. The summary adds up all calls of a stage name
+    """
+    if _recorder is None:
+        return _noStage
+    return _recorder.stage(name, tags)
+
+
+def timed(name):
+    """ Decorator, which runs every call of a function as stage name """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if _recorder is None:
+                return function(*args, **kwargs)
+            with _recorder.stage(name, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, value=1):
+    """ Adds value to the counter name of the run and of all running stages """
+    if _recorder is not None:
+        _recorder.count(name, value)
+
+
+def peakMemory():
+    """ :return: highest memory usage (resident set size) of the process so far in bytes, 0 if unknown """
+    if resource is None:
+        return 0
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024     # bytes on macOS, kB on Linux
+
+
+def printSummary():
+    """ Prints the summaryTable of the active Recorder, if there is one """
+    if _recorder is not None:
+        print(_recorder.summaryTable())
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Inside this script are IntervalSet and ZeroingPlan defined. IntervalSet is a set of sample intervalls backed by a numpy
+int array. It is used for the intervalls of the angle sectors and the intervalls which get zeroed. ZeroingPlan holds for
+every block of the time data the samples of it, which get zeroed.
+"""
+from hashlib import md5
+
+from numpy import array, asarray, concatenate, argsort, maximum, minimum, flatnonzero, unique, cumsum, bincount, \
+    zeros, searchsorted, int64, ones, empty, arange, repeat, diff
+
+
+class IntervalSet:
+    """
+    Set of intervalls [[start0, end0], [start1, end1], ...] of sample numbers. Like everywhere in this project start
+    and end are both part of the intervall.
+
+    The intervalls are always sorted and merged: overlapping intervalls and intervalls which touch each other (e.g.
+    [1,10], [11,16]) are joined. All operations work on the whole array at once, without python loops over the
+    intervalls. An IntervalSet can be used like the lists of intervalls before: len(), [n] and iterating over the
+    [start, end] pairs work the same.
+    """
+
+    def __init__(self, intervalls=()):
+        """
+        :param intervalls: [[start0, end0], [start1, end1], ...], array of shape (K, 2) or IntervalSet. Doesn't have to
+        be sorted or merged
+        """
+        if isinstance(intervalls, IntervalSet):
+            self.intervalls = intervalls.intervalls
+        else:
+            self.intervalls = self._merge(asarray(intervalls, dtype=int64).reshape(-1, 2))
+
+    @classmethod
+    def _fromMerged(cls, ints):
+        """ IntervalSet of intervalls which are already sorted and merged, empty intervalls get removed """
+        intervalSet = cls.__new__(cls)
+        intervalSet.intervalls = ints[ints[:, 1] >= ints[:, 0]]
+        return intervalSet
+
+    @staticmethod
+    def _merge(ints):
+        """ sorts the intervalls and joins all which overlap or touch each other """
+        ints = ints[ints[:, 1] >= ints[:, 0]]   # remove empty intervalls
+        if len(ints) <= 1:
+            return ints.copy()
+        ints = ints[argsort(ints[:, 0], kind='stable')]
+        ends = maximum.accumulate(ints[:, 1])
+        # a new merged intervall starts where the start is behind the end of all intervalls before
+        newStart = concatenate(([True], ints[1:, 0] > ends[:-1] + 1))
+        firsts = flatnonzero(newStart)
+        lasts = concatenate((firsts[1:] - 1, [len(ints) - 1]))
+        merged = empty((len(firsts), 2), dtype=int64)
+        merged[:, 0] = ints[firsts, 0]
+        merged[:, 1] = ends[lasts]
+        return merged
+
+    @classmethod
+    def _fromEvents(cls, sets, minCount):
+        """
+        Returns the samples, which are in at least minCount of the given IntervalSets. Every intervall adds +1 at its
+        start and -1 behind its end, the cumulated sum is the number of sets a sample is in
+        """
+        pos = concatenate([concatenate((s.starts, s.ends + 1)) for s in sets])
+        delta = concatenate([concatenate((ones(len(s), dtype=int64), -ones(len(s), dtype=int64))) for s in sets])
+        if not len(pos):
+            return cls()
+        positions, inverse = unique(pos, return_inverse=True)
+        count = cumsum(bincount(inverse, weights=delta, minlength=len(positions)).astype(int64))
+        inside = flatnonzero(count[:-1] >= minCount)     # [positions[i], positions[i+1]) is inside
+        return cls(array([positions[inside], positions[inside + 1] - 1]).T.reshape(-1, 2))
+
+    @property
+    def starts(self):
+        """ first sample of every intervall """
+        return self.intervalls[:, 0]
+
+    @property
+    def ends(self):
+        """ last sample of every intervall """
+        return self.intervalls[:, 1]
+
+    @property
+    def numsamples(self):
+        """ number of samples inside of the intervalls """
+        return int((self.ends - self.starts + 1).sum())
+
+    def union(self, other):
+        """
+        :param other: IntervalSet or intervalls
+        :return: IntervalSet with all samples, that are in self or other
+        """
+        return IntervalSet(concatenate((self.intervalls, IntervalSet(other).intervalls)))
+
+    def intersect(self, other):
+        """
+        :param other: IntervalSet or intervalls
+        :return: IntervalSet with all samples, that are in self and other
+        """
+        return self._fromEvents([self, IntervalSet(other)], 2)
+
+    def clip(self, start, stop):
+        """
+        :return: IntervalSet with all samples of self, that are in [start, stop). stop isn't part of it, like with
+        slices
+        """
+        first = searchsorted(self.ends, start, side='left')     # first intervall which ends at or after start
+        last = searchsorted(self.starts, stop, side='left')     # intervalls from last on start at or after stop
+        ints = self.intervalls[first:last].copy()
+        if len(ints):
+            ints[0, 0] = max(ints[0, 0], start)
+            ints[-1, 1] = min(ints[-1, 1], stop - 1)
+        return self._fromMerged(ints)
+
+    def invert(self, start, stop):
+        """
+        Inverts the intervalls inside of [start, stop). E.g. [[5,10], [20,25]].invert(0, 30) -> [[0,4], [11,19],
+        [26,29]]
+        :return: IntervalSet with all samples in [start, stop), which are not in self
+        """
+        ints = self.clip(start, stop).intervalls
+        gapStarts = concatenate(([start], ints[:, 1] + 1))
+        gapEnds = concatenate((ints[:, 0] - 1, [stop - 1]))
+        return self._fromMerged(array([gapStarts, gapEnds]).T)
+
+    def toMask(self, numsamples):
+        """
+        :return: bool array of length numsamples, which is True for all samples inside of the intervalls
+        """
+        ints = self.clip(0, numsamples)
+        change = zeros(numsamples + 1, dtype=int64)
+        change[ints.starts] += 1
+        change[ints.ends + 1] -= 1
+        return cumsum(change[:-1]) > 0
+
+    def tolist(self):
+        return self.intervalls.tolist()
+
+    def __len__(self):
+        return len(self.intervalls)
+
+    def __getitem__(self, item):
+        return self.intervalls[item]
+
+    def __iter__(self):
+        return iter(self.intervalls)
+
+    def __array__(self, dtype=None):
+        return self.intervalls if dtype is None else self.intervalls.astype(dtype)
+
+    def __eq__(self, other):
+        return isinstance(other, IntervalSet) and self.intervalls.shape == other.intervalls.shape and \
+            bool((self.intervalls == other.intervalls).all())
+
+    def __str__(self):
+        # also used by the acoular digests, so the content must go into it completely
+        return f"IntervalSet({len(self)} intervalls, {md5(self.intervalls.tobytes()).hexdigest()})"
+
+    def __repr__(self):
+        return f"IntervalSet({self.tolist()})" if len(self) <= 10 else str(self)
+
+
+class ZeroingPlan:
+    """
+    Precomputed zeroing of blockwise yielded time data. For every block of :attr:`num` samples it holds the ranges
+    inside of the block, which get zeroed, so a generator just has to apply them. The plan only depends on the
+    intervalls, the blocksize and the number of samples, so it can be reused for every pass over the same data (e.g.
+    when a sector is evaluated at several frequencies).
+    """
+
+    def __init__(self, intsToZero, num, numsamples):
+        """
+        :param intsToZero: [[start0, end0], [s1,e1],...] or IntervalSet, samples with the number from start to end (both
+        included) will be zeroed
+        :param num: blocksize
+        :param numsamples: number of samples of the time data
+        """
+        self.num = num
+        self.numsamples = numsamples
+        ints = IntervalSet(intsToZero).clip(0, numsamples)
+
+        #: first sample and length of every block
+        self.blockStarts = arange(0, numsamples, num, dtype=int64)
+        self.blockLengths = minimum(self.blockStarts + num, numsamples) - self.blockStarts
+
+        # every intervall is split into one piece per block it reaches into
+        firstBlock, lastBlock = ints.starts // num, ints.ends // num
+        nrPieces = lastBlock - firstBlock + 1
+        intNr = repeat(arange(len(ints)), nrPieces)
+        pieceBlocks = repeat(firstBlock, nrPieces) + arange(nrPieces.sum()) - repeat(cumsum(nrPieces) - nrPieces,
+                                                                                      nrPieces)
+        blockStart = pieceBlocks * num
+        localStarts = maximum(ints.starts[intNr], blockStart) - blockStart
+        localEnds = minimum(ints.ends[intNr] + 1, blockStart + num) - blockStart   # not part of the range, like slices
+
+        #: the ranges of block b are [pointers[b], pointers[b+1]) in localStarts/localEnds
+        self.pointers = searchsorted(pieceBlocks, arange(len(self.blockStarts) + 1))
+        self.localStarts = localStarts.tolist()
+        self.localEnds = localEnds.tolist()
+
+        #: True for every block, in which all samples get zeroed
+        single = flatnonzero(diff(self.pointers) == 1)
+        piece = self.pointers[single]
+        self.fullyZeroed = zeros(len(self.blockStarts), dtype=bool)
+        self.fullyZeroed[single] = (localStarts[piece] == 0) & (localEnds[piece] == self.blockLengths[single])
+
+    @property
+    def dataBlocks(self):
+        """ numbers of the blocks, which aren't zeroed completely """
+        return flatnonzero(~self.fullyZeroed)
+
+    def zero(self, blockNr, data):
+        """
+        Sets the samples of block blockNr in data, which are inside of the intervalls to zero, to 0
+        :param data: samples of the block, shape (length of the block, numchannels)
+        :return: data, or a zeroed copy of it if data is read-only (e.g. a view of a memmap)
+        """
+        if self.pointers[blockNr] < self.pointers[blockNr + 1] and not data.flags.writeable:
+            data = data.copy()
+        for p in range(self.pointers[blockNr], self.pointers[blockNr + 1]):
+            data[self.localStarts[p]:self.localEnds[p]] = 0
+        return data
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Inside this script is MapStack defined, which stores all maps of a run (e.g. the maps of the angle intervalls) in one
+file together with their metadata
+"""
+import json
+from os import path, replace
+
+from acoular import RectGrid
+from numpy import load
+from numpy.lib.format import open_memmap
+
+from B_Acoular_Grids import SectorGrid
+
+
+def gridMetadata(grid):
+    """ :return: dict with everything needed to create the RectGrid or SectorGrid grid again (see gridFromMetadata) """
+    if isinstance(grid, SectorGrid):
+        return dict(gridMetadata(grid.grid), sectors=[[float(v) for v in sector] for sector in grid.sectors])
+    return {name: float(getattr(grid, name)) for name in ('x_min', 'x_max', 'y_min', 'y_max', 'z', 'increment')}
+
+
+def gridFromMetadata(metadata):
+    """ :return: RectGrid (or SectorGrid) of the metadata of a MapStack (or of a dict returned by gridMetadata) """
+    settings = dict(metadata.get('grid', metadata))
+    sectors = settings.pop('sectors', None)
+    grid = RectGrid(**settings)
+    return grid if sectors is None else SectorGrid(grid=grid, sectors=sectors)
+
+
+class MapStack:
+    """
+    All maps of a run in one file: mapFolder/name.npy holds them as one array of shape (number of maps, nx, ny). It is
+    opened as memmap, so single maps can be read or written without loading the others. mapFolder/name.json holds the
+    metadata (e.g. grid, freq, bandwidth, nrIntervalls) and the number of stored maps.
+
+    Maps are read with stack[nr] or stack[a:b] and written with stack[nr] = map or stack.append(map). The file grows if
+    necessary.
+    """
+
+    def __init__(self, mapFolder, name, mode='r'):
+        """
+        Opens an existing MapStack (see create for a new one)
+        :param mode: 'r' to read, 'r+' to read and write
+        """
+        self.mapFolder = mapFolder
+        self.name = name
+        self.mode = mode
+        with open(self.jsonFile) as f:
+            info = json.load(f)
+        #: number of stored maps
+        self.count = info['count']
+        #: dict with the metadata of the maps
+        self.metadata = info['metadata']
+        self._data = load(self.npyFile, mmap_mode=mode)
+
+    @classmethod
+    def create(cls, mapFolder, name, mapShape, capacity=1, dtype='float64', **metadata):
+        """
+        Creates a new, empty MapStack. An existing one with the same name gets overwritten
+        :param mapShape: shape of a single map, e.g. grid.shape
+        :param capacity: number of maps for which space is reserved, the file grows if more are stored
+        :param metadata: metadata of the maps, must be json serializable (see gridMetadata for the grid)
+        :return: the MapStack opened in mode 'r+'
+        """
+        open_memmap(path.join(mapFolder, name + '.npy'), mode='w+', dtype=dtype,
+                    shape=(max(capacity, 1),) + tuple(mapShape)).flush()
+        stack = cls.__new__(cls)
+        stack.mapFolder, stack.name, stack.count, stack.metadata = mapFolder, name, 0, metadata
+        stack._saveInfo()
+        return cls(mapFolder, name, 'r+')
+
+    @staticmethod
+    def exists(mapFolder, name):
+        return path.isfile(path.join(mapFolder, name + '.json'))
+
+    @property
+    def npyFile(self):
+        return path.join(self.mapFolder, self.name + '.npy')
+
+    @property
+    def jsonFile(self):
+        return path.join(self.mapFolder, self.name + '.json')
+
+    @property
+    def capacity(self):
+        """ number of maps for which space is reserved in the file """
+        return self._data.shape[0]
+
+    @property
+    def maps(self):
+        """ memmap of all stored maps, shape (count, nx, ny) """
+        return self._data[:self.count]
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, item):
+        return self.maps[item]
+
+    def __setitem__(self, nr, newMap):
+        self.writeMap(nr, newMap)
+        self.count = max(self.count, nr + 1)
+        self._saveInfo()
+
+    def append(self, newMap):
+        """ stores newMap behind the last map and returns its nr """
+        self[self.count] = newMap
+        return self.count - 1
+
+    def writeMap(self, nr, newMap):
+        """
+        Writes the map nr into the file, without changing count or the .json file. Several processes can write
+        different maps at the same time this way, if the capacity is big enough
+        """
+        if nr >= self.capacity:
+            self._grow(nr + 1)
+        self._data[nr] = newMap
+
+    def reserve(self, capacity):
+        """ makes sure, that there is space for capacity maps in the file """
+        if capacity > self.capacity:
+            self._grow(capacity)
+
+    def flush(self):
+        self._data.flush()
+        self._saveInfo()
+
+    def _grow(self, minCapacity):
+        """ copies the maps into a bigger file """
+        capacity = max(minCapacity, 2 * self.capacity)
+        self._data.flush()
+        tempName = self.npyFile + '.tmp'
+        newData = open_memmap(tempName, mode='w+', dtype=self._data.dtype, shape=(capacity,) + self._data.shape[1:])
+        newData[:self.capacity] = self._data
+        newData.flush()
+        del newData
+        self._data = None
+        replace(tempName, self.npyFile)
+        self._data = load(self.npyFile, mmap_mode=self.mode)
+
+    def _saveInfo(self):
+        tempName = self.jsonFile + '.tmp'
+        with open(tempName, 'w') as f:
+            json.dump({'count': self.count, 'metadata': self.metadata}, f, indent=1)
+        replace(tempName, self.jsonFile)
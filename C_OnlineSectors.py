@@ -0,0 +1,435 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Inside this script is OnlineSectorCsms defined, which calculates the csms of the angle sectors of a rotating
+measurement incrementally, while its time data arrives: from a h5 file, which is still written (see h5Chunks), or from
+a local socket (see socketChunks). The trigger pulses, the angles and the csms of the sectors are updated revolution by
+revolution, refreshMaps beamforms the current csms and calculates the Average, Min and Standing maps from them. So
+standing sources can be watched during a test rig run, instead of afterwards.
+
+    online = OnlineSectorCsms(spectra, interpolator, nrIntervalls=10, trackerChannel=64)
+    for chunk in h5Chunks('micData/run.h5'):
+        if online.update(chunk):
+            refreshMaps(online, steer, [1500], 3, 'Maps', ['runOnline_'])
+
+appendChunks and sendChunks replay a recorded measurement into a growing h5 file or a socket, as stand-in for the
+measurement system.
+"""
+import socket
+import time as t
+from collections import deque
+from math import pi
+from os import makedirs
+from warnings import warn
+
+import tables
+from acoular import BeamformerBase
+from numpy import asarray, concatenate, delete, empty, arange, flatnonzero, argmax, searchsorted, unique, dot, \
+    diff, frombuffer, int64
+
+from B_Acoular_Spectra import StoredSectorPowerSpectra, _BlockBatch
+from C_FilterFunctionality import averageAndMinimum
+from C_Instrumentation import count
+from C_MapStack import MapStack, gridMetadata
+
+
+class OnlineSectorCsms:
+    """
+    Sums up the csms of nrIntervalls angle sectors from time data, which is passed chunk by chunk to :meth:`update`.
+    The chunks hold the microphone channels and the tracker channel with the trigger pulses (like the files in
+    micData/Messdaten or the ones of writeSyntheticMeasurement with trackerChannel=True).
+
+    A revolution is processed as soon as the trigger pulse at its end has arrived: the angle rises linearly from one
+    pulse to the next, the samples are interpolated (virtually rotated) and split into FFT blocks, which are added to
+    the csms of their sectors like in SectorPowerSpectra (a block on the border of sectors is added to both, with the
+    samples of the other sector set to 0). Only the samples since the last pulse and the end of the last FFT block are
+    kept, so the memory and the cost of an update don't grow with the length of the measurement. The samples before
+    the first and after the last pulse aren't used. Revolutions, which are much longer than the last one or than
+    maxPeriod (a missing pulse, or a tracker signal, which stays beyond the threshold), are dropped with a warning.
+    Unlike AngleTracker, the angle isn't a spline through several pulses, because the later pulses aren't known yet.
+
+    It has metadata and sectorCsms like a SectorCsmStore, so StoredSectorPowerSpectra can beamform the sectors (see
+    refreshMaps).
+    """
+
+    def __init__(self, spectra, interpolator, nrIntervalls=10, trackerChannel=-1, threshold=4., triggerType='dirac',
+                 multiplePeaksInHunk='extremum', hunkLength=0.1, minPulseDistance=256, rotDirection=-1,
+                 triggerPerRevo=1, startAngle=0., keepRevolutions=0, maxPeriod=2 ** 18):
+        """
+        :param spectra: BandPowerSpectra with the settings of the csm calculation (block_size, window, overlap, ind_low,
+        ind_high, calib, precision, batch_size). Its time_data is only used for sample_freq and numchannels (of the
+        microphones), e.g. TimeSamples(sample_freq=51200, numchannels=64)
+        :param interpolator: SpatialInterpolatorRotation with the settings of the interpolation (mics, mics_virtual,
+        method, array_dimension, Q), its source and angle_source aren't used
+        :param nrIntervalls: number of angle sectors, like for getIntervallsByDegreeOverlapping(2 * pi / nrIntervalls)
+        :param trackerChannel: channel of the chunks with the trigger signal, all other channels are the microphones
+        :param threshold, triggerType, multiplePeaksInHunk, hunkLength: like for Trigger, the threshold can't be
+        estimated here. Samples above the threshold, which are closer than hunkLength * length of the last revolution,
+        belong to one pulse
+        :param minPulseDistance: samples above the threshold, which are closer than that, belong to one pulse, as long
+        as there is no revolution yet
+        :param rotDirection, triggerPerRevo, startAngle: like for AngleTracker
+        :param keepRevolutions: >0: only the last keepRevolutions revolutions are in the csms (sliding window), their
+        csms are kept separately. 0 = all revolutions since the start
+        :param maxPeriod: maximum number of samples of a revolution (2 ** 18 = 5.1 s at 51200 Hz). After the first
+        revolution, the limit is 2 * the length of the last one. The samples of longer revolutions, and pulses which
+        are longer than a revolution, are dropped, so the memory stays bounded
+        """
+        self.spectra = spectra
+        self.interpolator = interpolator
+        self.nrIntervalls = nrIntervalls
+        self.trackerChannel = trackerChannel
+        self.threshold = threshold
+        self.triggerType = triggerType
+        self.multiplePeaksInHunk = multiplePeaksInHunk
+        self.hunkLength = hunkLength
+        self.minPulseDistance = minPulseDistance
+        self.rotDirection = rotDirection
+        self.triggerPerRevo = triggerPerRevo
+        self.startAngle = startAngle
+        self.keepRevolutions = keepRevolutions
+        self.maxPeriod = maxPeriod
+        #: number of revolutions (between two trigger pulses), which were added to the csms
+        self.numRevolutions = 0
+
+        numchannels = spectra.time_data.numchannels
+        self._sectorBorders = 2 * pi / nrIntervalls * arange(1, nrIntervalls)     # like in sectorLabels
+        self._received = 0                  # number of samples, which were passed to update
+        self._raw = empty((0, numchannels))  # microphone samples, which aren't processed yet
+        self._rawStart = 0                  # sample nr of _raw[0]
+        self._lastTracker = None            # last sample of the tracker channel, for 'rect' triggers
+        self._candidates = empty(0, dtype=int64), empty(0)     # samples above the threshold and their tracker values
+        self._lastPulse = None              # sample nr of the last trigger pulse
+        self._stuck = False                 # the pending samples above the threshold are longer than a revolution
+        self._numPulses = 0
+        self._lastPeriod = 0                # length of the last revolution in samples
+        self._periodSum = 0
+        self._rotated = empty((0, numchannels))  # interpolated samples, which aren't in an FFT block yet
+        self._labels = empty(0, dtype=int64)     # and their sectors
+        self._csms = spectra._new_band_csm(nrIntervalls)    # sums of the revolutions, not normalized
+        self._numSamples = 0                # number of samples of the revolutions in the csms
+        self._history = deque()             # (csms, number of samples) of the kept revolutions
+
+    def __str__(self):
+        return f"online{id(self)}_{self.numRevolutions}"
+
+    @property
+    def sampleFreq(self):
+        return self.spectra.time_data.sample_freq
+
+    @property
+    def averageRpm(self):
+        """ average rpm of all revolutions so far (like AngleTracker.average_rpm), 0 before the first one """
+        return 60. * self.sampleFreq / (self._periodSum / self.numRevolutions) if self.numRevolutions else 0.
+
+    @property
+    def metadata(self):
+        """ settings of the csm calculation, like the metadata of a SectorCsmStore """
+        spectra = self.spectra
+        return {'key': str(self), 'nrFineSectors': self.nrIntervalls, 'numRevolutions': self.numRevolutions,
+                'sample_freq': self.sampleFreq, 'numsamples': self._numSamples,
+                'numchannels': spectra.time_data.numchannels, 'block_size': spectra.block_size,
+                'window': spectra.window, 'overlap': spectra.overlap, 'precision': spectra.precision,
+                'lines': [int(i) for i in spectra.indices], 'norm': self._norm()}
+
+    def _norm(self):
+        """ normalization factor of the csms, like BandPowerSpectra._norm for the samples of the revolutions """
+        bs, overlap = self.spectra.block_size, self.spectra.overlap_
+        wind = self.spectra.window_(bs)
+        numBlocks = overlap * self._numSamples / bs - overlap + 1    # like PowerSpectra.num_blocks
+        return 2.0 / bs / dot(wind, wind) / max(numBlocks, 1)
+
+    def sectorCsms(self, nrIntervalls, revolutions=None):
+        """
+        :param nrIntervalls: number of sectors, must be the one of this object
+        :param revolutions: must be None or [], all (kept) revolutions are used
+        :return: array of shape (nrIntervalls, number of lines, numchannels, numchannels) with the normalized csms of
+        the revolutions so far
+        """
+        if nrIntervalls != self.nrIntervalls:
+            raise ValueError(f"The csms are summed up for {self.nrIntervalls} sectors, not for {nrIntervalls}")
+        if revolutions:
+            raise ValueError("OnlineSectorCsms can't select revolutions, see keepRevolutions")
+        return self._csms * self._norm()
+
+    def update(self, chunk):
+        """
+        Processes the next samples of the measurement
+        :param chunk: array of shape (number of samples, number of channels), with the tracker channel
+        :return: number of revolutions, which were completed by this chunk and added to the csms
+        """
+        chunk = asarray(chunk)
+        tracker = chunk[:, self.trackerChannel]
+        self._raw = concatenate((self._raw, delete(chunk, self.trackerChannel, axis=1)))
+        pulses = self._newPulses(tracker)
+        self._received += len(chunk)
+        completed = 0
+        for pulse in pulses:
+            if self._lastPulse is not None:
+                self._addRevolution(self._lastPulse, pulse)
+                completed += 1
+            self._lastPulse = pulse
+            self._numPulses += 1
+        nextPulse = self._candidates[0][0] if len(self._candidates[0]) else self._received
+        if self._lastPulse is not None and nextPulse - self._lastPulse > self._maxLength(2):
+            warn(f"No trigger pulse in {nextPulse - self._lastPulse} samples since sample {self._lastPulse}, the "
+                 f"revolution is dropped. Check the threshold and the tracker channel", Warning, stacklevel=2)
+            self._lastPulse = None
+        # only the samples since the last pulse (or since the first possible pulse) are needed later
+        if self._lastPulse is not None:
+            keepFrom = self._lastPulse
+        else:
+            keepFrom = nextPulse
+        self._raw = self._raw[keepFrom - self._rawStart:]
+        self._rawStart = keepFrom
+        return completed
+
+    def finish(self):
+        """
+        Processes the pulse at the end of the data, which isn't complete for update as long as further samples could
+        belong to it. Call it after the last chunk
+        :return: number of revolutions, which were completed by it
+        """
+        locs, values = self._candidates
+        if not len(locs) or self._stuck:
+            self._candidates, self._stuck = (empty(0, dtype=int64), empty(0)), False
+            return 0
+        pulse = int(locs[0] if self.multiplePeaksInHunk == 'first' else locs[argmax(abs(values))])
+        self._candidates = empty(0, dtype=int64), empty(0)
+        if self._lastPulse is None:
+            self._lastPulse, self._numPulses = pulse, 1
+            return 0
+        self._addRevolution(self._lastPulse, pulse)
+        self._lastPulse = pulse
+        self._numPulses += 1
+        self._raw = self._raw[pulse - self._rawStart:]
+        self._rawStart = pulse
+        return 1
+
+    def _newPulses(self, tracker):
+        """ :return: list with the sample nrs of the trigger pulses, which are complete after the chunk tracker """
+        if self.triggerType == 'rect':      # difference of every sample to its predecessor, like Trigger
+            signal = diff(tracker, prepend=tracker[0] if self._lastTracker is None else self._lastTracker)
+        else:
+            signal = tracker
+        self._lastTracker = tracker[-1]
+        above = flatnonzero(signal > self.threshold if self.threshold > 0 else signal < self.threshold)
+        locs = concatenate((self._candidates[0], above + self._received))
+        values = concatenate((self._candidates[1], tracker[above]))    # like Trigger, the extremum of the signal values
+        end = self._received + len(tracker)
+        pulses = []
+        while len(locs):
+            hunk = self.hunkLength * self._lastPeriod if self._lastPeriod else self.minPulseDistance
+            gaps = flatnonzero(diff(locs) >= hunk)
+            groupEnd = gaps[0] + 1 if len(gaps) else len(locs)
+            if not self._stuck and locs[groupEnd - 1] - locs[0] > self._maxLength(1):
+                warn(f"The tracker signal is beyond the threshold since sample {locs[0]}, longer than a revolution. "
+                     f"These samples are no trigger pulse", Warning, stacklevel=3)
+                self._stuck = True
+            if groupEnd == len(locs) and end - locs[-1] < hunk:     # the pulse may go on in the next chunk
+                if self._stuck:     # only the last sample is needed, to see whether the next ones continue
+                    locs, values = locs[-1:], values[-1:]
+                break
+            if not self._stuck:
+                pulse = locs[0] if self.multiplePeaksInHunk == 'first' else locs[argmax(abs(values[:groupEnd]))]
+                previous = pulses[-1] if pulses else self._lastPulse
+                if previous is not None:
+                    self._lastPeriod = pulse - previous
+                pulses.append(int(pulse))
+            self._stuck = False
+            locs, values = locs[groupEnd:], values[groupEnd:]
+        self._candidates = locs, values
+        return pulses
+
+    def _maxLength(self, periods):
+        """ :return: periods * length of the last revolution, at most maxPeriod samples """
+        return min(periods * self._lastPeriod, self.maxPeriod) if self._lastPeriod else self.maxPeriod
+
+    def _addRevolution(self, start, end):
+        """ interpolates the samples start ... end-1 between two pulses and adds their FFT blocks to the csms """
+        n = end - start
+        data = self._raw[start - self._rawStart:end - self._rawStart]
+        # the angle rises linearly by 2 pi / triggerPerRevo from pulse to pulse, like the spline of the AngleTracker
+        pulseNr = (self._numPulses - 1) % self.triggerPerRevo
+        angles = ((pulseNr + arange(n) / n) * 2 * pi * self.rotDirection / self.triggerPerRevo +
+                  self.startAngle) % (2 * pi)
+        rotated = self.interpolator._result_core_func(data, angles, 2 * pi, self.interpolator.Q,
+                                                      interp_at_zero=False)
+        labels = searchsorted(self._sectorBorders, angles, side='right')
+        self._addBlocks(rotated, labels)
+        self.numRevolutions += 1
+        self._periodSum += n
+
+    def _addBlocks(self, rotated, labels):
+        """ adds all complete FFT blocks of the interpolated samples (and the rest of the last ones) to the csms """
+        bs = self.spectra.block_size
+        posinc = int(bs / self.spectra.overlap_)
+        self._rotated = concatenate((self._rotated, rotated))
+        self._labels = concatenate((self._labels, labels))
+        starts = arange(0, len(self._rotated) - bs + 1, posinc)
+        csms = self._csms if not self.keepRevolutions else self.spectra._new_band_csm(self.nrIntervalls)
+        batch = _BlockBatch(self.spectra, csms)
+        for start in starts:
+            block, blockLabels = self._rotated[start:start + bs], self._labels[start:start + bs]
+            if (blockLabels == blockLabels[0]).all():   # whole block inside of one sector
+                batch.add(block, blockLabels[0])
+            else:   # block on the border of sectors -> added to each with the samples of the others zeroed
+                for nr in unique(blockLabels):
+                    batch.add(block * (blockLabels == nr)[:, None], nr)
+        batch.flush()
+        count('blocksYielded', len(starts))
+        self._numSamples += len(rotated)
+        if self.keepRevolutions:
+            self._csms += csms
+            self._history.append((csms, len(rotated)))
+            if len(self._history) > self.keepRevolutions:   # the oldest revolution leaves the window
+                oldCsms, oldSamples = self._history.popleft()
+                self._csms -= oldCsms
+                self._numSamples -= oldSamples
+        nextStart = starts[-1] + posinc if len(starts) else 0
+        self._rotated, self._labels = self._rotated[nextStart:], self._labels[nextStart:]
+
+
+def refreshMaps(online, steer, freqs, bandwidth, mapFolder, mapNames, minSoundVolume=10):
+    """
+    Beamforms the current csms of all sectors and calculates the Average, Min and Standing maps from them (see
+    averageAndMinimum). The maps of the sectors are stored in the MapStacks mapFolder/mapNames like in the A_ scripts,
+    so plotMaps, integrateSources and D_PlotSingleMap can be used for them meanwhile
+    :param online: OnlineSectorCsms with at least one revolution
+    :param steer: SteeringVector of the maps, e.g. with a RectGrid or a SectorGrid
+    :param freqs: frequencies of interest, inside of the lines of online.spectra
+    :param bandwidth: bandwidth (0 = single frequency line, 3= third octave band)
+    :param mapNames: name of the MapStack for every frequency
+    :return: list with the dict {"Average": averageMap, "Standing": standingMap, "Min": minMap} of every frequency
+    """
+    if not online.numRevolutions:
+        raise ValueError("There is no complete revolution yet")
+    nrInts = online.nrIntervalls
+    ps = StoredSectorPowerSpectra(store=online, nrIntervalls=nrInts)
+    bf = BeamformerBase(freq_data=ps, steer=steer, r_diag=True, cached=False)
+    makedirs(mapFolder, exist_ok=True)
+    mapStacks = [MapStack.create(mapFolder, name, steer.grid.shape, nrInts, freq=f, bandwidth=bandwidth,
+                                 nrIntervalls=nrInts, revolutions=online.numRevolutions, grid=gridMetadata(steer.grid))
+                 for f, name in zip(freqs, mapNames)]
+    for nr in range(nrInts):
+        ps.sector = nr
+        for f, mapStack in zip(freqs, mapStacks):
+            mapStack[nr] = bf.synthetic(f, bandwidth)   # the beamforming is done once, for the first frequency
+    for mapStack in mapStacks:
+        mapStack.flush()
+    return [averageAndMinimum(mapFolder, name, nrInts - 1, minSoundVolume, nrInts) for name in mapNames]
+
+
+def h5Info(fileName):
+    """ :return: (sample_freq, number of channels) of the time data of a h5 file """
+    with tables.open_file(fileName, mode='r') as h5:
+        return float(h5.root.time_data.attrs.sample_freq), h5.root.time_data.shape[1]
+
+
+def h5Chunks(fileName, chunkSize=8192, pollInterval=0.5, timeout=10., start=0):
+    """
+    Yields the samples of /time_data of a h5 file, which is still written (e.g. by the measurement system or
+    appendChunks), in chunks of at most chunkSize as soon as they are in the file. The file is opened again for every
+    chunk, so the writer must flush it after appending. Both need the environment variable HDF5_USE_FILE_LOCKING=FALSE,
+    otherwise HDF5 doesn't let them open the file at the same time
+    :param pollInterval: time in s to wait, if there are no new samples
+    :param timeout: the generator ends, if there were no new samples for that many seconds
+    :param start: first sample
+    """
+    pos, lastData = start, t.time()
+    while True:
+        chunk = None
+        try:
+            with tables.open_file(fileName, mode='r') as h5:
+                data = h5.root.time_data
+                if data.nrows > pos:
+                    chunk = data[pos:min(pos + chunkSize, data.nrows)]
+        except (OSError, tables.HDF5ExtError):  # the file doesn't exist yet or is written at the moment
+            pass
+        if chunk is not None and len(chunk):
+            count('bytesRead', chunk.nbytes)
+            pos += len(chunk)
+            lastData = t.time()
+            yield chunk
+        elif t.time() - lastData > timeout:
+            return
+        else:
+            t.sleep(pollInterval)
+
+
+def socketChunks(port, numchannels, host='localhost', chunkSize=8192):
+    """
+    Waits on host:port for one connection (e.g. of sendChunks) and yields the received samples in chunks of chunkSize
+    samples (the last one may be shorter). The sender sends the samples row by row as float32 (little endian), with
+    numchannels values per sample. The generator ends, when the sender closes the connection
+    """
+    rowBytes = 4 * numchannels
+    buffer = bytearray(chunkSize * rowBytes)
+    view = memoryview(buffer)
+    with socket.create_server((host, port)) as server:
+        connection, _ = server.accept()
+        with connection:
+            filled = 0
+            while True:
+                received = connection.recv_into(view[filled:])
+                filled += received
+                if filled == len(buffer) or (not received and filled >= rowBytes):
+                    rows = filled // rowBytes
+                    count('bytesRead', rows * rowBytes)
+                    yield frombuffer(buffer, dtype='<f4', count=rows * numchannels).reshape(rows, numchannels).copy()
+                    rest = filled - rows * rowBytes
+                    buffer[:rest] = buffer[rows * rowBytes:filled]
+                    filled = rest
+                if not received:
+                    return
+
+
+def _replay(fileName, chunkSize, speed):
+    """ yields the chunks of /time_data of a h5 file, every one not before its time of the measurement / speed """
+    with tables.open_file(fileName, mode='r') as h5:
+        data = h5.root.time_data
+        sampleFreq = float(data.attrs.sample_freq)
+        T = t.time()
+        for pos in range(0, data.nrows, chunkSize):
+            chunk = data[pos:min(pos + chunkSize, data.nrows)]
+            if speed > 0:
+                t.sleep(max(0., T + (pos + len(chunk)) / sampleFreq / speed - t.time()))
+            yield sampleFreq, chunk
+
+
+def appendChunks(fileName, targetName, chunkSize=8192, speed=1.):
+    """
+    Stand-in for a measurement system: copies /time_data of a h5 file chunk by chunk into the h5 file targetName (which
+    is overwritten), in the speed of the measurement, and flushes it after every chunk (see h5Chunks)
+    :param speed: factor for the speed of the measurement, 0 = as fast as possible
+    """
+    with tables.open_file(targetName, mode='w') as target:
+        data = None
+        for sampleFreq, chunk in _replay(fileName, chunkSize, speed):
+            if data is None:
+                data = target.create_earray('/', 'time_data', tables.Float32Atom(), (0, chunk.shape[1]))
+                data.attrs.sample_freq = sampleFreq
+                target.flush()
+            data.append(chunk.astype('float32'))
+            target.flush()
+
+
+def sendChunks(fileName, port, host='localhost', chunkSize=8192, speed=1., connectTimeout=10.):
+    """
+    Stand-in for a measurement system: sends /time_data of a h5 file chunk by chunk to host:port (see socketChunks), in
+    the speed of the measurement
+    :param speed: factor for the speed of the measurement, 0 = as fast as possible
+    :param connectTimeout: time in s, how long it is tried to connect (the receiver may not be listening yet)
+    """
+    T = t.time()
+    while True:
+        try:
+            connection = socket.create_connection((host, port))
+            break
+        except ConnectionRefusedError:
+            if t.time() - T > connectTimeout:
+                raise
+            t.sleep(0.1)
+    with connection:
+        for _, chunk in _replay(fileName, chunkSize, speed):
+            connection.sendall(chunk.astype('<f4').tobytes())
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Inside this script is calcSectorMapsParallel defined, which calculates the sound maps of the angle sectors in a
+process pool instead of one after another. The microphone data and the angles are written once into .npy files, which
+all worker processes open as memmap, so they aren't copied into every process.
+"""
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from os import path, cpu_count
+from shutil import rmtree
+from tempfile import mkdtemp
+import time as t
+
+from acoular import BeamformerBase, config
+from numba import config as numbaConfig, set_num_threads
+from numpy import save, atleast_1d, fft
+from numpy.lib.format import open_memmap
+
+from B_Acoular_Environments import CachedGeneralFlowEnvironment
+from B_Acoular_SourceAndTprocess import SpatialInterpolatorRotationZeroing, MemmapTimeSamples, MemmapAngleTracker
+from B_Acoular_Spectra import SparsePowerSpectra
+from C_FilterFunctionality import invertIntervalls, bandLimits
+from C_MapStack import MapStack
+
+# objects of a worker process, created once by _initWorker and used for all sectors it calculates
+_worker = {}
+
+
+def shareTimeData(source, angletracker, folder, num=65536):
+    """
+    Writes the time data of source and the angles of angletracker into .npy files, which can be opened as memmap
+    (see MemmapTimeSamples and MemmapAngleTracker)
+    :param source: SamplesGenerator, e.g. ZeroedMaskedTimeSamples. start/stop, invalid channels and calibration are
+    already applied to the written data
+    :param num: number of samples, which are read at once
+    :return: filename of the time data, filename of the angles
+    """
+    dataFile = path.join(folder, 'timedata.npy')
+    angleFile = path.join(folder, 'angle.npy')
+    data = None
+    i = 0
+    for block in source.result(num):
+        if data is None:
+            data = open_memmap(dataFile, mode='w+', dtype=block.dtype, shape=(source.numsamples, source.numchannels))
+        data[i:i + block.shape[0]] = block
+        i += block.shape[0]
+    data.flush()
+    del data
+    save(angleFile, angletracker.angle)
+    return dataFile, angleFile
+
+
+def _sharedRotdata(dataFile, angleFile, sampleFreq, interpolation):
+    """
+    :return: SpatialInterpolatorRotationZeroing of the shared files. It has the same digest in every process, so all
+    use the same cache of the interpolated data, if interpolation contains a cache_folder
+    """
+    source = MemmapTimeSamples(name=dataFile, sample_freq=sampleFreq)
+    return SpatialInterpolatorRotationZeroing(source=source, angle_source=MemmapAngleTracker(angle_file=angleFile),
+                                              **interpolation)
+
+
+def _initWorker(dataFile, angleFile, sampleFreq, interpolation, spectra, steer, r_diag, caching, threads):
+    """ creates the acoular objects of a worker process """
+    config.global_caching = caching
+    set_num_threads(threads)
+    rotdata = _sharedRotdata(dataFile, angleFile, sampleFreq, interpolation)
+    ps = SparsePowerSpectra(time_data=rotdata, **spectra)
+    _worker['rotdata'] = rotdata
+    _worker['bf'] = BeamformerBase(freq_data=ps, steer=steer, r_diag=r_diag)
+
+
+def _calcSectorMap(nr, intervalls, freqs, bandwidth, stacks):
+    """
+    calculates the maps of one sector inside of a worker process (one for every frequency, all from the same
+    beamforming result) and writes them into the MapStacks
+    :param stacks: (mapFolder, name) of the MapStack of every frequency
+    """
+    T = t.time()
+    rotdata = _worker['rotdata']
+    rotdata.intsToZero = invertIntervalls(intervalls, rotdata.source.numsamples)
+    for freq, (mapFolder, stackName) in zip(freqs, stacks):
+        mapStack = MapStack(mapFolder, stackName, 'r+')
+        mapStack.writeMap(nr, _worker['bf'].synthetic(freq, bandwidth))
+        mapStack.flush()
+    return nr, t.time() - T
+
+
+def calcSectorMapsParallel(rotdata, intervalls, steer, freq, bandwidth, mapStack, block_size=1024, window='Hanning',
+                           overlap='50%', r_diag=True, workers=None, shareFolder=None, cacheRotated=True, prefetch=0):
+    """
+    Calculates the sound map of every sector with a pool of worker processes. The map of sector nr is stored as
+    mapStack[nr], like in the A_ scripts, so averageAndMinimum, plotMaps and integrateSources can be used afterwards.
+    For several frequencies, every worker calculates the csm and the beamforming result of a sector once and takes the
+    maps of all frequencies from it.
+    The maps are the same as the ones calculated with SectorPowerSpectra: every worker zeroes the samples outside of its
+    sector (before or, with cacheRotated, after the interpolation) and calculates the csm with SparsePowerSpectra.
+    :param rotdata: SpatialInterpolatorRotation (with source and angle_source), like in the A_ scripts. Its mics,
+    mics_virtual, method, array_dimension, Q and interp_at_zero are used by the workers
+    :param intervalls: intervalls of all sectors, as returned by getIntervallsByDegreeOverlapping
+    :param steer: SteeringVector for the beamforming. Every worker calculates it once for all sectors it gets. With a
+    CachedGeneralFlowEnvironment it is calculated once before and the workers load it from the cache
+    :param freq: frequency of interest or list of frequencies
+    :param bandwidth: bandwidth (0 = single frequency line, 3= third octave band)
+    :param mapStack: MapStack opened with mode 'r+', the workers write the maps directly into its file. List with one
+    MapStack for every frequency, if freq is a list
+    :param block_size, window, overlap: settings of the csm calculation, see PowerSpectra
+    :param r_diag: see BeamformerBase
+    :param workers: number of worker processes, None = number of cpus
+    :param shareFolder: folder for the .npy files, which are shared with the workers. None = temporary folder, which
+    gets deleted afterwards
+    :param cacheRotated: If True, the time data is interpolated (virtually rotated) only once into a file in
+    shareFolder, from which the workers read it (see SpatialInterpolatorRotationZeroing.cache_folder). Otherwise
+    every worker interpolates the samples of each of its sectors
+    :param prefetch: >0: every worker reads (and interpolates) that many blocks ahead in a background thread, while it
+    calculates the csm (see SpatialInterpolatorRotationZeroing.prefetch)
+
+    The workers are forked. If numba uses its tbb threading layer, the main process hangs when it exits afterwards, so
+    set the environment variable NUMBA_THREADING_LAYER to "workqueue" or "omp" before acoular is imported (like in the
+    A_ scripts)
+    """
+    workers = workers or cpu_count()
+    freqs = atleast_1d(freq).tolist()
+    mapStacks = mapStack if isinstance(mapStack, (list, tuple)) else [mapStack]
+    if len(freqs) != len(mapStacks):
+        raise ValueError(f"{len(freqs)} frequencies, but {len(mapStacks)} MapStacks")
+    tempFolder = shareFolder is None
+    if tempFolder:
+        shareFolder = mkdtemp(prefix='sectors_')
+    try:
+        T = t.time()
+        dataFile, angleFile = shareTimeData(rotdata.source, rotdata.angle_source, shareFolder)
+        print(f"\033[92m shareTimeData time={format(t.time() - T, '.2f')}s \n\u001b[0m")
+        if isinstance(steer.env, CachedGeneralFlowEnvironment):
+            steer.r0, steer.rm   # fills the cache, so the workers don't trace the same rays at the same time
+
+        interpolation = {name: getattr(rotdata, name) for name in ('mics', 'mics_virtual', 'method', 'array_dimension',
+                                                                   'Q', 'interp_at_zero')}
+        interpolation['prefetch'] = prefetch
+        if cacheRotated:
+            T = t.time()
+            interpolation['cache_folder'] = path.join(shareFolder, 'rotated')
+            _sharedRotdata(dataFile, angleFile, rotdata.source.sample_freq, interpolation).rotated
+            print(f"\033[92m interpolation time={format(t.time() - T, '.2f')}s \n\u001b[0m")
+        # the workers only beamform the frequency lines of the bands
+        fftfreq = abs(fft.fftfreq(block_size, 1. / rotdata.source.sample_freq)[:block_size // 2 + 1])
+        indLow, indHigh = bandLimits(fftfreq, freqs, bandwidth)
+        spectra = {'block_size': block_size, 'window': window, 'overlap': overlap, 'ind_low': indLow,
+                   'ind_high': indHigh}
+        threads = max(1, numbaConfig.NUMBA_NUM_THREADS // workers)   # numba threads per worker
+        initargs = (dataFile, angleFile, rotdata.source.sample_freq, interpolation, spectra, steer, r_diag,
+                    config.global_caching, threads)
+        for stack in mapStacks:
+            stack.reserve(len(intervalls))
+            stack.flush()
+        stacks = [(stack.mapFolder, stack.name) for stack in mapStacks]
+        with ProcessPoolExecutor(max_workers=workers, initializer=_initWorker, initargs=initargs) as pool:
+            futures = [pool.submit(_calcSectorMap, nr, ints, freqs, bandwidth, stacks)
+                       for nr, ints in enumerate(intervalls)]
+            for done, future in enumerate(as_completed(futures)):
+                nr, sectorTime = future.result()
+                print(f"[{done + 1}/{len(intervalls)}]\033[92m sector {nr} time={format(sectorTime, '.2f')}s \u001b[0m")
+        for stack in mapStacks:
+            stack.count = max(stack.count, len(intervalls))
+            stack.flush()
+    finally:
+        if tempFolder:
+            rmtree(shareFolder, ignore_errors=True)
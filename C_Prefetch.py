@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Inside this script is prefetch defined, which runs a generator in a background thread. So the next blocks of time data
+are read from the file (or interpolated) while the current one is processed, instead of one after another.
+"""
+from queue import Queue, Full
+from threading import Thread, Event
+
+# put into the queue after the last item
+_END = object()
+
+
+def prefetch(iterable, depth=2):
+    """
+    Yields the items of iterable, which are produced by a background thread up to depth items ahead of the consumer.
+    Reading from h5 files and most numpy functions release the GIL, so the thread really works in parallel.
+    An exception inside of the thread is raised at the consumer. If the consumer stops early (e.g. the generator gets
+    closed), the thread stops after its current item. The thread has always ended, when the generator is finished, so
+    processes can be forked afterwards (see calcSectorMapsParallel).
+    :param iterable: e.g. a generator of time data blocks. It is only used by the thread
+    :param depth: maximum number of items waiting for the consumer, 0 = no thread, the items of iterable are yielded
+    directly
+    """
+    if depth <= 0:
+        yield from iterable
+        return
+    items = Queue(maxsize=depth)
+    stop = Event()
+
+    def produce():
+        try:
+            for item in iterable:
+                if not _put(items, (True, item), stop):
+                    break
+            else:
+                _put(items, (True, _END), stop)
+        except BaseException as e:
+            _put(items, (False, e), stop)
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+
+    thread = Thread(target=produce, name='prefetch', daemon=True)
+    thread.start()
+    try:
+        while True:
+            ok, item = items.get()
+            if not ok:
+                raise item
+            if item is _END:
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _put(items, entry, stop):
+    """ puts entry into the queue items, as soon as there is space. :return: False, if stop was set before """
+    while not stop.is_set():
+        try:
+            items.put(entry, timeout=0.1)
+            return True
+        except Full:
+            pass
+    return False
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Inside this script is SectorCsmStore defined, which stores the spectra of a rotating measurement for fine angle sectors
+(e.g. 1°) of every revolution. The csms of any coarser number of sectors, or of only some of the revolutions, are
+summed up from it (see StoredSectorPowerSpectra), without reading and interpolating the time data again.
+"""
+import json
+from math import pi
+from os import path, makedirs, replace
+
+from numpy import dtype as dtype_, load, empty, zeros, arange, cumsum, concatenate, flatnonzero, int64, isin, lexsort, \
+    add, unique
+from numpy.lib.format import open_memmap
+
+from B_Acoular_Spectra import addToCsm
+from C_DiskCache import DiskCache
+from C_FilterFunctionality import sectorLabels
+
+
+class SectorCsmStore:
+    """
+    The time data is split into pieces: the samples of one fine sector in one revolution. For every FFT block, the
+    spectra (only the lines of the band, see BandPowerSpectra) of all pieces it contains are stored, each calculated
+    with the samples of the other pieces set to 0. Because the FFT is linear, the spectrum of a block for any union of
+    pieces is the sum of their spectra. So the csm of a sector made of fine sectors is exactly the same as the one of
+    SectorPowerSpectra, also for blocks on the border of sectors.
+
+    Files: folder/name.npy (spectra of the pieces, shape (number of pieces, number of lines, numchannels), complex64
+    by default), folder/namePieces.npy (block nr, revolution and fine sector of every piece) and folder/name.json
+    (metadata). There are about number of samples / samples per fine sector + number of blocks pieces, so the size is
+    about that * number of lines * numchannels * 8 bytes (complex64), compared to number of samples * numchannels * 4
+    bytes of the time data. So the store pays off for few lines and few fine sectors, create refuses stores bigger than
+    maxBytes.
+    """
+
+    def __init__(self, folder, name):
+        """ Opens an existing store (see create for a new one), the spectra are read as memmap """
+        self.folder = folder
+        self.name = name
+        with open(self.jsonFile) as f:
+            #: dict with the settings of the csm calculation, the number of fine sectors and revolutions
+            self.metadata = json.load(f)
+        self.spectra = load(path.join(folder, name + '.npy'), mmap_mode='r')
+        self.pieces = load(path.join(folder, name + 'Pieces.npy'))
+
+    def __str__(self):
+        return self.metadata['key']
+
+    @classmethod
+    def cached(cls, folder, name, spectra, angletracker, nrFineSectors=360, dtype='complex64', maxBytes=8 * 1024 ** 3):
+        """
+        :return: The store folder/name, if it was created with the same settings. Otherwise it is created again (see
+        create)
+        """
+        if cls.exists(folder, name):
+            store = cls(folder, name)
+            if store.metadata['key'] == cls._key(spectra, angletracker, nrFineSectors) and \
+                    store.spectra.dtype == dtype_(dtype):
+                return store
+        return cls.create(folder, name, spectra, angletracker, nrFineSectors, dtype, maxBytes)
+
+    @classmethod
+    def create(cls, folder, name, spectra, angletracker, nrFineSectors=360, dtype='complex64', maxBytes=8 * 1024 ** 3):
+        """
+        Reads the time data once and stores the spectra of all pieces. An existing store with the same name gets
+        overwritten
+        :param spectra: BandPowerSpectra with the time data (e.g. SpatialInterpolatorRotation) and the settings (
+        block_size, window, overlap, ind_low, ind_high, calib, batch_size)
+        :param angletracker: AngleTracker with the angles of the time data
+        :param nrFineSectors: number of fine sectors per revolution, e.g. 360 for 1° sectors. The number of sectors of
+        the csms (see sectorCsms) must be a divisor of it
+        :param dtype: type of the stored spectra. The csms are summed up with spectra.precision, complex64 spectra
+        change them by about 1e-7 relative to SectorPowerSpectra, but need half of the disk space of complex128
+        :param maxBytes: if the spectra would need more bytes than that, a ValueError is raised before anything is
+        calculated, None = no limit
+        :return: the new store
+        """
+        t = spectra.time_data
+        fine, revolutions = sectorLabels(2 * pi / nrFineSectors, angletracker)
+        pieceIds = revolutions * nrFineSectors + fine
+        bs = spectra.block_size
+        posinc = int(bs / spectra.overlap_)
+        blockStarts = arange(0, t.numsamples - bs + 1, posinc)
+        # number of pieces in each block = 1 + number of changes of the piece inside of it
+        changes = concatenate(([0], cumsum(pieceIds[1:] != pieceIds[:-1])))
+        numPieces = int((changes[blockStarts + bs - 1] - changes[blockStarts]).sum()) + len(blockStarts)
+        numBytes = numPieces * len(spectra.indices) * t.numchannels * dtype_(dtype).itemsize
+        if maxBytes is not None and numBytes > maxBytes:
+            raise ValueError(f"The SectorCsmStore {name} would need {numBytes / 1024 ** 2:.1f}MiB (more than maxBytes="
+                             f"{maxBytes / 1024 ** 2:.1f}MiB), use fewer fine sectors or frequency lines")
+
+        makedirs(folder, exist_ok=True)
+        pieceSpectra = open_memmap(path.join(folder, name + '.npy'), mode='w+', dtype=dtype,
+                                   shape=(numPieces, len(spectra.indices), t.numchannels))
+        pieces = open_memmap(path.join(folder, name + 'Pieces.npy'), mode='w+', dtype=int64, shape=(numPieces, 3))
+        batch = empty((spectra.batch_size, bs, t.numchannels))
+        count, row = 0, 0
+        for blockNr, block, blockIds in _fftBlocks(t, bs, posinc, pieceIds):
+            borders = concatenate(([0], flatnonzero(blockIds[1:] != blockIds[:-1]) + 1, [bs]))
+            for start, end in zip(borders[:-1], borders[1:]):
+                if start == 0 and end == bs:
+                    batch[count] = block
+                else:   # the samples of the other pieces are set to 0
+                    batch[count] = 0
+                    batch[count, start:end] = block[start:end]
+                pieceId = blockIds[start]
+                pieces[row + count] = blockNr, pieceId // nrFineSectors, pieceId % nrFineSectors
+                count += 1
+                if count == len(batch):
+                    pieceSpectra[row:row + count] = spectra.band_spectra(batch)
+                    row, count = row + count, 0
+        if count:
+            pieceSpectra[row:row + count] = spectra.band_spectra(batch[:count])
+        pieceSpectra.flush()
+        pieces.flush()
+        del pieceSpectra, pieces
+
+        metadata = {'key': cls._key(spectra, angletracker, nrFineSectors), 'nrFineSectors': nrFineSectors,
+                    'numRevolutions': int(revolutions.max()) + 1 if len(revolutions) else 0,
+                    'sample_freq': t.sample_freq, 'numsamples': t.numsamples, 'numchannels': t.numchannels,
+                    'block_size': bs, 'window': spectra.window, 'overlap': spectra.overlap,
+                    'precision': spectra.precision, 'lines': [int(i) for i in spectra.indices], 'norm': spectra._norm()}
+        jsonFile = path.join(folder, name + '.json')
+        with open(jsonFile + '.tmp', 'w') as f:
+            json.dump(metadata, f, indent=1)
+        replace(jsonFile + '.tmp', jsonFile)   # written at last, so only complete stores exist
+        return cls(folder, name)
+
+    @staticmethod
+    def exists(folder, name):
+        return path.isfile(path.join(folder, name + '.json'))
+
+    @staticmethod
+    def _key(spectra, angletracker, nrFineSectors):
+        return DiskCache.key(spectra.digest, angletracker.digest, nrFineSectors)
+
+    @property
+    def jsonFile(self):
+        return path.join(self.folder, self.name + '.json')
+
+    @property
+    def nrFineSectors(self):
+        return self.metadata['nrFineSectors']
+
+    @property
+    def numRevolutions(self):
+        return self.metadata['numRevolutions']
+
+    def sectorCsms(self, nrIntervalls, revolutions=None, numGroups=1024):
+        """
+        Sums up the csms of nrIntervalls sectors. Sector nr contains the fine sectors
+        nr * nrFineSectors / nrIntervalls ... (nr + 1) * nrFineSectors / nrIntervalls - 1, like the intervalls of
+        getIntervallsByDegreeOverlapping(2 * pi / nrIntervalls, angletracker)
+        :param nrIntervalls: number of sectors, must be a divisor of nrFineSectors
+        :param revolutions: list of the revolutions, whose samples are used, None or [] = all. The samples of the others
+        are treated as zeros, like zeroed time data
+        :param numGroups: number of block spectra, which are summed up at once
+        :return: array of shape (nrIntervalls, number of lines, numchannels, numchannels) with the normalized csms
+        """
+        if self.nrFineSectors % nrIntervalls:
+            raise ValueError(f"nrIntervalls={nrIntervalls} is no divisor of nrFineSectors={self.nrFineSectors}")
+        rows = arange(len(self.pieces))
+        if revolutions:
+            rows = rows[isin(self.pieces[:, 1], revolutions)]
+        blocks = self.pieces[rows, 0]
+        sectors = self.pieces[rows, 2] * nrIntervalls // self.nrFineSectors
+        order = lexsort((sectors, blocks))     # the pieces of a sector inside of a block are next to each other
+        rows, blocks, sectors = rows[order], blocks[order], sectors[order]
+        groupStarts = flatnonzero(concatenate(([True], (blocks[1:] != blocks[:-1]) | (sectors[1:] != sectors[:-1]))))
+        groupEnds = concatenate((groupStarts[1:], [len(rows)]))
+
+        nc = self.spectra.shape[2]
+        csms = zeros((nrIntervalls, self.spectra.shape[1], nc, nc), dtype=self.metadata['precision'])
+        for g in range(0, len(groupStarts), numGroups):
+            start, end = groupStarts[g], groupEnds[min(g + numGroups, len(groupStarts)) - 1]
+            # spectrum of every block for its sector = sum of the spectra of its pieces
+            blockSpectra = add.reduceat(self.spectra[rows[start:end]].astype(csms.dtype),
+                                        groupStarts[g:g + numGroups] - start, axis=0)
+            groupSectors = sectors[groupStarts[g:g + numGroups]]
+            for nr in unique(groupSectors):
+                addToCsm(csms[nr], blockSpectra[groupSectors == nr])
+        return csms * self.metadata['norm']
+
+
+def _fftBlocks(timeData, blockSize, posinc, labels):
+    """ yields (nr of the block, FFT block of timeData, labels of its samples) of all FFT blocks, like PowerSpectra """
+    bs = blockSize
+    temp = empty((2 * bs, timeData.numchannels))
+    tempLabels = zeros(2 * bs, dtype=labels.dtype)
+    pos = bs
+    count = 0   # number of samples which have been read so far
+    blockNr = 0
+    for data in timeData.result(bs):
+        ns = data.shape[0]
+        temp[bs:bs + ns] = data
+        tempLabels[bs:bs + ns] = labels[count:count + ns]
+        while pos + bs <= bs + ns:
+            yield blockNr, temp[pos:pos + bs], tempLabels[pos:pos + bs]
+            blockNr += 1
+            pos += posinc
+        temp[0:bs] = temp[bs:]
+        tempLabels[0:bs] = tempLabels[bs:]
+        pos -= bs
+        count += ns
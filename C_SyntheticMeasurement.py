@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Inside this script is writeSyntheticMeasurement defined, which writes simulated measurements like WriteH5Files.py: the
+microphone data of rotating and standing white noise sources and the trigger signal of the rotation. Any number of
+sources, rpm, jitter, duration and microphone geometry can be chosen. The data is calculated and written in chunks, so
+also recordings of several minutes with 64 channels need only a few MB of memory.
+"""
+from os import path
+
+import tables
+from acoular import MicGeom, __file__ as acoularFile
+from numpy import pi, sin, cos, floor, zeros, empty, arange, sqrt, clip, int64, concatenate, asarray, where, \
+    flatnonzero, maximum
+from numpy.random import default_rng
+
+#: the sources at the positions of WriteH5Files.py: two rotating sources and a standing one. Unlike there (rms=0), the
+#: standing source is audible, so that there is a standing source to be found in the maps
+DEFAULT_SOURCES = [{'r': 0.5, 'phi0': 0., 'z': 1., 'rms': 1., 'seed': 1},
+                   {'r': 0.5, 'phi0': pi, 'z': 1., 'rms': 1., 'seed': 2},
+                   {'loc': [0., 0.5, 1.], 'rms': 1., 'seed': 3}]
+
+
+def rotationAngle(t, rpm=-500., jitterRpm=1., jitterFreq=0.2):
+    """
+    :param t: times in s
+    :param rpm: mean revolutions per minute, negative = clockwise (like in WriteH5Files.py)
+    :param jitterRpm, jitterFreq: the rpm varies by +-jitterRpm with the frequency jitterFreq (in Hz)
+    :return: rotation angle at the times t in radians, 0 at t=0. Unlike in WriteH5Files.py, the jitter is
+    integrated, so it doesn't grow with the time
+    """
+    jitterPhase = jitterRpm / 60. / (2 * pi * jitterFreq) * (1 - cos(2 * pi * jitterFreq * t)) if jitterRpm else 0.
+    return 2 * pi * (rpm / 60. * t + jitterPhase)
+
+
+def rotationSpeed(t, rpm=-500., jitterRpm=1., jitterFreq=0.2):
+    """ :return: derivative of rotationAngle by the time in radians/s """
+    return 2 * pi / 60. * (rpm + jitterRpm * sin(2 * pi * jitterFreq * t))
+
+
+def triggerChunk(phi, amplitude=5.):
+    """
+    Trigger signal like in WriteH5Files.py: a pulse at the sample nearest to every time the angle passes pi (mod 2 pi),
+    where sin(phi) = 0 and cos(phi) < 0
+    :param phi: rotation angles of the samples start-1 ... end (one more sample at each side of the chunk)
+    :return: trigger signal of the samples start ... end-1
+    """
+    revolution = floor((phi - pi) / (2 * pi))
+    crossings = flatnonzero(revolution[1:] != revolution[:-1])     # between sample j and j+1 of phi
+    target = pi + 2 * pi * maximum(revolution[crossings], revolution[crossings + 1])
+    pulses = where(abs(phi[crossings] - target) <= abs(phi[crossings + 1] - target), crossings, crossings + 1)
+    trigger = zeros(len(phi))
+    trigger[pulses] = amplitude
+    return trigger[1:-1]
+
+
+class _NoiseSignal:
+    """ white noise signal of a source, which is generated step by step while it is read with increasing times """
+
+    def __init__(self, rms, seed, sampleFreq):
+        self.rms = rms
+        self.rng = default_rng(seed)
+        self.sampleFreq = sampleFreq
+        self.start = 0      # nr of the first sample in samples
+        self.samples = empty(0)
+
+    def values(self, times):
+        """
+        :param times: emission times in s. The smallest one must not be smaller than the smallest one of the last
+        call, samples before it are forgotten
+        :return: signal at the times, interpolated with cubic (Catmull-Rom) splines through the samples. 0 before the
+        time 0
+        """
+        pos = times * self.sampleFreq
+        first, last = int(floor(max(pos.min(), 0))) - 1, int(pos.max()) + 3
+        if last > self.start + len(self.samples):
+            newSamples = self.rng.standard_normal(last - self.start - len(self.samples)) * self.rms
+            self.samples = concatenate((self.samples, newSamples))
+        if first > self.start:
+            self.samples = self.samples[first - self.start:]
+            self.start = first
+        index = floor(pos).astype(int64)
+        w = pos - index
+        local = clip(index - self.start, 1, len(self.samples) - 3)
+        p0, p1, p2, p3 = (self.samples[local + k] for k in (-1, 0, 1, 2))
+        values = p1 + 0.5 * w * (p2 - p0 + w * (2 * p0 - 5 * p1 + 4 * p2 - p3 + w * (3 * (p1 - p2) + p3 - p0)))
+        return where(index >= 0, values, 0.)
+
+
+def _sourcePosition(source, phi):
+    """ :return: positions (3, *phi.shape) of a source at the rotation angles phi and their derivatives by phi """
+    if 'loc' in source:
+        loc = asarray(source['loc'], dtype=float).reshape((3,) + (1,) * phi.ndim)
+        return loc + 0 * phi, zeros((3,) + phi.shape)
+    angle = phi + source.get('phi0', 0.)
+    r, z = source['r'], source.get('z', 1.)
+    return (asarray([r * cos(angle), r * sin(angle), z + 0 * angle]),
+            asarray([-r * sin(angle), r * cos(angle), 0 * angle]))
+
+
+def micSignals(sources, mpos, t, signals, c=343., rpm=-500., jitterRpm=1., jitterFreq=0.2, step=16, iterations=3):
+    """
+    Calculates the microphone signals of the sources at the receiving times t. The emission time of every microphone
+    is found with Newton iterations (like in acoular.MovingPointSource), vectorized over all microphones, for every
+    step-th sample. The emission times and distances between them are interpolated linearly, they change so slowly
+    that the error is far below a sample.
+    :param sources: list of source dicts (see writeSyntheticMeasurement)
+    :param mpos: microphone positions, shape (3, number of mics)
+    :param t: receiving times in s, evenly spaced
+    :param signals: _NoiseSignal of every source
+    :param rpm, jitterRpm, jitterFreq: rotation of the rotating sources, see rotationAngle
+    :return: array (len(t), number of mics) with the sound pressure
+    """
+    dt = t[1] - t[0] if len(t) > 1 else 0.
+    coarse = t[0] + arange(len(t) // step + 2) * step * dt     # every step-th sample and one behind the last one
+    nr = arange(len(t))
+    left, weight = nr // step, (nr % step / step)[:, None]
+    out = zeros((len(t), mpos.shape[1]))
+    for source, signal in zip(sources, signals):
+        tm = coarse[:, None] + zeros(mpos.shape[1])
+        te = tm.copy()
+        for _ in range(iterations):
+            loc, dloc = _sourcePosition(source, rotationAngle(te, rpm, jitterRpm, jitterFreq))
+            rm = loc - mpos[:, None, :]
+            dist = sqrt((rm * rm).sum(0))
+            velocity = dloc * rotationSpeed(te, rpm, jitterRpm, jitterFreq)
+            mr = (rm * velocity).sum(0) / dist / c   # radial Mach number
+            te -= (te + dist / c - tm) / (1 + mr)
+        loc = _sourcePosition(source, rotationAngle(te, rpm, jitterRpm, jitterFreq))[0]
+        rm = loc - mpos[:, None, :]
+        amplitude = 1 / sqrt((rm * rm).sum(0))
+        teSamples = te[left] * (1 - weight) + te[left + 1] * weight
+        out += signal.values(teSamples) * (amplitude[left] * (1 - weight) + amplitude[left + 1] * weight)
+    return out
+
+
+def writeSyntheticMeasurement(name, triggerName=None, micgeofile=None, sources=DEFAULT_SOURCES, duration=2.,
+                              sampleFreq=51200., rpm=-500., jitterRpm=1., jitterFreq=0.2, c=343., trackerChannel=False,
+                              chunkSize=8192, complevel=0, complib='blosc'):
+    """
+    Writes a simulated measurement into h5 files, which can be read by acoular (TimeSamples) and the A_ scripts.
+    :param name: name of the h5 file with the microphone data
+    :param triggerName: name of the h5 file with the trigger signal, None = no separate trigger file
+    :param micgeofile: xml file of the microphone geometry, default tub_vogel64.xml of acoular (WriteH5Files.py uses
+    tub_vogel63.xml)
+    :param sources: list with a dict for every source. Rotating source: {'r': radius, 'phi0': start angle, 'z': z,
+    'rms': rms, 'seed': seed of the noise}. Standing source: {'loc': [x, y, z], 'rms': rms, 'seed': seed}
+    :param duration: length of the recording in s
+    :param rpm, jitterRpm, jitterFreq: rotation of the rotating sources, see rotationAngle
+    :param trackerChannel: if True, the trigger signal is stored as last channel of the microphone data (like in the
+    files in micData/Messdaten)
+    :param chunkSize: number of samples, which are calculated and written at once
+    :param complevel, complib: compression of the h5 files (see tables.Filters), complevel 0 = no compression
+    :return: (name of the microphone data, index of the tracker channel or None)
+    """
+    if micgeofile is None:
+        micgeofile = path.join(path.split(acoularFile)[0], 'xml', 'tub_vogel64.xml')
+    mpos = MicGeom(from_file=micgeofile).mpos
+    numsamples = int(duration * sampleFreq)
+    numMics = mpos.shape[1]
+    signals = [_NoiseSignal(source.get('rms', 1.), source.get('seed', nr), sampleFreq)
+               for nr, source in enumerate(sources)]
+
+    filters = tables.Filters(complevel=complevel, complib=complib) if complevel else None
+    files = []
+
+    def createData(fileName, numchannels):
+        h5 = tables.open_file(fileName, mode='w')
+        files.append(h5)
+        data = h5.create_earray('/', 'time_data', tables.Float32Atom(), (0, numchannels), filters=filters,
+                                expectedrows=numsamples, chunkshape=(max(1, min(chunkSize, 2 ** 20 // numchannels)),
+                                                                     numchannels))
+        data.attrs.sample_freq = sampleFreq
+        return data
+
+    try:
+        micData = createData(name, numMics + int(trackerChannel))
+        triggerData = createData(triggerName, 1) if triggerName else None
+        for start in range(0, numsamples, chunkSize):
+            end = min(start + chunkSize, numsamples)
+            t = arange(start, end) / sampleFreq
+            trigger = triggerChunk(rotationAngle(arange(start - 1, end + 1) / sampleFreq, rpm, jitterRpm, jitterFreq))
+            if start == 0:
+                trigger[0] = 0      # like in WriteH5Files.py
+            if end == numsamples:
+                trigger[-1] = 0
+            block = micSignals(sources, mpos, t, signals, c, rpm, jitterRpm, jitterFreq)
+            if trackerChannel:
+                block = concatenate((block, trigger[:, None]), axis=1)
+            micData.append(block.astype('float32'))
+            if triggerData is not None:
+                triggerData.append(trigger[:, None].astype('float32'))
+    finally:
+        for h5 in files:
+            h5.close()
+    return name, numMics if trackerChannel else None
+
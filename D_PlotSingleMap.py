@@ -11,8 +11,12 @@ from acoular import L_p, RectGrid
 from matplotlib.pylab import figure, imshow, colorbar, show
 from numpy import load
 
+from B_Acoular_Grids import SectorGrid
+from C_MapStack import MapStack, gridFromMetadata
+
 npyMapFolder = path.join(getcwd(), 'Maps')
 MapName = 'R_rpm500freq1500_notRotatedRot'
+mapNr = 0       # nr of the map, if MapName is a MapStack
 t = "R_rpm500"                     # title
 sectors = [[-0.165,-0.47,0.3]]     # R
 radius = 0.8
@@ -20,7 +24,15 @@ Z = 1
 inc = 0.01
 g = RectGrid(x_min=-radius, x_max=radius, y_min=-radius, y_max=radius, z=Z, increment=inc)
 fig = figure("plots")
-MapDB = L_p(load(path.join(npyMapFolder, MapName + ".npy")))
+if MapStack.exists(npyMapFolder, MapName):    # one map of a MapStack (e.g. from the A_ scripts), with its grid
+    mapStack = MapStack(npyMapFolder, MapName)
+    Map = mapStack[mapNr]
+    g = gridFromMetadata(mapStack.metadata)
+    if isinstance(g, SectorGrid):   # map of only the grid points inside of the sectors (sectorsOnly of the A_ scripts)
+        Map, g = g.fullMap(Map), g.grid
+else:
+    Map = load(path.join(npyMapFolder, MapName + ".npy"))
+MapDB = L_p(Map)
 averageMapDBmx = MapDB.max()
 print(f"averageMapDBmx = {averageMapDBmx} dB")
 DBRange = 30
@@ -14,11 +14,13 @@ import time as t
 from math import pi
 
 from acoular import config, PowerSpectra, SteeringVector, BeamformerBase, MicGeom, RectGrid, __file__, RotatingFlow, \
-    GeneralFlowEnvironment, MaskedTimeSamples
-from acoular.tprocess import Trigger, AngleTracker, SpatialInterpolatorRotation
+    MaskedTimeSamples
+from acoular.tprocess import Trigger, SpatialInterpolatorRotation
 
 from numpy import save, array
 
+from B_Acoular_Environments import CachedGeneralFlowEnvironment
+from B_Acoular_SourceAndTprocess import CachedAngleTracker
 
 
 # ------------------------------- Initialize and set variables -------------------------------
@@ -65,14 +67,14 @@ splittedMapName = h5savefileName[0:-3] + "freq" + str(int(freq)) + "_rotated"  #
 rotdata = SpatialInterpolatorRotation(mics=mg, method='linear', array_dimension='2D', interp_at_zero=False,
                                       source=microphonedata)
 
-angletracker = AngleTracker(trigger=trigger, source=rotdata)
+angletracker = CachedAngleTracker(trigger=trigger, source=rotdata)
 rotdata.angle_source = angletracker
 
 
 # ----- Rotating air, steering vector
 rotfield = RotatingFlow(rpm=int(angletracker.average_rpm), v0=0,
                         origin=array((0., 0., 0.)))
-envRot = GeneralFlowEnvironment(c=c0, N=1000, ff=rotfield, Om=12)
+envRot = CachedGeneralFlowEnvironment(c=c0, N=1000, ff=rotfield, Om=12)
 steerRot = SteeringVector(grid=g, mics=mg, env=envRot)
 
 # ------------------------------- Calculate -------------------------------
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Batch runner: calculates the maps of all jobs of a job list (TOML or YAML, see BatchJobs.toml) like
+A_FilterStandingSource.py, without plotting them. The jobs are run by a pool of worker processes, jobs with the same
+microphone geometry and grid share them (and the steering vector) inside of a worker. Jobs which are done already are
+skipped, interrupted ones are resumed (see C_BatchJobs.runJob). For every job, the integrated sound levels are stored
+in its done file in the map folder.
+
+    python G_BatchRunner.py BatchJobs.toml --workers 4
+"""
+from os import environ
+
+environ["QT_API"] = "pyqt5"
+# numbas tbb threading layer lets the script hang at its end, if worker processes were forked
+environ.setdefault("NUMBA_THREADING_LAYER", "workqueue")
+
+import argparse
+import sys
+import time as t
+
+from acoular import config
+
+from C_BatchJobs import loadJobs, runJobs
+from C_Instrumentation import enable, disable, loadEvents, summaryTable
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Calculates the maps of all jobs of a TOML/YAML job list")
+    parser.add_argument('jobFile', help="job list (.toml, .yaml or .yml)")
+    parser.add_argument('--workers', type=int, default=None, help="number of worker processes, default: number of cpus")
+    parser.add_argument('--force', action='store_true', help="calculate jobs again, which are done already")
+    parser.add_argument('--instrument', metavar='JSONL', help="file for the times and counters of the stages of all "
+                                                              "jobs (see C_Instrumentation)")
+    parser.add_argument('--profile', nargs='*', default=[], metavar='STAGE',
+                        help="stages which are run with cProfile, e.g. sector_csm")
+    args = parser.parse_args(argv)
+
+    config.global_caching = "none"
+    jobs = loadJobs(args.jobFile)
+    print(f"{len(jobs)} jobs in {args.jobFile}")
+    if args.instrument or args.profile:     # the forked workers write into the same file
+        enable(args.instrument, args.profile)
+    T = t.time()
+    try:
+        results = runJobs(jobs, args.workers, args.force)
+    finally:
+        disable()
+
+    print(f"\n{'job':40} {'status':8} {'time':>8}")
+    for result in results:
+        print(f"{result['name']:40} {result['status']:8} {format(result['time'], '.2f'):>8}s")
+    failed = [result for result in results if result['status'] == 'failed']
+    for result in failed:
+        print(f"\n\033[91m{result['name']} failed:\n{result['error']}\u001b[0m")
+    if args.instrument:
+        print("\n" + summaryTable(loadEvents(args.instrument, since=T)))
+    print(f"\033[92m all jobs time={format(t.time() - T, '.2f')}s \u001b[0m")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
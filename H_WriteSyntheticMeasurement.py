@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Writes a simulated measurement (see C_SyntheticMeasurement.writeSyntheticMeasurement), e.g. long recordings with many
+channels as input for load tests and benchmarks. Without sources, the ones of DEFAULT_SOURCES are used (the positions
+of WriteH5Files.py, but with an audible standing source).
+
+    python H_WriteSyntheticMeasurement.py micData/Simuliert/R_60s.h5 --trigger trigger_60s.h5 --duration 60
+    python H_WriteSyntheticMeasurement.py long.h5 --tracker-channel --rotating 0.5 0 1 1 --standing 0 0.5 1 1
+"""
+import argparse
+import sys
+import time as t
+from os import path
+
+from C_SyntheticMeasurement import writeSyntheticMeasurement, DEFAULT_SOURCES
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Writes a simulated measurement into h5 files")
+    parser.add_argument('name', help="h5 file for the microphone data")
+    parser.add_argument('--trigger', help="h5 file for the trigger signal (in the folder of name)")
+    parser.add_argument('--tracker-channel', action='store_true', help="store the trigger as last channel of name")
+    parser.add_argument('--micgeo', help="xml file of the microphone geometry, default tub_vogel64.xml of acoular")
+    parser.add_argument('--rotating', nargs=4, type=float, action='append', metavar=('R', 'PHI0', 'Z', 'RMS'),
+                        help="rotating source, can be given several times")
+    parser.add_argument('--standing', nargs=4, type=float, action='append', metavar=('X', 'Y', 'Z', 'RMS'),
+                        help="standing source, can be given several times")
+    parser.add_argument('--duration', type=float, default=2., help="length in s")
+    parser.add_argument('--sample-freq', type=float, default=51200.)
+    parser.add_argument('--rpm', type=float, default=-500., help="negative = clockwise")
+    parser.add_argument('--jitter-rpm', type=float, default=1.)
+    parser.add_argument('--jitter-freq', type=float, default=0.2)
+    parser.add_argument('--chunk-size', type=int, default=8192, help="samples calculated and written at once")
+    parser.add_argument('--complevel', type=int, default=0, help="compression level of the h5 files, 0 = none")
+    args = parser.parse_args(argv)
+
+    sources = [{'r': r, 'phi0': phi0, 'z': z, 'rms': rms} for r, phi0, z, rms in args.rotating or []] + \
+              [{'loc': [x, y, z], 'rms': rms} for x, y, z, rms in args.standing or []]
+    for seed, source in enumerate(sources):
+        source['seed'] = seed + 1
+    triggerName = path.join(path.dirname(args.name), args.trigger) if args.trigger else None
+    T = t.time()
+    writeSyntheticMeasurement(args.name, triggerName, args.micgeo, sources or DEFAULT_SOURCES, args.duration,
+                              args.sample_freq, args.rpm, args.jitter_rpm, args.jitter_freq,
+                              trackerChannel=args.tracker_channel, chunkSize=args.chunk_size,
+                              complevel=args.complevel)
+    print(f"\033[92m {args.name} written, time={format(t.time() - T, '.2f')}s \u001b[0m")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
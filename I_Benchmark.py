@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the processing chain (see C_Benchmark): every stage is timed on its own for a simulated measurement.
+Starting from a base case, the number of samples, the number of channels, the grid increment and nrIntervalls are
+changed one after another. The results are written as json and can be compared with a saved baseline, stages which
+got slower by more than the tolerance are listed and the exit code is 1 then.
+
+    python I_Benchmark.py --output Benchmark/new.json --baseline Benchmark/baseline.json
+    python I_Benchmark.py --samples 51200 204800 --channels 16 32 --inc 0.04 0.01 --nr-intervalls 4 20
+"""
+from os import path, getcwd, environ
+
+environ["QT_API"] = "pyqt5"
+environ.setdefault("NUMBA_THREADING_LAYER", "workqueue")
+
+import argparse
+import sys
+import time as t
+
+from acoular import config
+
+from C_Benchmark import BASE_CASE, DEFAULT_SETTINGS, STAGES, sweepCases, runBenchmark, saveResults, loadResults, \
+    compareToBaseline
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Times every stage of the processing chain for simulated data")
+    parser.add_argument('--samples', type=int, nargs='*', default=[51200, 204800],
+                        help=f"numbers of samples of the sweep, base case: {BASE_CASE['samples']}")
+    parser.add_argument('--channels', type=int, nargs='*', default=[16, 32],
+                        help=f"numbers of microphones (at most 64), base case: {BASE_CASE['channels']}")
+    parser.add_argument('--inc', type=float, nargs='*', default=[0.04, 0.01],
+                        help=f"grid increments in m, base case: {BASE_CASE['inc']}")
+    parser.add_argument('--nr-intervalls', type=int, nargs='*', default=[4, 20],
+                        help=f"numbers of angle sectors, base case: {BASE_CASE['nrIntervalls']}")
+    parser.add_argument('--repeat', type=int, default=1, help="runs of every case, the fastest one is used")
+    parser.add_argument('--flow', action='store_true', help="steering vector with the rotating flow environment")
+    parser.add_argument('--data-folder', default=path.join(getcwd(), 'micData', 'Benchmark'),
+                        help="folder of the simulated measurement, it is written only once")
+    parser.add_argument('--output', default=path.join(getcwd(), 'Benchmark', 'results.json'), help="json file")
+    parser.add_argument('--baseline', help="json file of an earlier run to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="relative change which counts as regression")
+    args = parser.parse_args(argv)
+
+    config.global_caching = "none"
+    cases = sweepCases({'samples': args.samples, 'channels': args.channels, 'inc': args.inc,
+                        'nrIntervalls': args.nr_intervalls})
+    settings = dict(DEFAULT_SETTINGS, flow=args.flow)
+    T = t.time()
+    results = runBenchmark(args.data_folder, cases, settings, args.repeat)
+    saveResults(results, args.output)
+
+    print(f"\n{'case':55} " + " ".join(f"{stage[:10]:>10}" for stage in STAGES) + f" {'total':>8}")
+    for result in results['results']:
+        print(f"{result['case']:55} " + " ".join(f"{result['wall'][stage]:10.3f}" for stage in STAGES) +
+              f" {result['total']:8.2f}")
+    print(f"\033[92m benchmark time={format(t.time() - T, '.2f')}s, results are saved in {args.output} \u001b[0m")
+
+    if not args.baseline:
+        return 0
+    rows = compareToBaseline(results, loadResults(args.baseline), args.tolerance)
+    changed = [row for row in rows if row['status'] in ('slower', 'faster')]
+    for row in changed:
+        color = "\033[91m" if row['status'] == 'slower' else "\033[92m"
+        print(f"{color}{row['status']:7} {row['case']:55} {row['stage']:22} {row['baseline']:8.3f}s -> "
+              f"{row['time']:8.3f}s ({format(row['ratio'], '.2f')}x)\u001b[0m")
+    slower = [row for row in changed if row['status'] == 'slower']
+    print(f"{len(slower)} of {len(rows)} stage times are slower than in {args.baseline} by more than "
+          f"{round(args.tolerance * 100)}%")
+    return 1 if slower else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Online analysis of a running measurement: the time data is read while it is recorded, from a growing h5 file or from a
+local socket, and the csms of the angle sectors are updated revolution by revolution (see C_OnlineSectors). Every
+--refresh revolutions, on SIGUSR1 and at the end, the maps of the sectors and the Average, Min and Standing maps are
+calculated from the csms so far and stored in the map folder, the levels of the integration sectors are printed.
+--simulate replays a recorded measurement (with the tracker channel, see H_WriteSyntheticMeasurement.py
+--tracker-channel) in the speed of the measurement as stand-in for the measurement system.
+
+    python J_OnlineStandingSource.py --h5 micData/run.h5 --refresh 10
+    python J_OnlineStandingSource.py --port 5555 --channels 65 --simulate micData/Simuliert/R_60s.h5 --keep 20
+"""
+from os import path, getcwd, environ, getpid
+
+environ["QT_API"] = "pyqt5"
+environ.setdefault("NUMBA_THREADING_LAYER", "workqueue")
+# the h5 file is read while the measurement system writes it
+environ.setdefault("HDF5_USE_FILE_LOCKING", "FALSE")
+
+import argparse
+import signal
+import sys
+import time as t
+from multiprocessing import Process
+
+import tables
+from acoular import config, SteeringVector, MicGeom, RectGrid, RotatingFlow, Environment, TimeSamples, \
+    SpatialInterpolatorRotation, __file__ as acoularFile
+from numpy import array, stack
+
+from B_Acoular_Environments import CachedGeneralFlowEnvironment
+from B_Acoular_Spectra import BandPowerSpectra
+from C_FilterFunctionality import bandLimits, integrateMaps, sectorIndices
+from C_Instrumentation import stage
+from C_OnlineSectors import OnlineSectorCsms, refreshMaps, h5Info, h5Chunks, socketChunks, appendChunks, sendChunks
+
+# set by SIGUSR1, the maps are refreshed after the next chunk then
+_refreshRequested = False
+
+
+def _requestRefresh(signum, frame):
+    global _refreshRequested
+    _refreshRequested = True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Updates the sector maps of a running measurement revolution by "
+                                                 "revolution")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--h5', help="h5 file, which is written by the measurement system")
+    source.add_argument('--port', type=int, help="local port, to which the samples are sent (float32, row by row)")
+    parser.add_argument('--channels', type=int, default=65, help="number of channels sent to the port")
+    parser.add_argument('--sample-freq', type=float, default=51200., help="sample frequency of the data of the port")
+    parser.add_argument('--tracker-channel', type=int, default=-1, help="channel of the trigger signal")
+    parser.add_argument('--threshold', type=float, default=4., help="threshold of the trigger pulses")
+    parser.add_argument('--micgeo', help="xml file of the microphone geometry, default tub_vogel64.xml of acoular")
+    parser.add_argument('--nr-intervalls', type=int, default=10, help="number of angle sectors")
+    parser.add_argument('--freqs', type=float, nargs='*', default=[1500.], help="frequencies of interest")
+    parser.add_argument('--bandwidth', type=int, default=3, help="0 = single frequency line, 3 = third octave band")
+    parser.add_argument('--block-size', type=int, default=1024)
+    parser.add_argument('--inc', type=float, default=0.01, help="grid increment in m")
+    parser.add_argument('--side', type=float, default=1.6, help="length of each side of the grid in m")
+    parser.add_argument('--z', type=float, default=0.991, help="distance between the array and the sources in m")
+    parser.add_argument('--sector', nargs=3, type=float, action='append', metavar=('X', 'Y', 'R'),
+                        help="integration sector, can be given several times. Default: 0 0.5 0.1")
+    parser.add_argument('--flow', action='store_true', help="steering vector with the rotating flow environment (with "
+                                                            "the rpm of the revolutions before the first refresh)")
+    parser.add_argument('--c0', type=float, default=343.)
+    parser.add_argument('--keep', type=int, default=0, help="only the last KEEP revolutions are used, 0 = all")
+    parser.add_argument('--refresh', type=int, default=10, help="maps are refreshed every REFRESH revolutions, "
+                                                                "0 = only on SIGUSR1 and at the end")
+    parser.add_argument('--min-sound-volume', type=float, default=10., help="see averageAndMinimum")
+    parser.add_argument('--map-folder', default=path.join(getcwd(), 'Maps'))
+    parser.add_argument('--name', default='online', help="first part of the names of the maps")
+    parser.add_argument('--chunk-size', type=int, default=8192, help="number of samples read at once")
+    parser.add_argument('--timeout', type=float, default=10., help="the h5 file is finished, if it doesn't grow for "
+                                                                   "that many seconds")
+    parser.add_argument('--simulate', metavar='H5', help="recorded measurement, which is replayed into the h5 file "
+                                                         "or sent to the port")
+    parser.add_argument('--speed', type=float, default=1., help="speed of the replay, 0 = as fast as possible")
+    args = parser.parse_args(argv)
+
+    config.global_caching = "none"
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, _requestRefresh)
+    replay = None
+    if args.simulate:   # the stand-in for the measurement system runs in its own process
+        if args.h5:
+            replay = Process(target=appendChunks, args=(args.simulate, args.h5, args.chunk_size, args.speed))
+        else:
+            replay = Process(target=sendChunks, args=(args.simulate, args.port, 'localhost', args.chunk_size,
+                                                      args.speed))
+        replay.start()
+
+    if args.h5:
+        T = t.time()
+        while True:     # waits for the measurement system to create the file
+            try:
+                sampleFreq, numchannels = h5Info(args.h5)
+                break
+            except (OSError, AttributeError, tables.HDF5ExtError):  # not created or written completely yet
+                if t.time() - T > args.timeout:
+                    raise
+                t.sleep(0.2)
+        chunks = h5Chunks(args.h5, args.chunk_size, timeout=args.timeout)
+    else:
+        sampleFreq, numchannels = args.sample_freq, args.channels
+        chunks = socketChunks(args.port, numchannels, chunkSize=args.chunk_size)
+
+    micgeofile = args.micgeo or path.join(path.split(acoularFile)[0], 'xml', 'tub_vogel64.xml')
+    mg = MicGeom(from_file=micgeofile)
+    if mg.num_mics != numchannels - 1:
+        raise ValueError(f"{mg.num_mics} microphones, but {numchannels - 1} channels without the tracker channel")
+    spectra = BandPowerSpectra(time_data=TimeSamples(sample_freq=sampleFreq, numchannels=mg.num_mics),
+                               window='Hanning', overlap='50%', block_size=args.block_size)
+    spectra.ind_low, spectra.ind_high = bandLimits(spectra.fftfreq(), args.freqs, args.bandwidth)
+    interpolator = SpatialInterpolatorRotation(mics=mg, method='linear', array_dimension='2D', interp_at_zero=False)
+    online = OnlineSectorCsms(spectra, interpolator, args.nr_intervalls, args.tracker_channel, args.threshold,
+                              keepRevolutions=args.keep)
+
+    half = args.side / 2
+    g = RectGrid(x_min=-half, x_max=half, y_min=-half, y_max=half, z=args.z, increment=args.inc)
+    sectors = args.sector or [[0, 0.5, 0.1]]
+    sectorInds = sectorIndices(g, sectors)
+    mapNames = [args.name + "freq" + str(round(f)) + "_nrInts" + str(args.nr_intervalls) + "_bnd" +
+                str(args.bandwidth) + "_" for f in args.freqs]
+    steer = None
+    print(f"pid {getpid()}: waiting for the data, kill -USR1 {getpid()} refreshes the maps")
+
+    def refresh():
+        nonlocal steer
+        if steer is None:   # the rpm of the flow is known after the first revolutions
+            if args.flow:
+                rotfield = RotatingFlow(rpm=int(online.averageRpm), v0=0, origin=array((0., 0., 0.)))
+                env = CachedGeneralFlowEnvironment(c=args.c0, N=1000, ff=rotfield, Om=12)
+            else:
+                env = Environment(c=args.c0)
+            steer = SteeringVector(grid=g, mics=mg, env=env)
+        T = t.time()
+        with stage('onlineRefresh', revolutions=online.numRevolutions):
+            results = refreshMaps(online, steer, args.freqs, args.bandwidth, args.map_folder, mapNames,
+                                  args.min_sound_volume)
+        print(f"\033[92m {online.numRevolutions} revolutions ({format(online.averageRpm, '.1f')} rpm), maps "
+              f"refreshed in {format(t.time() - T, '.2f')}s \u001b[0m")
+        for f, resultMaps in zip(args.freqs, results):
+            levels = integrateMaps(stack([resultMaps['Average'], resultMaps['Standing']]), sectorInds)
+            for sector, (average, standing) in zip(sectors, levels):
+                print(f"{round(f)}Hz sector {sector}: Average {format(average, '.2f')}dB, "
+                      f"Standing {format(standing, '.2f')}dB")
+
+    global _refreshRequested
+    lastRefresh = 0
+    T = t.time()
+    for chunk in chunks:
+        with stage('onlineUpdate'):
+            online.update(chunk)
+        due = args.refresh and online.numRevolutions - lastRefresh >= args.refresh
+        if (due or _refreshRequested) and online.numRevolutions:
+            refresh()
+            lastRefresh, _refreshRequested = online.numRevolutions, False
+    online.finish()
+    if replay is not None:
+        replay.join()
+    if not online.numRevolutions:
+        print("\033[91m No complete revolution, check --threshold and --tracker-channel \u001b[0m")
+        return 1
+    if online.numRevolutions > lastRefresh:
+        refresh()
+    print(f"\033[92m {online.numRevolutions} revolutions, time={format(t.time() - T, '.2f')}s, maps are saved in "
+          f"{args.map_folder} \u001b[0m")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())